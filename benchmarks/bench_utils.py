@@ -0,0 +1,54 @@
+"""Helpers shared by the benchmark scripts"""
+import json
+import random
+
+
+VOCABULARY_SIZE = 50000
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of a list of seconds, in milliseconds"""
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+    return {
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3)
+    }
+
+
+def zipf_weights(count, exponent=1.1):
+    """Cumulative Zipf weights for random.choices(cum_weights=...)"""
+    weights = [1 / (rank + 1) ** exponent for rank in range(count)]
+    total = sum(weights)
+    cumulative = []
+    running = 0.0
+    for weight in weights:
+        running += weight / total
+        cumulative.append(running)
+    return cumulative
+
+
+class Corpus:
+    """Zipf-distributed synthetic words"""
+
+    def __init__(self, seed=1):
+        self.random = random.Random(seed)
+        self.words = [f"w{i:05d}" for i in range(VOCABULARY_SIZE)]
+        self.cumulative = zipf_weights(VOCABULARY_SIZE)
+
+    def sentence(self, length):
+        return ' '.join(self.random.choices(self.words, cum_weights=self.cumulative, k=length))
+
+
+def write_report(report, output=None):
+    """Print a JSON report, or write it to output"""
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
@@ -0,0 +1,146 @@
+"""
+Benchmark knowledge-base queries at increasing corpus sizes.
+
+Writes a synthetic log of TTS interactions (Zipf-distributed vocabulary,
+like real text) for each size, then measures index build time, warm
+startup with the memory-mapped checkpoint, and query latency for rare,
+common and multi-term queries. For comparison, sizes up to --baseline-max
+also time a linear scan of the log, which is what every query cost before
+the inverted index.
+
+    python benchmarks/kb_query_bench.py --sizes 10000,100000,1000000
+
+Prints a JSON report (or writes it to --output).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'speech-agent'))
+
+from bench_utils import Corpus, percentiles, write_report  # noqa: E402
+from knowledge_base import KnowledgeBase  # noqa: E402
+from knowledge_log import AppendLog  # noqa: E402
+
+
+WRITE_BATCH = 5000
+
+
+def write_log(storage_dir, size, corpus):
+    """Append size interactions directly to the knowledge log"""
+    log = AppendLog(os.path.join(storage_dir, "log"))
+    batch = []
+    for i in range(size):
+        batch.append({"kind": "knowledge", "data": {
+            "type": "tts_request",
+            "id": f"{i:032x}",
+            "query": corpus.sentence(corpus.random.randint(8, 40)),
+            "response": "[Audio response generated]",
+            "timestamp": datetime.now().isoformat()
+        }})
+        if len(batch) >= WRITE_BATCH:
+            log.append(batch)
+            batch = []
+    log.append(batch)
+    return log
+
+
+def linear_scan(log, query_text, limit=10):
+    """Pre-index query cost: parse and substring-match every record"""
+    results = []
+    needle = query_text.lower()
+    for _, _, record in log.scan():
+        data = record.get('data', {})
+        if needle in data.get('query', '').lower():
+            results.append(data)
+    return results[:limit]
+
+
+def time_queries(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def run(size, args, corpus):
+    storage_dir = tempfile.mkdtemp(prefix=f"kb-bench-{size}-", dir=args.dir)
+    try:
+        start = time.perf_counter()
+        log = write_log(storage_dir, size, corpus)
+        write_seconds = time.perf_counter() - start
+
+        options = dict(storage_dir=storage_dir, async_writes=False, checkpoint_docs=args.checkpoint_docs)
+        start = time.perf_counter()
+        KnowledgeBase(**options)
+        build_seconds = time.perf_counter() - start
+
+        # A new worker maps the checkpoint instead of re-reading the log
+        start = time.perf_counter()
+        kb = KnowledgeBase(**options)
+        startup_seconds = time.perf_counter() - start
+
+        words = corpus.words
+        rng = random.Random(2)
+        queries = {
+            # Rank ~1000-50000: a handful to a few hundred matches
+            "rare": [rng.choice(words[1000:]) for _ in range(args.queries)],
+            # Top 20 words: matches a large fraction of the corpus
+            "common": [rng.choice(words[:20]) for _ in range(args.queries)],
+            "multi_term": [
+                ' '.join([rng.choice(words[:100]), rng.choice(words[100:5000]), rng.choice(words[5000:])])
+                for _ in range(args.queries)
+            ]
+        }
+        report = {
+            "interactions": size,
+            "log_bytes": log.size(),
+            "write_seconds": round(write_seconds, 3),
+            "index_build_seconds": round(build_seconds, 3),
+            "warm_startup_seconds": round(startup_seconds, 3),
+            "index_bytes": os.path.getsize(os.path.join(storage_dir, "index", "index.bin")),
+            "index": kb.index.stats(),
+            "query": {name: time_queries(kb.query, qs) for name, qs in queries.items()}
+        }
+        if size <= args.baseline_max:
+            sample = queries["rare"][:args.baseline_queries]
+            report["linear_scan"] = time_queries(lambda q: linear_scan(log, q), sample)
+        print(f"{size} interactions: {json.dumps(report['query'])}", file=sys.stderr)
+        return report
+    finally:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated corpus sizes")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="queries per query class")
+    parser.add_argument("--checkpoint-docs", type=int, default=10000)
+    parser.add_argument("--baseline-max", type=int, default=100000,
+                        help="largest size to also time the linear scan at")
+    parser.add_argument("--baseline-queries", type=int, default=5)
+    parser.add_argument("--dir", default=None, help="scratch directory")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+
+    # Silence per-record logging from the knowledge base
+    logging.getLogger().setLevel(logging.WARNING)
+
+    corpus = Corpus()
+    results = [run(int(size), args, corpus) for size in args.sizes.split(',')]
+    write_report({"results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Micro-benchmarks of the speech agent's hot paths at growing sizes.
+
+- get_cached_audio: hits and misses through each cache tier configuration
+  with --cache-sizes entries stored (Zipf-distributed lookups, so hits
+  include whatever the memory tier evicted).
+- KnowledgeBase.add_knowledge: synchronous appends and background
+  (wait=False) enqueues, with --kb-sizes interactions already in the log.
+- KnowledgeBase.query: keyword queries at the same sizes, and semantic and
+  hybrid queries with --semantic (every record is embedded first).
+
+    python benchmarks/micro_bench.py --cache-sizes 1000,10000 --kb-sizes 10000,100000
+
+Prints a JSON report (or writes it to --output).
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Scratch locations for the app's module-level cache and knowledge base;
+# set before anything imports the app
+SCRATCH_DIR = tempfile.mkdtemp(prefix="micro-bench-")
+os.environ.update({
+    "ENABLE_METRICS": "false",
+    "CACHE_DIR": os.path.join(SCRATCH_DIR, "app-cache"),
+    "KB_STORAGE_DIR": os.path.join(SCRATCH_DIR, "app-knowledge"),
+    "RUNPOD_API_ENDPOINT": "http://127.0.0.1:9/v2/unused/runsync"
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'speech-agent'))
+
+from bench_utils import Corpus, percentiles, write_report, zipf_weights  # noqa: E402
+from kb_query_bench import write_log  # noqa: E402
+
+import app as speech_agent  # noqa: E402
+from audio_cache import build_audio_cache  # noqa: E402
+from knowledge_base import KnowledgeBase  # noqa: E402
+from knowledge_vectors import HashingEmbedder, np  # noqa: E402
+
+
+CACHE_BACKENDS = ("memory", "disk", "memory,disk")
+
+
+def timed(fn, inputs):
+    samples = []
+    for value in inputs:
+        start = time.perf_counter()
+        fn(value)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_cache(backend, size, args, corpus):
+    cache_dir = tempfile.mkdtemp(prefix="cache-", dir=SCRATCH_DIR)
+    cache = build_audio_cache(backend, 3600, cache_dir=cache_dir, sweep_interval=3600)
+    speech_agent.audio_cache = cache
+    try:
+        texts = [f"{i} {corpus.sentence(8)}" for i in range(size)]
+        audio = os.urandom(args.audio_kb * 1024)
+        start = time.perf_counter()
+        for text in texts:
+            speech_agent.cache_audio(text, audio)
+        fill_seconds = time.perf_counter() - start
+
+        rng = random.Random(3)
+        lookups = rng.choices(texts, cum_weights=zipf_weights(size), k=args.lookups)
+        hits_before, misses_before = cache.hits, cache.misses
+        hit_samples = timed(speech_agent.get_cached_audio, lookups)
+        hit_rate = (cache.hits - hits_before) / ((cache.hits - hits_before) + (cache.misses - misses_before))
+        misses = [f"missing {i}" for i in range(args.lookups)]
+        miss_samples = timed(speech_agent.get_cached_audio, misses)
+        return {
+            "backend": backend,
+            "entries": size,
+            "fill_seconds": round(fill_seconds, 3),
+            "hit_rate": round(hit_rate, 4),
+            "lookup": percentiles(hit_samples),
+            "miss": percentiles(miss_samples),
+            "tiers": cache.stats().get('tiers')
+        }
+    finally:
+        cache.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def wait_for_vectors(kb, count, timeout=600):
+    deadline = time.monotonic() + timeout
+    while kb.vectors.stats()['vectors'] < count and time.monotonic() < deadline:
+        time.sleep(0.2)
+
+
+def make_entries(count, corpus):
+    return [
+        {"type": "note", "query": corpus.sentence(corpus.random.randint(4, 12)),
+         "response": corpus.sentence(corpus.random.randint(8, 40))}
+        for _ in range(count)
+    ]
+
+
+def bench_knowledge(size, args, corpus):
+    # Left in place until exit: the embedding thread can't be stopped
+    storage_dir = tempfile.mkdtemp(prefix=f"kb-{size}-", dir=SCRATCH_DIR)
+    write_log(storage_dir, size, corpus)
+    embedder = HashingEmbedder() if args.semantic else None
+    kb = KnowledgeBase(
+        storage_dir=storage_dir, async_writes=False,
+        checkpoint_docs=args.checkpoint_docs, embedder=embedder
+    )
+    entries = make_entries(args.operations, corpus)
+    report = {
+        "interactions": size,
+        "add_knowledge": percentiles(timed(kb.add_knowledge, entries))
+    }
+
+    background = KnowledgeBase(storage_dir=storage_dir, checkpoint_docs=args.checkpoint_docs)
+    entries = make_entries(args.operations, corpus)
+    report["add_knowledge_background"] = percentiles(
+        timed(lambda entry: background.add_knowledge(entry, wait=False), entries)
+    )
+    background.flush()
+
+    rng = random.Random(2)
+    queries = [
+        ' '.join([rng.choice(corpus.words[:100]), rng.choice(corpus.words[100:5000])])
+        for _ in range(args.operations)
+    ]
+    modes = ['keyword']
+    if kb.vectors is not None:
+        wait_for_vectors(kb, size + 2 * args.operations)
+        modes += ['semantic', 'hybrid']
+    report["query"] = {
+        mode: percentiles(timed(lambda q: kb.query(q, mode=mode), queries))
+        for mode in modes
+    }
+    print(f"{size} interactions: {report['query']}", file=sys.stderr)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cache-sizes", default="1000,10000",
+                        help="comma-separated numbers of cached entries")
+    parser.add_argument("--audio-kb", type=int, default=48,
+                        help="size of each cached entry (48KB is about a second of audio)")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--kb-sizes", default="1000,10000,100000",
+                        help="comma-separated knowledge log sizes")
+    parser.add_argument("--operations", type=int, default=200,
+                        help="adds and queries timed per size")
+    parser.add_argument("--checkpoint-docs", type=int, default=10000)
+    parser.add_argument("--semantic", action="store_true",
+                        help="also time semantic and hybrid queries")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+
+    # Silence per-lookup and per-record logging
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.semantic and np is None:
+        parser.error("--semantic requires numpy")
+
+    corpus = Corpus()
+    try:
+        report = {
+            "get_cached_audio": [
+                bench_cache(backend, int(size), args, corpus)
+                for size in args.cache_sizes.split(',') for backend in CACHE_BACKENDS
+            ],
+            "knowledge_base": [
+                bench_knowledge(int(size), args, corpus) for size in args.kb_sizes.split(',')
+            ]
+        }
+        write_report(report, args.output)
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
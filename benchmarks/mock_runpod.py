@@ -0,0 +1,432 @@
+"""
+Local stand-in for a RunPod serverless endpoint running the TTS handler.
+
+Implements the parts of the RunPod API the speech agent uses (/run,
+/runsync, /status, /stream, /cancel) and produces silent 24kHz 16-bit WAV
+audio in the same output format as runpod-tts-service/handler.py,
+including its timing ``meta`` and RunPod's delayTime/executionTime.
+
+Simulates a pool of workers: at most --workers jobs run at once (the rest
+wait IN_QUEUE), and a job that finds no warm idle worker pays --cold-start
+seconds first; workers go cold after --idle-timeout seconds unused. A
+fraction of jobs can fail (--error-rate) and a fraction of HTTP requests
+can be answered with 503 (--http-error-rate).
+
+    python benchmarks/mock_runpod.py --port 8089 --latency 0.5 --cold-start 8
+
+then point the speech agent at it:
+
+    RUNPOD_API_ENDPOINT=http://localhost:8089/v2/mock/runsync
+"""
+import argparse
+import base64
+import json
+import logging
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SAMPLE_RATE = 24000
+STREAMING_SIZE = 0xFFFFFFFF
+ROUTE = re.compile(r'^/v2/[^/]+/(run|runsync|health|(status|stream|cancel)/([\w-]+))$')
+
+
+def job_route(job_input):
+    """The voice and model the handler reports rendering a job with"""
+    return {"voice": job_input.get("voice") or "default", "model": job_input.get("model") or "mock"}
+
+
+def wav_header(data_size=STREAMING_SIZE):
+    """Mono 16-bit PCM WAV header, streaming-compatible by default"""
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+class MockJob:
+    """A simulated synthesis job"""
+
+    def __init__(self, job_input):
+        self.id = f"mock-{uuid.uuid4().hex}"
+        self.input = job_input
+        self.status = "IN_QUEUE"
+        self.stream = []
+        self.stream_sent = 0
+        self.output = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+
+class MockRunPod:
+    """Job store and synthesis simulator"""
+
+    def __init__(
+        self, latency=0.2, chunk_interval=0.05, seconds_per_char=0.06,
+        workers=0, cold_start=0.0, idle_timeout=60.0, error_rate=0.0,
+        http_error_rate=0.0, seed=None
+    ):
+        """workers=0 runs every job at once, starting workers as needed"""
+        self.latency = latency
+        self.chunk_interval = chunk_interval
+        self.seconds_per_char = seconds_per_char
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(workers) if workers else None
+        # Times at which each idle warm worker goes cold
+        self.warm_until = []
+        self.counters = {"jobs": 0, "cold_starts": 0, "failed": 0, "http_errors": 0}
+
+    def submit(self, job_input):
+        job = MockJob(job_input)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.counters["jobs"] += 1
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _chunks(self, text, speed=None):
+        """Silent PCM for roughly the duration the text would take to speak"""
+        total = int(len(text) * self.seconds_per_char / (speed or 1.0) * SAMPLE_RATE) * 2
+        chunk_size = SAMPLE_RATE // 5 * 2  # 200ms of audio per chunk
+        for offset in range(0, total, chunk_size):
+            yield b'\x00' * min(chunk_size, total - offset)
+
+    def fail_request(self):
+        """Whether to answer this HTTP request with a 503"""
+        with self.lock:
+            if self.random.random() >= self.http_error_rate:
+                return False
+            self.counters["http_errors"] += 1
+            return True
+
+    def _acquire_worker(self):
+        """Take a warm idle worker if there is one; returns whether it was cold"""
+        now = time.time()
+        with self.lock:
+            self.warm_until = [until for until in self.warm_until if until > now]
+            if self.warm_until:
+                self.warm_until.pop()
+                return False
+            self.counters["cold_starts"] += 1
+            return True
+
+    def _release_worker(self):
+        with self.lock:
+            self.warm_until.append(time.time() + self.idle_timeout)
+
+    def _run(self, job):
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            if job.status == "CANCELLED":
+                job.done.set()
+                return
+            cold = self._acquire_worker()
+            try:
+                job.status = "IN_PROGRESS"
+                if cold:
+                    time.sleep(self.cold_start)
+                job.started_at = time.time()
+                self._synthesize(job, cold)
+            finally:
+                self._release_worker()
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+            job.finished_at = time.time()
+
+    def _finish(self, job, output):
+        job.output = output
+        job.status = "COMPLETED"
+        job.done.set()
+
+    def _synthesize(self, job, cold):
+        if job.input.get("texts") is not None:
+            self._synthesize_batch(job, job.input["texts"], cold)
+            return
+        text = job.input.get("text")
+        if not text:
+            job.error = "Missing text field in input"
+            self._finish(job, [{"error": job.error}])
+            return
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.counters["failed"] += 1
+
+        start = time.time()
+        time.sleep(self.latency)
+        if failed:
+            # Handler errors are reported in the output of a completed job
+            job.error = "Audio generation failed: simulated error"
+            self._finish(job, [{"error": job.error}])
+            return
+        stream = bool(job.input.get("stream"))
+        audio = []
+        first_chunk = None
+        audio_bytes = 0
+        for i, chunk in enumerate(self._chunks(text, job.input.get("speed"))):
+            if job.status == "CANCELLED":
+                job.done.set()
+                return
+            if first_chunk is None:
+                first_chunk = time.time() - job.submitted_at
+            audio_bytes += len(chunk)
+            if stream:
+                if i == 0:
+                    chunk = wav_header() + chunk
+                with self.lock:
+                    job.stream.append({"output": {
+                        "chunk": base64.b64encode(chunk).decode('utf-8'),
+                        "seq": i
+                    }})
+                time.sleep(self.chunk_interval)
+            else:
+                audio.append(chunk)
+
+        synthesis = time.time() - start
+        duration = audio_bytes / (SAMPLE_RATE * 2)
+        meta = {
+            "processing_time_seconds": time.time() - start,
+            "first_chunk_seconds": first_chunk,
+            "queue_wait_seconds": 0.0,
+            "synthesis_seconds": synthesis,
+            "audio_duration_seconds": duration,
+            "real_time_factor": synthesis / duration if duration else None,
+            "batch_size": 1,
+            "audio_size_kb": audio_bytes / 1024,
+            "model_init_seconds": self.cold_start,
+            "cold_start": cold,
+            "stages": {"queue_wait": 0.0, "synthesis": synthesis},
+            **job_route(job.input)
+        }
+        if job.input.get("trace_id"):
+            meta["trace_id"] = job.input["trace_id"]
+        if stream:
+            with self.lock:
+                job.stream.append({"output": {"done": True, "format": "wav", "meta": meta}})
+            self._finish(job, [item["output"] for item in job.stream])
+        else:
+            data = b''.join(audio)
+            self._finish(job, [{
+                "audio": base64.b64encode(wav_header(len(data)) + data).decode('utf-8'),
+                "format": "wav",
+                "meta": meta
+            }])
+
+    def health(self):
+        now = time.time()
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if job.status == "IN_PROGRESS")
+            idle = sum(1 for until in self.warm_until if until > now)
+            return {"workers": {"idle": idle, "running": running}, "mock": dict(self.counters)}
+
+    def _synthesize_batch(self, job, texts, cold):
+        """Batch job: one result per text, like the handler's input.texts"""
+        start = time.time()
+        time.sleep(self.latency)
+        results = []
+        for text in texts:
+            with self.lock:
+                failed = self.random.random() < self.error_rate
+                if failed:
+                    self.counters["failed"] += 1
+            if failed or not text:
+                results.append({"error": "Audio generation failed: simulated error" if text else "Missing text"})
+                continue
+            data = b''.join(self._chunks(text, job.input.get("speed")))
+            results.append({
+                "audio": base64.b64encode(wav_header(len(data)) + data).decode('utf-8'),
+                "format": "wav",
+                "meta": {
+                    "processing_time_seconds": time.time() - start,
+                    "batch_size": len(texts),
+                    "audio_duration_seconds": len(data) / (SAMPLE_RATE * 2),
+                    "model_init_seconds": self.cold_start,
+                    "cold_start": cold,
+                    **job_route(job.input)
+                }
+            })
+        self._finish(job, [{"results": results}])
+
+    def _timing(self, job):
+        """RunPod's delayTime and executionTime (milliseconds)"""
+        timing = {}
+        if job.started_at is not None:
+            timing["delayTime"] = int((job.started_at - job.submitted_at) * 1000)
+            end = job.finished_at or time.time()
+            timing["executionTime"] = int((end - job.started_at) * 1000)
+        return timing
+
+    def status(self, job):
+        result = {"id": job.id, "status": job.status}
+        if job.status == "COMPLETED":
+            result["output"] = job.output
+            result.update(self._timing(job))
+        return result
+
+    def drain_stream(self, job):
+        with self.lock:
+            items = job.stream[job.stream_sent:]
+            job.stream_sent = len(job.stream)
+            status = job.status
+        # Only report completion once every item has been handed out
+        if status == "COMPLETED" and job.stream_sent < len(job.stream):
+            status = "IN_PROGRESS"
+        result = {"id": job.id, "status": status, "stream": items}
+        if status == "COMPLETED":
+            result.update(self._timing(job))
+        return result
+
+
+def make_handler(backend, sync_wait):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _route(self):
+            match = ROUTE.match(self.path.split('?')[0])
+            if not match:
+                self._send(404, {"error": "Not found"})
+                return None, None
+            operation = match.group(2) or match.group(1)
+            return operation, match.group(3)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            operation, job_id = self._route()
+            if operation is not None and backend.fail_request():
+                self._send(503, {"error": "Simulated outage"})
+                return
+            if operation in ("run", "runsync"):
+                job = backend.submit(body.get("input", {}))
+                if operation == "runsync":
+                    job.done.wait(sync_wait)
+                    self._send(200, backend.status(job))
+                else:
+                    self._send(200, {"id": job.id, "status": job.status})
+            elif operation == "cancel":
+                job = backend.get(job_id)
+                if job is None:
+                    self._send(404, {"error": "Job not found"})
+                    return
+                if job.status != "COMPLETED":
+                    job.status = "CANCELLED"
+                self._send(200, {"id": job.id, "status": job.status})
+            elif operation is not None:
+                self._send(405, {"error": "Method not allowed"})
+
+        def do_GET(self):
+            operation, job_id = self._route()
+            if operation not in (None, "health") and backend.fail_request():
+                self._send(503, {"error": "Simulated outage"})
+                return
+            if operation == "health":
+                self._send(200, backend.health())
+                return
+            if operation not in ("status", "stream"):
+                if operation is not None:
+                    self._send(405, {"error": "Method not allowed"})
+                return
+            job = backend.get(job_id)
+            if job is None:
+                self._send(404, {"error": "Job not found"})
+            elif operation == "status":
+                self._send(200, backend.status(job))
+            else:
+                self._send(200, backend.drain_stream(job))
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8089, sync_wait=90, **backend_options):
+    """Create a server; call serve_forever() on it (or run it in a thread)"""
+    backend = MockRunPod(**backend_options)
+    server = ThreadingHTTPServer((host, port), make_handler(backend, sync_wait))
+    server.daemon_threads = True
+    server.backend = backend
+    return server
+
+
+def add_backend_arguments(parser):
+    """Worker pool and failure options, shared with the load generator"""
+    parser.add_argument("--workers", type=int, default=0,
+                        help="concurrent jobs (0: unlimited)")
+    parser.add_argument("--cold-start", type=float, default=0.0,
+                        help="seconds a job waits when no warm worker is idle")
+    parser.add_argument("--idle-timeout", type=float, default=60.0,
+                        help="seconds an idle worker stays warm")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of jobs that fail")
+    parser.add_argument("--http-error-rate", type=float, default=0.0,
+                        help="fraction of API requests answered with 503")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def backend_options(args):
+    return {
+        "workers": args.workers,
+        "cold_start": args.cold_start,
+        "idle_timeout": args.idle_timeout,
+        "error_rate": args.error_rate,
+        "http_error_rate": args.http_error_rate,
+        "seed": args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="seconds before the first chunk is produced")
+    parser.add_argument("--chunk-interval", type=float, default=0.05,
+                        help="seconds between streamed chunks")
+    parser.add_argument("--sync-wait", type=float, default=90,
+                        help="seconds /runsync waits before returning IN_PROGRESS")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = serve(
+        args.host, args.port, sync_wait=args.sync_wait,
+        latency=args.latency, chunk_interval=args.chunk_interval,
+        **backend_options(args)
+    )
+    logging.info(f"Mock RunPod listening on http://{args.host}:{args.port}/v2/mock/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Load-test /tts with a realistic mix of repeated and new texts.
+
+Texts are drawn from a fixed pool with Zipf-distributed popularity, so a
+few phrases recur constantly and most are rare, and their lengths vary
+from a few words to several sentences (long texts are split into segments
+by the server). A closed loop of --concurrency clients sends --requests
+requests, streaming or buffered.
+
+Without --url the whole stack runs in this process, offline: the mock
+RunPod backend (with its cold-start, worker-pool and error options) and
+the Flask app on a local werkzeug server, with a scratch cache and
+knowledge base.
+
+    python benchmarks/tts_load.py --requests 2000 --concurrency 16 --cold-start 5
+    python benchmarks/tts_load.py --url http://localhost:8000
+
+Prints a JSON report (or writes it to --output): latency and time to first
+byte percentiles, throughput, errors by status, and the cache hit rate
+over the run (from /cache/stats).
+"""
+import argparse
+import logging
+import math
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench_utils import Corpus, percentiles, write_report, zipf_weights
+from mock_runpod import add_backend_arguments, backend_options, serve
+
+SPEECH_AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'speech-agent')
+
+
+class TextPool:
+    """Distinct texts of varied length with Zipf-distributed popularity"""
+
+    def __init__(self, distinct, zipf_s, median_words, seed=1):
+        corpus = Corpus(seed)
+        self.random = corpus.random
+        self.texts = []
+        for _ in range(distinct):
+            # Log-normal lengths: mostly short prompts, some paragraphs
+            words = max(2, min(400, int(self.random.lognormvariate(math.log(median_words), 0.9))))
+            sentences = []
+            while words > 0:
+                length = min(words, self.random.randint(6, 18))
+                sentences.append(corpus.sentence(length).capitalize() + '.')
+                words -= length
+            self.texts.append(' '.join(sentences))
+        self.cumulative = zipf_weights(distinct, zipf_s)
+
+    def sample(self, count):
+        return self.random.choices(self.texts, cum_weights=self.cumulative, k=count)
+
+
+def start_stack(args, scratch_dir):
+    """Run the mock RunPod backend and the app in this process; returns the app's URL"""
+    mock = serve("127.0.0.1", 0, latency=args.latency, chunk_interval=args.chunk_interval,
+                 **backend_options(args))
+    threading.Thread(target=mock.serve_forever, name="mock-runpod", daemon=True).start()
+    mock_port = mock.server_address[1]
+
+    os.environ.update({
+        "RUNPOD_API_ENDPOINT": f"http://127.0.0.1:{mock_port}/v2/mock/runsync",
+        "RUNPOD_API_KEY": "bench",
+        "CACHE_DIR": os.path.join(scratch_dir, "cache"),
+        "KB_STORAGE_DIR": os.path.join(scratch_dir, "knowledge"),
+        "ENABLE_METRICS": "false"
+    })
+    sys.path.insert(0, SPEECH_AGENT_DIR)
+    from werkzeug.serving import make_server
+    import app as speech_agent
+
+    # Silence the app's per-request logging
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, speech_agent.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="speech-agent", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", mock
+
+
+def cache_counters(url):
+    try:
+        stats = requests.get(f"{url}/cache/stats", timeout=10).json()
+        return stats.get('hits', 0), stats.get('misses', 0)
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def send(session, url, text, stream, timeout):
+    """One /tts request; returns (status, seconds to first byte, seconds, bytes)"""
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    try:
+        with session.post(f"{url}/tts", json={"text": text, "stream": stream},
+                          stream=True, timeout=timeout) as response:
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk and first_byte is None:
+                    first_byte = time.perf_counter() - start
+                size += len(chunk)
+            status = response.status_code
+    except requests.RequestException:
+        status = 'connection_error'
+    return status, first_byte, time.perf_counter() - start, size
+
+
+def run_load(url, texts, args):
+    work = queue.Queue()
+    for text in texts:
+        work.put(text)
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            try:
+                text = work.get_nowait()
+            except queue.Empty:
+                return
+            result = send(session, url, text, args.stream, args.timeout)
+            with lock:
+                results.append((text, result))
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed, texts):
+    statuses = {}
+    for _, (status, _, _, _) in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [result for _, result in results if result[0] == 200]
+    seen = set()
+    repeats = 0
+    for text in texts:
+        repeats += text in seen
+        seen.add(text)
+    report = {
+        "requests": len(results),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "statuses": statuses,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else None,
+        "repeat_rate": round(repeats / len(texts), 4) if texts else None,
+        "audio_bytes": sum(size for _, _, _, size in ok)
+    }
+    if ok:
+        report["latency"] = percentiles([seconds for _, _, seconds, _ in ok])
+        first_bytes = [first for _, first, _, _ in ok if first is not None]
+        if first_bytes:
+            report["time_to_first_byte"] = percentiles(first_bytes)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=None,
+                        help="speech agent to test (default: run one in-process against the mock)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="requests sent first and left out of the report")
+    parser.add_argument("--stream", action="store_true", help="request streamed audio")
+    parser.add_argument("--distinct", type=int, default=500, help="distinct texts in the pool")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of text popularity")
+    parser.add_argument("--median-words", type=int, default=12)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    mock = parser.add_argument_group("in-process mock RunPod")
+    mock.add_argument("--latency", type=float, default=0.2)
+    mock.add_argument("--chunk-interval", type=float, default=0.05)
+    add_backend_arguments(mock)
+    parser.set_defaults(seed=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    pool = TextPool(args.distinct, args.zipf, args.median_words, args.seed)
+    warmup = pool.sample(args.warmup)
+    texts = pool.sample(args.requests)
+
+    scratch_dir = None
+    mock_server = None
+    url = args.url
+    if url is None:
+        scratch_dir = tempfile.mkdtemp(prefix="tts-load-")
+        url, mock_server = start_stack(args, scratch_dir)
+    try:
+        if warmup:
+            run_load(url, warmup, args)
+        before = cache_counters(url)
+        results, elapsed = run_load(url, texts, args)
+        after = cache_counters(url)
+
+        report = summarize(results, elapsed, texts)
+        if before and after:
+            hits, misses = after[0] - before[0], after[1] - before[1]
+            # Per segment lookup; a long text is several lookups
+            report["cache"] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None
+            }
+        if mock_server is not None:
+            report["mock_runpod"] = mock_server.backend.health()["mock"]
+        report["config"] = {
+            key: value for key, value in vars(args).items() if key not in ("output",)
+        }
+        report["config"]["url"] = args.url or "in-process"
+    finally:
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Output formats for the worker.
+
+Jobs choose their encoding with ``input.format`` (wav, pcm, opus, mp3 or
+flac) plus optional ``input.sample_rate`` and ``input.bit_depth``. WAV and
+PCM at the model's layout need no conversion; everything else is encoded by
+an ffmpeg subprocess fed chunk by chunk, so streamed jobs emit compressed
+audio as it is synthesized and the base64 payload shrinks accordingly.
+
+speech-agent/audio_formats.py is the web server's copy of the encoder.
+"""
+import shutil
+import struct
+import subprocess
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+
+FFMPEG = shutil.which('ffmpeg')
+
+MEDIA_TYPES = {
+    'wav': 'audio/wav',
+    'pcm': 'audio/L16',
+    'opus': 'audio/ogg; codecs=opus',
+    'mp3': 'audio/mpeg',
+    'flac': 'audio/flac'
+}
+FORMAT_ALIASES = {'wave': 'wav', 'l16': 'pcm', 'raw': 'pcm', 'ogg': 'opus'}
+
+SAMPLE_RATES = (8000, 12000, 16000, 22050, 24000, 44100, 48000)
+BIT_DEPTHS = {'wav': (8, 16, 24, 32), 'pcm': (8, 16, 24, 32), 'flac': (16, 24)}
+
+# ffmpeg raw sample formats by bytes per sample (8-bit PCM is unsigned)
+RAW_FORMATS = {1: 'u8', 2: 's16le', 3: 's24le', 4: 's32le'}
+CODEC_ARGS = {
+    'opus': ['-c:a', 'libopus', '-b:a', '32k', '-f', 'ogg'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3'],
+    'flac': ['-c:a', 'flac', '-f', 'flac']
+}
+
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+class FormatError(ValueError):
+    """The requested output format can't be produced"""
+
+
+class OutputFormat(NamedTuple):
+    """Encoding of a job's audio; None keeps the model's rate/bit depth"""
+    name: str = 'wav'
+    sample_rate: Optional[int] = None
+    bit_depth: Optional[int] = None
+
+    @property
+    def is_default(self) -> bool:
+        return self == OutputFormat()
+
+    @property
+    def media_type(self) -> str:
+        if self.name != 'pcm':
+            return MEDIA_TYPES[self.name]
+        media_type = f"audio/L{self.bit_depth or 16}"
+        if self.sample_rate:
+            media_type += f";rate={self.sample_rate}"
+        return media_type
+
+
+def output_format(job_input) -> OutputFormat:
+    """Read and validate the output format options of a job"""
+    name = str(job_input.get("format") or 'wav').lower()
+    name = FORMAT_ALIASES.get(name, name)
+    if name not in MEDIA_TYPES:
+        raise FormatError(
+            f"Unsupported format. Supported: {', '.join(MEDIA_TYPES)}"
+        )
+    try:
+        sample_rate = int(job_input["sample_rate"]) if job_input.get("sample_rate") else None
+        bit_depth = int(job_input["bit_depth"]) if job_input.get("bit_depth") else None
+    except (TypeError, ValueError):
+        raise FormatError("sample_rate and bit_depth must be integers")
+    if sample_rate is not None and sample_rate not in SAMPLE_RATES:
+        raise FormatError(f"Unsupported sample rate {sample_rate}")
+    if bit_depth is not None and bit_depth not in BIT_DEPTHS.get(name, ()):
+        raise FormatError(f"Unsupported bit depth {bit_depth} for {name}")
+
+    needs_ffmpeg = name not in ('wav', 'pcm') or sample_rate or bit_depth not in (None, 16)
+    if needs_ffmpeg and not FFMPEG:
+        raise FormatError(f"Format {name} is not available on this worker")
+    return OutputFormat(name, sample_rate, bit_depth)
+
+
+def _wav_header(channels, sample_rate, sample_width, data_size=STREAMING_SIZE):
+    """PCM WAV header, streaming-compatible by default"""
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack(
+            '<IHHIIHH', 16, 1, channels, sample_rate,
+            sample_rate * channels * sample_width, channels * sample_width,
+            sample_width * 8
+        )
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+def _parse_header(data: bytes) -> Optional[Tuple[Tuple[int, int, int], int]]:
+    """
+    Return ((channels, sample_rate, sample_width), data offset) for a WAV
+    stream, or None until the whole header has arrived
+    """
+    if len(data) < 12:
+        return None
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise FormatError("Model output is not WAV")
+    layout = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ' and offset + 24 <= len(data):
+            channels, sample_rate = struct.unpack('<HI', data[offset + 10:offset + 16])
+            bits = struct.unpack('<H', data[offset + 22:offset + 24])[0]
+            layout = (channels, sample_rate, bits // 8)
+        elif chunk_id == b'data':
+            return (layout, offset + 8) if layout else None
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+class AudioEncoder:
+    """
+    Incrementally convert the model's WAV stream to an OutputFormat.
+
+    ``feed`` returns whatever output is ready and ``finish`` flushes the
+    rest. ffmpeg's output is drained by a reader thread so writes never
+    deadlock on a full pipe.
+    """
+
+    def __init__(self, fmt: OutputFormat):
+        self.fmt = fmt
+        self.layout = None
+        self._head = b''
+        self._passthrough = False
+        self._process = None
+        self._reader = None
+        self._output = bytearray()
+        self._lock = threading.Lock()
+
+    def _start(self, source) -> bytes:
+        fmt = self.fmt
+        channels, sample_rate, sample_width = source
+        if fmt.name in ('wav', 'pcm'):
+            sample_width = (fmt.bit_depth or 16) // 8
+        self.layout = (channels, fmt.sample_rate or sample_rate, sample_width)
+        if fmt.name in ('wav', 'pcm') and self.layout == source:
+            self._passthrough = True
+            return b''
+
+        args = [
+            FFMPEG, '-hide_banner', '-loglevel', 'error',
+            '-f', RAW_FORMATS[source[2]], '-ar', str(source[1]),
+            '-ac', str(channels), '-i', 'pipe:0', '-ar', str(self.layout[1])
+        ]
+        if fmt.name in ('wav', 'pcm'):
+            raw = RAW_FORMATS[sample_width]
+            args += ['-c:a', 'pcm_' + raw, '-f', raw]
+        else:
+            args += CODEC_ARGS[fmt.name]
+            if fmt.name == 'flac' and fmt.bit_depth == 24:
+                args += ['-sample_fmt', 's32', '-bits_per_raw_sample', '24']
+        args.append('pipe:1')
+
+        self._process = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self._reader = threading.Thread(target=self._drain, daemon=True)
+        self._reader.start()
+        return _wav_header(*self.layout) if fmt.name == 'wav' else b''
+
+    def _drain(self) -> None:
+        while True:
+            data = self._process.stdout.read1(65536)
+            if not data:
+                return
+            with self._lock:
+                self._output += data
+
+    def _take(self) -> bytes:
+        with self._lock:
+            data = bytes(self._output)
+            self._output.clear()
+        return data
+
+    def _convert(self, pcm: bytes) -> bytes:
+        if self._passthrough:
+            return pcm
+        if pcm:
+            self._process.stdin.write(pcm)
+            self._process.stdin.flush()
+        return self._take()
+
+    def feed(self, data: bytes) -> bytes:
+        """Add the next piece of the WAV stream; returns encoded output"""
+        if self.layout is not None:
+            return self._convert(data)
+
+        self._head += data
+        parsed = _parse_header(self._head)
+        if parsed is None:
+            return b''
+        source, offset = parsed
+        head, self._head = self._head, b''
+        prefix = self._start(source)
+        if self._passthrough and self.fmt.name == 'wav':
+            return head
+        return prefix + self._convert(head[offset:])
+
+    def finish(self) -> bytes:
+        """Flush the encoder and return the remaining output"""
+        if self._process is None:
+            return b''
+        self._process.stdin.close()
+        self._reader.join()
+        error = self._process.stderr.read().decode(errors='replace').strip()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {error}")
+        return self._take()
+
+    def close(self) -> None:
+        """Abort encoding"""
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+    def sized_wav(self, data: bytes) -> bytes:
+        """Replace the streaming header of complete WAV output with a sized one"""
+        if self.fmt.name != 'wav' or self.layout is None:
+            return data
+        parsed = _parse_header(data)
+        if parsed is None:
+            return data
+        pcm = data[parsed[1]:]
+        return _wav_header(*self.layout, data_size=len(pcm)) + pcm
+
+
+def encode_audio(wav: bytes, fmt: OutputFormat) -> bytes:
+    """Convert a complete WAV blob"""
+    encoder = AudioEncoder(fmt)
+    try:
+        return encoder.sized_wav(encoder.feed(wav) + encoder.finish())
+    finally:
+        encoder.close()
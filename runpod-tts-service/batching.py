@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+class BatchItem:
+    """
+    One text submitted to the scheduler.
+
+    Audio chunks are delivered as the model produces them and can be
+    consumed with a plain ``for`` loop (blocking) or ``async for``.
+    """
+
+    def __init__(self, text, options: Optional[Dict[str, Any]] = None):
+        self.text = text
+        self.options = options or {}
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.batch_size = 0
+        self._chunks = deque()
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _notify(self) -> None:
+        # Caller holds the condition
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def put(self, chunk: bytes) -> None:
+        with self._cond:
+            if self.first_chunk_at is None:
+                self.first_chunk_at = time.time()
+            self._chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self._done = True
+            self._error = error
+            self.finished_at = time.time()
+            self._notify()
+
+    def _take(self):
+        """Pop every available chunk along with the completion state"""
+        with self._cond:
+            chunks = list(self._chunks)
+            self._chunks.clear()
+            return chunks, self._done, self._error
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                while not self._chunks and not self._done:
+                    self._cond.wait()
+            chunks, done, error = self._take()
+            yield from chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            waiter = (loop, event)
+            with self._cond:
+                self._waiters.append(waiter)
+            chunks, done, error = self._take()
+            if not chunks and not done:
+                await event.wait()
+            with self._cond:
+                self._waiters.remove(waiter)
+            for chunk in chunks:
+                yield chunk
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of the TTS model.
+
+    Texts submitted from concurrent jobs (or several texts from one batch
+    job) are gathered for up to ``max_wait`` seconds, or until
+    ``max_batch_size`` are waiting, and run through the model together on
+    a single thread that owns the GPU.
+
+    Models that implement ``stream_batch(texts)``, yielding
+    ``(index, chunk)`` pairs, synthesize a whole batch in one pass.
+    Otherwise the batch is run item by item through ``stream(text)``, which
+    still saves the per-job scheduling overhead. Any object with a
+    ``stream`` method works, so the scheduler runs on CPU with a fake model.
+
+    Items may carry synthesis options (a voice preset's speaker, speed...),
+    passed to the model as keyword arguments; only items with the same
+    options share a model call.
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_wait: float = 0.01):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[BatchItem]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._loop, name="tts-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, text, options: Optional[Dict[str, Any]] = None) -> BatchItem:
+        """Queue a text for synthesis"""
+        item = BatchItem(text, options)
+        self._queue.put(item)
+        return item
+
+    def submit_many(self, texts: List, options: Optional[Dict[str, Any]] = None) -> List[BatchItem]:
+        """Queue several texts; they are eligible for the same batch"""
+        return [self.submit(text, options) for text in texts]
+
+    def close(self) -> None:
+        """Stop the scheduler thread once the items already queued are done"""
+        self._queue.put(None)
+
+    def _gather(self) -> List[BatchItem]:
+        """Block for one item, then collect more until the window closes"""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Closed: run what was gathered, then stop at the next gather
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._gather()
+            if not batch:
+                return
+            started = time.time()
+            for item in batch:
+                item.started_at = started
+                item.batch_size = len(batch)
+            try:
+                self._run(batch)
+            except Exception as e:
+                logging.error(f"Batch of {len(batch)} failed: {e}")
+                logging.error(traceback.format_exc())
+                for item in batch:
+                    if not item.done:
+                        item.finish(e)
+
+    def _run(self, batch: List[BatchItem]) -> None:
+        groups: Dict[str, List[BatchItem]] = {}
+        for item in batch:
+            groups.setdefault(repr(sorted(item.options.items())), []).append(item)
+        for group in groups.values():
+            self._run_group(group, group[0].options)
+
+    def _run_group(self, batch: List[BatchItem], options: Dict[str, Any]) -> None:
+        if len(batch) > 1 and hasattr(self.model, "stream_batch"):
+            for index, chunk in self.model.stream_batch([item.text for item in batch], **options):
+                if chunk:
+                    batch[index].put(chunk)
+            for item in batch:
+                item.finish()
+            return
+
+        for item in batch:
+            # Without batch inference each text waits for the ones before it
+            item.started_at = time.time()
+            try:
+                for chunk in self.model.stream(item.text, **options):
+                    if chunk:
+                        item.put(chunk)
+                item.finish()
+            except Exception as e:
+                # One bad text shouldn't fail the rest of the batch
+                logging.error(f"Synthesis failed: {e}")
+                logging.error(traceback.format_exc())
+                item.finish(e)
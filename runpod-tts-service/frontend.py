@@ -0,0 +1,70 @@
+"""
+Text front-end: what the model is given for a text and voice.
+
+Each text is normalized (see text_normalization.py) and, for models that
+implement ``encode_prompt(text, voice)``, turned into prompt tokens. Models
+implementing it must accept its output in ``stream`` and ``stream_batch``
+in place of the text; other models are given the normalized text.
+
+Both steps are pure functions of the text and voice and are repeated for
+the same phrases thousands of times, so their results are kept in a
+bounded LRU keyed by (voice, text).
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple
+
+from text_normalization import normalize_text
+
+
+class Prepared(NamedTuple):
+    """A text ready for synthesis"""
+    text: str    # normalized text
+    prompt: Any  # what the model synthesizes: prompt tokens, or the normalized text
+
+
+class FrontEnd:
+    """Normalization and prompt encoding, memoized per voice"""
+
+    def __init__(self, model=None, max_entries: int = 10000, normalize: bool = True):
+        self.model = model
+        self.max_entries = max_entries
+        self.normalize = normalize
+        self._entries: "OrderedDict[tuple, Prepared]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, text: str, voice: str) -> Prepared:
+        key = (voice, text)
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared
+            self.misses += 1
+
+        normalized = normalize_text(text) if self.normalize else text
+        if normalized != text:
+            logging.debug(f"Normalized {text!r} to {normalized!r}")
+        encode = getattr(self.model, 'encode_prompt', None)
+        prepared = Prepared(normalized, encode(normalized, voice) if encode else normalized)
+
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = prepared
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return prepared
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
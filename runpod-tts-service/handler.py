@@ -1,7 +1,14 @@
-import runpod
-from realtime_tts import RealTimeTTS
+from batching import BatchScheduler
+from frontend import FrontEnd
+from audio_formats import AudioEncoder, FormatError, encode_audio, output_format
+from registry import ModelRegistry, load_voices
+from startup import model_bytes, release_memory, start_model
+from typing import NamedTuple
+import asyncio
 import base64
 import logging
+import os
+import struct
 import time
 import traceback
 
@@ -11,97 +18,506 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Initialize model
-try:
-    logging.info("Initializing TTS model...")
+# Model and startup configuration (see startup.py)
+TTS_MODEL = os.getenv('TTS_MODEL', 'canopylabs/orpheus-3b-0.1-pretrained')
+# "auto" (CUDA if available), "cuda", "cuda:N" or "cpu"; falls back to CPU
+TTS_DEVICE = os.getenv('TTS_DEVICE', 'auto')
+# Baked model snapshots, one directory per model
+TTS_MODEL_DIR = os.getenv('TTS_MODEL_DIR', '/models')
+# Synthesized before the worker accepts jobs (empty disables warm-up)
+TTS_WARMUP_TEXT = os.getenv('TTS_WARMUP_TEXT', 'Hello! This is a warm-up.')
+TTS_WARMUP_RUNS = int(os.getenv('TTS_WARMUP_RUNS', 1))
+
+# Text front-end (see frontend.py): number/date/abbreviation expansion and
+# a memo of normalized texts and prompt tokens per voice
+TEXT_NORMALIZATION = os.getenv('TEXT_NORMALIZATION', 'true').lower() == 'true'
+FRONTEND_CACHE_SIZE = int(os.getenv('FRONTEND_CACHE_SIZE', 10000))
+# Voice of jobs that don't name one (input.voice)
+TTS_VOICE = os.getenv('TTS_VOICE', 'default')
+
+# Voices and models (see registry.py): voice presets as JSON or a JSON
+# file, e.g. {"tara": {"model": "...", "voice": "tara", "speed": 1.0}},
+# further models jobs may name (input.model), and how many models stay
+# loaded at once (and in how many MB; 0: no limit)
+TTS_VOICES = os.getenv('TTS_VOICES', '')
+TTS_MODELS = [name.strip() for name in os.getenv('TTS_MODELS', '').split(',') if name.strip()]
+TTS_MAX_RESIDENT_MODELS = int(os.getenv('TTS_MAX_RESIDENT_MODELS', 1))
+TTS_MEMORY_BUDGET = int(os.getenv('TTS_MEMORY_BUDGET_MB', 0)) * 1024 * 1024
+# Range of input.speed
+MIN_SPEED = 0.5
+MAX_SPEED = 2.0
+
+# Micro-batching: texts arriving within the window are synthesized together
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT = float(os.getenv('BATCH_MAX_WAIT_MS', 10)) / 1000
+# Jobs this worker accepts at once so the scheduler has something to batch
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', BATCH_MAX_SIZE))
+# Most texts one batch job may carry
+MAX_BATCH_TEXTS = int(os.getenv('MAX_BATCH_TEXTS', 32))
+MAX_TEXT_LENGTH = 1000
+
+# Set by init_worker() before the worker accepts jobs
+registry = None
+voices = {}
+device = None
+init_time = None
+startup_phases = {}
+
+# The first job this worker serves paid for the model load (a cold start)
+cold_start = True
+
+# PCM layout produced by the model (Orpheus emits 24kHz 16-bit mono)
+SAMPLE_RATE = int(os.getenv('TTS_SAMPLE_RATE', 24000))
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+# Size placeholder for WAV headers whose length is unknown while streaming
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+def wav_header(data_size=STREAMING_SIZE):
+    """
+    Build a PCM WAV header. With the default data size the header is
+    streaming-compatible: players read until the connection closes.
+    """
+    byte_rate = SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH
+    block_align = CHANNELS * SAMPLE_WIDTH
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack(
+            '<IHHIIHH', 16, 1, CHANNELS, SAMPLE_RATE,
+            byte_rate, block_align, SAMPLE_WIDTH * 8
+        )
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+def validate_text(text):
+    """Return an error message for unusable text, or None"""
+    if not isinstance(text, str) or not text:
+        return "Invalid text input. Text cannot be empty."
+    if len(text) > MAX_TEXT_LENGTH:
+        return (
+            f"Invalid text input. Maximum {MAX_TEXT_LENGTH} characters allowed."
+        )
+    return None
+
+
+class LoadedModel(NamedTuple):
+    """A resident model with its own batch scheduler and front-end"""
+    name: str
+    model: object
+    device: str
+    scheduler: BatchScheduler
+    front_end: FrontEnd
+    startup_phases: dict
+
+
+def load_model(name):
+    """Load and warm up a model and start its scheduler; returns it and its size"""
+    model, model_device, timer = start_model(
+        name, TTS_DEVICE, TTS_MODEL_DIR, TTS_WARMUP_TEXT, TTS_WARMUP_RUNS
+    )
+    loaded = LoadedModel(
+        name,
+        model,
+        model_device,
+        BatchScheduler(model, BATCH_MAX_SIZE, BATCH_MAX_WAIT),
+        FrontEnd(model, FRONTEND_CACHE_SIZE, TEXT_NORMALIZATION),
+        timer.phases
+    )
+    return loaded, model_bytes(model)
+
+
+def unload_model(loaded):
+    loaded.scheduler.close()
+    release_memory(loaded.device)
+
+
+def init_worker():
+    """Set up the voices and model registry, and load and warm up the default model"""
+    global registry, voices, device, init_time, startup_phases
+    voices = load_voices(TTS_VOICES, TTS_VOICE, TTS_MODEL)
+    registry = ModelRegistry(
+        load_model,
+        [TTS_MODEL] + TTS_MODELS + [voice.model for voice in voices.values()],
+        unload_model,
+        TTS_MAX_RESIDENT_MODELS,
+        TTS_MEMORY_BUDGET
+    )
+    try:
+        logging.info(f"Initializing TTS model {TTS_MODEL}...")
+        loaded, _ = registry.acquire(TTS_MODEL)
+    except Exception as e:
+        logging.error(f"Failed to initialize model: {e}")
+        logging.error(traceback.format_exc())
+        raise
+    registry.release(TTS_MODEL)
+    device = loaded.device
+    startup_phases = loaded.startup_phases
+    init_time = round(sum(startup_phases.values()), 3)
+    logging.info(f"Voices: {', '.join(sorted(voices))}; models: {', '.join(registry.models)}")
+
+
+def resolve_voice(job_input):
+    """
+    (voice, model, synthesis options) of a job, from its voice, model and
+    speed fields. Raises ValueError for unknown voices and models.
+    """
+    name = job_input.get("voice") or TTS_VOICE
+    voice = voices.get(name)
+    if voice is None:
+        raise ValueError(f"Unknown voice {name!r}. Available: {', '.join(sorted(voices))}")
+    model_name = job_input.get("model") or voice.model
+    if model_name not in registry.models:
+        raise ValueError(f"Unknown model {model_name!r}. Available: {', '.join(registry.models)}")
+    options = dict(voice.options)
+    speed = job_input.get("speed")
+    if speed is not None:
+        if isinstance(speed, bool) or not isinstance(speed, (int, float)) or not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"Invalid speed. Expected a number from {MIN_SPEED} to {MAX_SPEED}.")
+        options["speed"] = float(speed)
+    return name, model_name, options
+
+
+def take_cold_start():
+    """True for the first job served by this worker"""
+    global cold_start
+    cold, cold_start = cold_start, False
+    return cold
+
+
+def item_meta(item, processing_time, audio_size, pcm_bytes=0, stages=None, trace_id=None, route=None):
+    """
+    Timing metadata reported for one synthesized text. pcm_bytes is the
+    model's raw audio output, from which the audio duration and real-time
+    factor (synthesis time / audio duration) are derived. stages adds the
+    seconds spent on preparing the text (normalize) and on post-processing
+    (encode, base64) to the per-stage breakdown the web server turns into
+    trace spans. route adds the job's voice, model and device.
+    """
+    first_chunk = None
+    if item.first_chunk_at is not None:
+        first_chunk = item.first_chunk_at - item.submitted_at
+    synthesis = None
+    if item.started_at is not None and item.finished_at is not None:
+        synthesis = item.finished_at - item.started_at
+    duration = pcm_bytes / (SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+    cold = take_cold_start()
+    queue_wait = (item.started_at or time.time()) - item.submitted_at
+    stages = dict(stages or {})
+    # In the order they happen
+    stages = dict(
+        {"normalize": stages.pop("normalize", 0.0), "queue_wait": queue_wait, "synthesis": synthesis or 0.0},
+        **stages
+    )
+    meta = {
+        "processing_time_seconds": processing_time,
+        "first_chunk_seconds": first_chunk,
+        "queue_wait_seconds": queue_wait,
+        "synthesis_seconds": synthesis,
+        "audio_duration_seconds": duration,
+        "real_time_factor": synthesis / duration if synthesis is not None and duration else None,
+        "batch_size": item.batch_size,
+        "audio_size_kb": audio_size,
+        "model_init_seconds": init_time,
+        "device": device,
+        "cold_start": cold,
+        "stages": stages
+    }
+    if cold:
+        meta["startup_phases"] = startup_phases
+    if trace_id:
+        meta["trace_id"] = trace_id
+    meta.update(route or {})
+    return meta
+
+
+def prepare(loaded, text, voice):
+    """The front-end's output for text, and the seconds it took"""
+    start = time.time()
+    prepared = loaded.front_end.prepare(text, voice)
+    return prepared, time.time() - start
+
+
+async def synthesize_batch(job_id, texts, fmt, loaded, voice, options, route, trace_id=None):
+    """Synthesize every text of a batch job; returns one result per text"""
+    errors = [validate_text(text) for text in texts]
+    prepared = [prepare(loaded, text, voice) for text, error in zip(texts, errors) if error is None]
+    items = loaded.scheduler.submit_many([text.prompt for text, _ in prepared], options)
+    pending = iter(zip(items, prepared))
+    results = []
+    for error in errors:
+        if error is not None:
+            results.append({"error": error})
+            continue
+        item, (_, normalize_time) = next(pending)
+        try:
+            chunks = [chunk async for chunk in item]
+        except Exception as e:
+            logging.error(f"Job {job_id}: Audio generation error: {e}")
+            results.append({"error": f"Audio generation failed: {e}"})
+            continue
+        audio_data = b''.join(chunks)
+        pcm_bytes = len(audio_data)
+        if audio_data and audio_data[:4] != b'RIFF':
+            audio_data = wav_header(len(audio_data)) + audio_data
+        else:
+            pcm_bytes -= len(wav_header())
+        encode_start = time.time()
+        if audio_data and not fmt.is_default:
+            audio_data = await asyncio.to_thread(encode_audio, audio_data, fmt)
+        base64_start = time.time()
+        encoded = base64.b64encode(audio_data).decode('utf-8')
+        stages = {
+            "normalize": normalize_time,
+            "encode": base64_start - encode_start,
+            "base64": time.time() - base64_start
+        }
+        results.append({
+            "audio": encoded,
+            "format": fmt.name,
+            "media_type": fmt.media_type,
+            "meta": item_meta(
+                item, time.time() - item.submitted_at, len(audio_data) / 1024,
+                max(pcm_bytes, 0), stages, trace_id, route
+            )
+        })
+    return results
+
+
+async def synthesize_one(job_id, text, fmt, stream, loaded, voice, options, route, trace_id=None):
+    """Synthesize one text, yielding its chunks or its audio as handler() does"""
+    # Generate audio
     start_time = time.time()
-    model = RealTimeTTS(
-        model='canopylabs/orpheus-3b-0.1-pretrained',
-        device='cuda'
+    prepared, normalize_time = prepare(loaded, text, voice)
+    item = loaded.scheduler.submit(prepared.prompt, options)
+    audio_chunks = []
+    has_header = None
+    total_bytes = 0
+    pcm_bytes = 0
+    seq = 0
+    # Seconds spent encoding and base64-encoding, summed over chunks
+    stages = {"normalize": normalize_time, "encode": 0.0, "base64": 0.0}
+    # Streamed jobs are encoded chunk by chunk as the model produces them
+    encoder = AudioEncoder(fmt) if stream and not fmt.is_default else None
+    
+    async def encode(method, *args):
+        encode_start = time.time()
+        try:
+            return await asyncio.to_thread(method, *args)
+        finally:
+            stages["encode"] += time.time() - encode_start
+    
+    def emit(chunk):
+        nonlocal seq
+        seq += 1
+        base64_start = time.time()
+        encoded = base64.b64encode(chunk).decode('utf-8')
+        stages["base64"] += time.time() - base64_start
+        return {
+            "chunk": encoded,
+            "seq": seq - 1
+        }
+    
+    try:
+        async for chunk in item:
+            pcm_bytes += len(chunk)
+            if has_header is None:
+                has_header = chunk[:4] == b'RIFF'
+                if has_header:
+                    pcm_bytes -= len(wav_header())
+                if stream and not has_header:
+                    chunk = wav_header() + chunk
+            if encoder:
+                chunk = await encode(encoder.feed, chunk)
+                if not chunk:
+                    continue
+            total_bytes += len(chunk)
+            if stream:
+                yield emit(chunk)
+            else:
+                audio_chunks.append(chunk)
+        if encoder:
+            chunk = await encode(encoder.finish)
+            if chunk:
+                total_bytes += len(chunk)
+                yield emit(chunk)
+    except Exception as e:
+        err_msg = str(e)
+        logging.error(
+            f"Job {job_id}: Audio generation error: {err_msg}"
+        )
+        yield {
+            "error": f"Audio generation failed: {err_msg}"
+        }
+        return
+    finally:
+        if encoder:
+            encoder.close()
+    
+    # Combine audio chunks
+    audio_data = b''.join(audio_chunks)
+    if audio_data and not has_header:
+        audio_data = wav_header(len(audio_data)) + audio_data
+    if audio_data and not fmt.is_default:
+        audio_data = await encode(encode_audio, audio_data, fmt)
+        total_bytes = len(audio_data)
+    if not stream:
+        base64_start = time.time()
+        encoded = base64.b64encode(audio_data).decode('utf-8')
+        stages["base64"] = time.time() - base64_start
+    
+    # Log completion
+    processing_time = time.time() - start_time
+    audio_size = total_bytes / 1024  # KB
+    logging.info(
+        f"Job {job_id}: Generated {audio_size:.2f}KB "
+        f"in {processing_time:.2f}s (batch of {item.batch_size})"
     )
-    init_time = time.time() - start_time
-    logging.info(f"Model initialized in {init_time:.2f} seconds")
-except Exception as e:
-    logging.error(f"Failed to initialize model: {e}")
-    logging.error(traceback.format_exc())
-    raise
+    meta = item_meta(item, processing_time, audio_size, max(pcm_bytes, 0), stages, trace_id, route)
+    
+    if stream:
+        yield {
+            "done": True,
+            "format": fmt.name,
+            "media_type": fmt.media_type,
+            "meta": meta
+        }
+        return
+    
+    # Return base64 encoded audio
+    yield {
+        "audio": encoded,
+        "format": fmt.name,
+        "media_type": fmt.media_type,
+        "meta": meta
+    }
 
 
-def handler(event):
+async def handler(event):
     """
     RunPod serverless handler function
+
+    Yields audio as it is produced. With ``input.stream`` set, each model
+    chunk is yielded as ``{"chunk": <base64>, "seq": n}`` followed by a
+    final ``{"done": True, "meta": {...}}``; otherwise a single
+    ``{"audio": <base64>, ...}`` item is yielded once synthesis completes.
+
+    ``input.texts`` (a list) requests a batch instead: a single
+    ``{"results": [...]}`` item is yielded with one ``audio`` or ``error``
+    entry per text, in order.
+
+    ``input.format`` selects the encoding (wav, pcm, opus, mp3, flac), with
+    optional ``input.sample_rate`` and ``input.bit_depth``.
+
+    ``input.voice`` (default ``TTS_VOICE``) picks a voice preset and with
+    it the model, ``input.model`` another model, and ``input.speed`` the
+    speaking rate. The model is loaded first if it isn't resident. Texts
+    are normalized (numbers, dates, abbreviations...) and prepared for the
+    voice by the model's front-end before they are synthesized.
+
+    Every result carries ``meta`` timing: queue wait, first-chunk latency,
+    synthesis time, real-time factor, ``stages`` (seconds spent normalizing,
+    queueing, synthesizing, encoding and base64-encoding), and the model init time
+    with a ``cold_start`` flag (and ``startup_phases``) on the worker's
+    first job, along with the voice, model and device (and
+    ``model_load_seconds`` when the job waited for the model to load).
+    ``input.trace_id``, set by the web server, is logged with the job and
+    echoed in ``meta``.
     """
     try:
         # Log request
         job_id = event.get("id", "unknown")
-        logging.info(f"Processing job {job_id}")
+        trace_id = (event.get("input") or {}).get("trace_id")
+        if trace_id:
+            logging.info(f"Processing job {job_id} (trace {trace_id})")
+        else:
+            logging.info(f"Processing job {job_id}")
         
         # Get text from the request
         if "input" not in event:
             logging.error(f"Job {job_id}: Missing input field")
-            return {"error": "Missing input field"}
-            
-        if "text" not in event["input"]:
-            logging.error(f"Job {job_id}: No text field in input")
-            return {"error": "Missing text field in input"}
-            
-        text = event["input"]["text"]
+            yield {"error": "Missing input field"}
+            return
         
-        # Validate text
-        if not text:
-            logging.error(f"Job {job_id}: Empty text input")
-            return {"error": "Invalid text input. Text cannot be empty."}
-            
-        if len(text) > 1000:
-            text_len = len(text)
-            logging.error(
-                f"Job {job_id}: Text too long ({text_len} characters)"
-            )
-            return {
-                "error": "Invalid text input. Maximum 1000 characters allowed."
-            }
+        try:
+            fmt = output_format(event["input"])
+        except FormatError as e:
+            logging.error(f"Job {job_id}: {e}")
+            yield {"error": str(e)}
+            return
         
-        # Log text summary
-        truncated = text[:50] + ('...' if len(text) > 50 else '')
-        logging.info(f"Job {job_id}: Processing text: {truncated}")
+        try:
+            voice, model_name, options = resolve_voice(event["input"])
+        except ValueError as e:
+            logging.error(f"Job {job_id}: {e}")
+            yield {"error": str(e)}
+            return
         
-        # Generate audio
-        start_time = time.time()
-        audio_chunks = []
+        texts = event["input"].get("texts")
+        if texts is not None:
+            if not isinstance(texts, list) or not texts:
+                yield {"error": "Invalid texts input. Expected a non-empty list."}
+                return
+            if len(texts) > MAX_BATCH_TEXTS:
+                yield {
+                    "error": f"Too many texts. Maximum {MAX_BATCH_TEXTS} per job."
+                }
+                return
+        elif "text" not in event["input"]:
+            logging.error(f"Job {job_id}: No text field in input")
+            yield {"error": "Missing text field in input"}
+            return
+        else:
+            text = event["input"]["text"]
+            
+            # Validate text
+            error = validate_text(text)
+            if error:
+                logging.error(f"Job {job_id}: {error}")
+                yield {"error": error}
+                return
         
+        # Load the model unless it's resident; it stays loaded until the job is done
+        acquiring = asyncio.ensure_future(asyncio.to_thread(registry.acquire, model_name))
         try:
-            for chunk in model.stream(text):
-                audio_chunks.append(chunk)
-        except Exception as e:
-            err_msg = str(e)
-            logging.error(
-                f"Job {job_id}: Audio generation error: {err_msg}"
+            loaded, load_seconds = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The load carries on; don't leave the model pinned once it's done
+            acquiring.add_done_callback(
+                lambda done: done.exception() is None and registry.release(model_name)
             )
-            logging.error(traceback.format_exc())
-            return {
-                "error": f"Audio generation failed: {err_msg}"
-            }
-        
-        # Combine audio chunks
-        audio_data = b''.join(audio_chunks)
-        
-        # Log completion
-        processing_time = time.time() - start_time
-        audio_size = len(audio_data) / 1024  # KB
-        logging.info(
-            f"Job {job_id}: Generated {audio_size:.2f}KB "
-            f"in {processing_time:.2f}s"
-        )
+            raise
+        except Exception as e:
+            logging.error(f"Job {job_id}: Failed to load model {model_name}: {e}")
+            yield {"error": f"Failed to load model {model_name}: {e}"}
+            return
+        route = {"voice": voice, "model": model_name, "device": loaded.device}
+        if load_seconds is not None:
+            route["model_load_seconds"] = load_seconds
         
-        # Return base64 encoded audio
-        return {
-            "audio": base64.b64encode(audio_data).decode('utf-8'),
-            "format": "wav",
-            "meta": {
-                "processing_time_seconds": processing_time,
-                "audio_size_kb": audio_size
-            }
-        }
+        try:
+            if texts is not None:
+                logging.info(f"Job {job_id}: Processing batch of {len(texts)} texts with voice {voice}")
+                yield {"results": await synthesize_batch(
+                    job_id, texts, fmt, loaded, voice, options, route, trace_id
+                )}
+                return
+            
+            stream = bool(event["input"].get("stream", False))
+            
+            # Log text summary
+            truncated = text[:50] + ('...' if len(text) > 50 else '')
+            logging.info(f"Job {job_id}: Processing text with voice {voice}: {truncated}")
+            
+            async for output in synthesize_one(
+                job_id, text, fmt, stream, loaded, voice, options, route, trace_id
+            ):
+                yield output
+        finally:
+            registry.release(model_name)
     except Exception as e:
         # Catch any unexpected errors
         error_msg = str(e)
@@ -110,8 +526,19 @@ def handler(event):
             f"Job {job}: Unexpected error: {error_msg}"
         )
         logging.error(traceback.format_exc())
-        return {"error": error_msg}
+        yield {"error": error_msg}
+
 
+if __name__ == '__main__':
+    # The model is loaded and warmed up before the first job is accepted
+    init_worker()
+    import runpod
 
-# Start the serverless handler
-runpod.serverless.start({"handler": handler})
+    # Start the serverless handler. Aggregating the stream keeps /run and
+    # /runsync results available to callers that do not poll /stream. The
+    # handler is async so concurrent jobs can share micro-batches.
+    runpod.serverless.start({
+        "handler": handler,
+        "return_aggregate_stream": True,
+        "concurrency_modifier": lambda current: MAX_CONCURRENT_JOBS
+    })
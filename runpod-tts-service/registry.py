@@ -0,0 +1,171 @@
+"""
+Voices and the models that render them.
+
+A voice is a preset over a model: the model's name plus the synthesis
+options (speaker, speed...) its stream calls are given. Voices of the same
+model share its one loaded copy of the weights, so serving another voice
+costs no memory, and one endpoint serves every voice instead of one
+endpoint (and cold start) per voice.
+
+Models are loaded the first time a job needs one and kept resident, at
+most ``max_models`` of them and, with a ``memory_budget``, at most that
+many bytes of weights. Past either limit the least recently used idle
+model is unloaded. Models in use by a job are never unloaded, so the
+limits are exceeded for as long as every resident model is busy.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Voice(NamedTuple):
+    name: str
+    model: str
+    options: Dict[str, Any]
+
+
+def load_voices(spec: Optional[str], default_voice: str, default_model: str) -> Dict[str, Voice]:
+    """
+    Voice presets from JSON, inline or in the file spec names:
+    {"<voice>": {"model": "<model>", "<option>": value, ...}}. The default
+    voice renders with the default model and no options unless defined.
+    """
+    presets = {}
+    if spec:
+        if os.path.isfile(spec):
+            with open(spec, 'r') as f:
+                presets = json.load(f)
+        else:
+            presets = json.loads(spec)
+    voices = {}
+    for name, preset in presets.items():
+        options = dict(preset)
+        voices[name] = Voice(name, options.pop('model', default_model), options)
+    voices.setdefault(default_voice, Voice(default_voice, default_model, {}))
+    return voices
+
+
+class _Resident:
+    __slots__ = ('value', 'size', 'in_use')
+
+    def __init__(self, value, size: int):
+        self.value = value
+        self.size = size
+        self.in_use = 1
+
+
+class ModelRegistry:
+    """Lazily loaded models, kept resident under a count and memory budget"""
+
+    def __init__(
+        self,
+        load: Callable[[str], Tuple[Any, int]],
+        models: Iterable[str],
+        unload: Optional[Callable[[Any], None]] = None,
+        max_models: int = 1,
+        memory_budget: int = 0
+    ):
+        """
+        load(name) returns a loaded model and its size in bytes; unload
+        releases one. models are the names jobs may ask for.
+        """
+        self._load = load
+        self._unload = unload
+        self.models = list(dict.fromkeys(models))
+        self.max_models = max(1, max_models)
+        self.memory_budget = memory_budget
+        self._resident: "OrderedDict[str, _Resident]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.models}
+        self.loads = 0
+        self.unloads = 0
+
+    def acquire(self, name: str) -> Tuple[Any, Optional[float]]:
+        """
+        The model, loading it if it isn't resident, and the seconds this
+        call spent loading it (None if it was resident). Blocks while
+        loading; release() it once the job is done.
+        """
+        if name not in self._load_locks:
+            raise ValueError(f"Unknown model {name!r}. Available: {', '.join(self.models)}")
+        value = self._take(name)
+        if value is not None:
+            return value, None
+
+        # One load per model; jobs asking for it meanwhile wait for this one
+        with self._load_locks[name]:
+            value = self._take(name)
+            if value is not None:
+                return value, None
+            self._unload_idle(room=1)
+            logging.info(f"Loading model {name}")
+            start = time.perf_counter()
+            value, size = self._load(name)
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._resident[name] = _Resident(value, size)
+                self.loads += 1
+            logging.info(f"Loaded model {name} ({size / 1024 ** 2:.0f}MB) in {seconds:.2f}s")
+            self._unload_idle()
+            return value, seconds
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            resident = self._resident.get(name)
+            if resident is not None:
+                resident.in_use -= 1
+        self._unload_idle()
+
+    def _take(self, name: str):
+        with self._lock:
+            resident = self._resident.get(name)
+            if resident is None:
+                return None
+            resident.in_use += 1
+            self._resident.move_to_end(name)
+            return resident.value
+
+    def _over(self, room: int) -> bool:
+        # Caller holds the lock
+        if len(self._resident) + room > self.max_models:
+            return True
+        return bool(self.memory_budget) and sum(r.size for r in self._resident.values()) > self.memory_budget
+
+    def _unload_idle(self, room: int = 0) -> None:
+        """Unload least recently used idle models until room more fit the limits"""
+        unloaded: List[Tuple[str, Any]] = []
+        with self._lock:
+            for name in list(self._resident):
+                if not self._over(room):
+                    break
+                resident = self._resident[name]
+                if resident.in_use > 0:
+                    continue
+                del self._resident[name]
+                unloaded.append((name, resident.value))
+                self.unloads += 1
+        for name, value in unloaded:
+            logging.info(f"Unloading model {name}")
+            if self._unload is not None:
+                try:
+                    self._unload(value)
+                except Exception as e:
+                    logging.error(f"Unloading model {name} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'resident': {
+                    name: {'bytes': r.size, 'in_use': r.in_use}
+                    for name, r in self._resident.items()
+                },
+                'bytes': sum(r.size for r in self._resident.values()),
+                'max_models': self.max_models,
+                'memory_budget': self.memory_budget,
+                'loads': self.loads,
+                'unloads': self.unloads
+            }
@@ -0,0 +1,170 @@
+"""
+Worker startup: device selection, model loading and warm-up.
+
+A serverless cold start pays for all of this before its first job, so
+each phase is timed, logged and reported in the meta of the worker's
+first job.
+
+- device: TTS_DEVICE, falling back to CPU when CUDA isn't available, so
+  the whole path runs (slowly) on machines without a GPU
+- import: the TTS library, imported only now so the handler module loads
+  without it
+- load: the weights. The Dockerfile bakes a safetensors snapshot into
+  TTS_MODEL_DIR; when it's there the model is loaded from it by path with
+  the Hugging Face hub offline, so startup never touches the network and
+  the weights are memory-mapped rather than read and copied.
+- warmup: throwaway syntheses before the worker accepts jobs, so CUDA
+  kernel compilation and allocator growth don't land on the first request
+
+Models named ``stub:...`` are the CPU stand-in in stub_model.py; nothing is
+imported or loaded for them.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Files of a snapshot needed to load the model; .bin weights are skipped
+SNAPSHOT_PATTERNS = ["*.json", "*.safetensors", "*.model", "*.txt", "*.tiktoken"]
+
+
+class StartupTimer:
+    """Seconds spent in each named startup phase"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 3)
+            logging.info(f"Startup phase {name} took {self.phases[name]:.2f}s")
+
+    @property
+    def total(self) -> float:
+        return round(sum(self.phases.values()), 3)
+
+
+def select_device(requested: str = 'auto') -> str:
+    """The requested device ('auto': CUDA if available), or 'cpu' if it isn't available"""
+    requested = (requested or 'auto').lower()
+    if requested == 'cpu':
+        return 'cpu'
+    try:
+        import torch
+        cuda = torch.cuda.is_available()
+    except ImportError:
+        cuda = False
+    if cuda:
+        return 'cuda' if requested == 'auto' else requested
+    if requested != 'auto':
+        logging.warning(f"Device {requested} is not available; falling back to CPU")
+    return 'cpu'
+
+
+def snapshot_path(model_name: str, model_dir: Optional[str]) -> str:
+    """Where the baked snapshot of model_name lives under model_dir"""
+    return os.path.join(model_dir or '', model_name.replace('/', '--'))
+
+
+def local_snapshot(model_name: str, model_dir: Optional[str]) -> Optional[str]:
+    """The baked snapshot of model_name, or None if there isn't one"""
+    if not model_dir:
+        return None
+    path = snapshot_path(model_name, model_dir)
+    return path if os.path.isfile(os.path.join(path, 'config.json')) else None
+
+
+def bake_model(model_name: str, model_dir: str) -> str:
+    """Download the model's safetensors snapshot into model_dir (run at image build)"""
+    from huggingface_hub import snapshot_download
+    return snapshot_download(
+        model_name,
+        local_dir=snapshot_path(model_name, model_dir),
+        allow_patterns=SNAPSHOT_PATTERNS
+    )
+
+
+def warm_up(model, text: str, runs: int = 1) -> None:
+    """Synthesize text and discard it, singly and (if supported) as a batch"""
+    for _ in range(runs):
+        for _ in model.stream(text):
+            pass
+        if hasattr(model, 'stream_batch'):
+            for _ in model.stream_batch([text, text]):
+                pass
+
+
+def start_model(
+    model_name: str,
+    requested_device: str = 'auto',
+    model_dir: Optional[str] = None,
+    warmup_text: str = '',
+    warmup_runs: int = 1
+):
+    """Load and warm up the model; returns (model, device, timer)"""
+    timer = StartupTimer()
+    with timer.phase('device'):
+        device = select_device(requested_device)
+
+    if model_name.startswith('stub:'):
+        with timer.phase('load'):
+            from stub_model import StubTTS
+            model = StubTTS(model_name, device)
+        logging.info(f"Stub model {model_name} ready on {device}")
+        return model, device, timer
+
+    with timer.phase('import'):
+        from realtime_tts import RealTimeTTS
+
+    with timer.phase('load'):
+        source = local_snapshot(model_name, model_dir)
+        if source is not None:
+            # Everything is on disk; don't let the hub check for updates
+            os.environ.setdefault('HF_HUB_OFFLINE', '1')
+            os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+        else:
+            logging.warning(f"No baked snapshot of {model_name} in {model_dir}; loading from the hub")
+            source = model_name
+        model = RealTimeTTS(model=source, device=device)
+
+    if warmup_text and warmup_runs > 0:
+        with timer.phase('warmup'):
+            try:
+                warm_up(model, warmup_text, warmup_runs)
+            except Exception as e:
+                # A cold first job is better than no worker
+                logging.error(f"Warm-up synthesis failed: {e}")
+
+    logging.info(f"Model ready on {device} in {timer.total:.2f}s: {timer.phases}")
+    return model, device, timer
+
+
+def model_bytes(model) -> int:
+    """Resident size of a model's weights (0 if it can't be told)"""
+    size = getattr(model, 'memory_bytes', None)
+    if size is not None:
+        return int(size)
+    for owner in (model, getattr(model, 'model', None)):
+        parameters = getattr(owner, 'parameters', None)
+        if callable(parameters):
+            try:
+                return sum(p.numel() * p.element_size() for p in parameters())
+            except Exception:
+                continue
+    return 0
+
+
+def release_memory(device: str) -> None:
+    """Hand memory freed by an unloaded model back to the device"""
+    if not device.startswith('cuda'):
+        return
+    try:
+        import torch
+        torch.cuda.empty_cache()
+    except ImportError:
+        pass
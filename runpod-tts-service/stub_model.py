@@ -0,0 +1,53 @@
+"""
+CPU-only stand-in for the TTS model.
+
+Selected with a model name starting with ``stub:`` (``stub:<name>`` or
+``stub:<name>:<megabytes>``, the size it reports as resident), so the
+worker, its model registry and the web server in front of it run end to
+end without a GPU or the TTS library. It produces a tone whose pitch
+depends on the voice and whose length depends on the text and speed,
+chunk by chunk like the real model.
+"""
+import math
+import struct
+import time
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+SAMPLE_RATE = 24000
+# Seconds of audio per character of text at speed 1.0
+SECONDS_PER_CHAR = 0.06
+CHUNK_SECONDS = 0.1
+
+
+class StubTTS:
+    """Tone generator with the streaming interface of the real model"""
+
+    def __init__(self, model: str = 'stub', device: str = 'cpu', delay: float = 0.0):
+        """delay is the seconds each chunk takes to produce"""
+        self.model = model
+        self.device = device
+        self.delay = delay
+        parts = model.split(':')
+        megabytes = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 64
+        self.memory_bytes = megabytes * 1024 * 1024
+
+    def stream(self, text, voice: Optional[str] = None, speed: float = 1.0, **options) -> Iterator[bytes]:
+        """16-bit mono PCM at SAMPLE_RATE, CHUNK_SECONDS at a time"""
+        text = text if isinstance(text, str) else ' '.join(map(str, text))
+        frequency = 200 + zlib.crc32((voice or self.model).encode()) % 400
+        total = max(1, int(len(text) * SECONDS_PER_CHAR / max(speed, 0.1) * SAMPLE_RATE))
+        chunk = int(CHUNK_SECONDS * SAMPLE_RATE)
+        for start in range(0, total, chunk):
+            count = min(chunk, total - start)
+            if self.delay:
+                time.sleep(self.delay)
+            yield struct.pack(
+                f'<{count}h',
+                *(int(3000 * math.sin(2 * math.pi * frequency * (start + i) / SAMPLE_RATE)) for i in range(count))
+            )
+
+    def stream_batch(self, texts: List, **options) -> Iterator[Tuple[int, bytes]]:
+        for index, text in enumerate(texts):
+            for chunk in self.stream(text, **options):
+                yield index, chunk
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+
+from batching import BatchScheduler
+
+
+class FakeModel:
+    """Records every model call; texts starting with "fail" raise"""
+
+    def __init__(self):
+        self.calls = []
+        self.busy = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def _enter(self, method, texts, options):
+        self.busy.set()
+        self.gate.wait()
+        self.calls.append((method, list(texts), options))
+
+    def stream(self, text, **options):
+        self._enter('stream', [text], options)
+        if text.startswith('fail'):
+            raise RuntimeError(f"cannot synthesize {text}")
+        yield text.encode()
+
+
+class FakeBatchModel(FakeModel):
+    def stream_batch(self, texts, **options):
+        self._enter('stream_batch', texts, options)
+        for index, text in enumerate(texts):
+            yield index, text.encode()
+
+
+@pytest.fixture
+def model():
+    return FakeBatchModel()
+
+
+@pytest.fixture
+def scheduler(model):
+    scheduler = BatchScheduler(model, max_batch_size=4, max_wait=0.05)
+    yield scheduler
+    model.gate.set()
+    scheduler.close()
+
+
+def test_items_submitted_together_share_a_batch(scheduler, model):
+    items = scheduler.submit_many(['a', 'b', 'c'])
+
+    assert [b''.join(item) for item in items] == [b'a', b'b', b'c']
+    assert model.calls == [('stream_batch', ['a', 'b', 'c'], {})]
+    assert all(item.batch_size == 3 for item in items)
+
+
+def test_batches_are_capped_at_max_batch_size(scheduler, model):
+    items = scheduler.submit_many([str(i) for i in range(6)])
+
+    assert [b''.join(item) for item in items] == [str(i).encode() for i in range(6)]
+    assert [texts for _, texts, _ in model.calls] == [['0', '1', '2', '3'], ['4', '5']]
+
+
+def test_items_with_different_options_get_separate_calls(scheduler, model):
+    # Hold the model thread on a first item so the rest gather into one batch
+    model.gate.clear()
+    first = scheduler.submit('first')
+    assert model.busy.wait(5)
+    fast = scheduler.submit_many(['a', 'b'], {'speed': 1.5})
+    slow = scheduler.submit_many(['c', 'd'], {'speed': 0.8})
+    model.gate.set()
+
+    for item in [first] + fast + slow:
+        list(item)
+    assert model.calls == [
+        ('stream', ['first'], {}),
+        ('stream_batch', ['a', 'b'], {'speed': 1.5}),
+        ('stream_batch', ['c', 'd'], {'speed': 0.8})
+    ]
+    assert all(item.batch_size == 4 for item in fast + slow)
+
+
+def test_a_failing_text_does_not_fail_its_batch():
+    model = FakeModel()
+    scheduler = BatchScheduler(model, max_batch_size=4, max_wait=0.05)
+    try:
+        ok, bad, also_ok = scheduler.submit_many(['ok', 'fail me', 'also ok'])
+
+        assert b''.join(ok) == b'ok'
+        with pytest.raises(RuntimeError, match='fail me'):
+            list(bad)
+        assert b''.join(also_ok) == b'also ok'
+        assert [method for method, _, _ in model.calls] == ['stream'] * 3
+    finally:
+        scheduler.close()
+
+
+def test_a_failing_batch_call_fails_every_item(scheduler, model):
+    def broken(texts, **options):
+        raise RuntimeError("out of memory")
+        yield
+
+    model.stream_batch = broken
+    items = scheduler.submit_many(['a', 'b'])
+
+    for item in items:
+        with pytest.raises(RuntimeError, match='out of memory'):
+            list(item)
+
+
+def test_items_can_be_consumed_async(scheduler):
+    async def collect(item):
+        return [chunk async for chunk in item]
+
+    assert asyncio.run(collect(scheduler.submit('async'))) == [b'async']
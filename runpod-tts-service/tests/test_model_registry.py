@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from registry import ModelRegistry, load_voices
+from startup import model_bytes
+from stub_model import StubTTS
+
+MB = 1024 * 1024
+
+
+class Loader:
+    """Loads StubTTS models by name, recording loads and unloads"""
+
+    def __init__(self):
+        self.loaded = []
+        self.unloaded = []
+
+    def load(self, name):
+        model = StubTTS(name)
+        self.loaded.append(name)
+        return model, model_bytes(model)
+
+    def unload(self, model):
+        self.unloaded.append(model.model)
+
+
+def registry(loader, models, **limits):
+    return ModelRegistry(loader.load, models, loader.unload, **limits)
+
+
+def use(registry, name):
+    model, seconds = registry.acquire(name)
+    registry.release(name)
+    return model, seconds
+
+
+def test_models_load_on_first_use_only():
+    loader = Loader()
+    models = registry(loader, ['stub:a', 'stub:b'], max_models=2)
+    assert loader.loaded == []
+
+    first, seconds = use(models, 'stub:a')
+    assert isinstance(first, StubTTS) and seconds is not None
+    again, seconds = use(models, 'stub:a')
+    assert again is first and seconds is None
+    assert loader.loaded == ['stub:a']
+
+
+def test_least_recently_used_model_is_unloaded_past_max_models():
+    loader = Loader()
+    models = registry(loader, ['stub:a', 'stub:b', 'stub:c'], max_models=2)
+
+    use(models, 'stub:a')
+    use(models, 'stub:b')
+    use(models, 'stub:a')
+    use(models, 'stub:c')
+
+    assert loader.unloaded == ['stub:b']
+    assert list(models.stats()['resident']) == ['stub:a', 'stub:c']
+    assert models.stats()['unloads'] == 1
+
+
+def test_models_are_unloaded_to_fit_the_memory_budget():
+    loader = Loader()
+    models = registry(
+        loader, ['stub:a:100', 'stub:b:100', 'stub:c:300'], max_models=3, memory_budget=350 * MB
+    )
+
+    use(models, 'stub:a:100')
+    use(models, 'stub:b:100')
+    assert loader.unloaded == []
+    use(models, 'stub:c:300')
+
+    assert loader.unloaded == ['stub:a:100', 'stub:b:100']
+    assert models.stats()['bytes'] == 300 * MB
+
+
+def test_models_in_use_are_not_unloaded():
+    loader = Loader()
+    models = registry(loader, ['stub:a', 'stub:b'], max_models=1)
+
+    models.acquire('stub:a')
+    models.acquire('stub:b')
+    # Over the limit for as long as both are busy
+    assert loader.unloaded == []
+    assert list(models.stats()['resident']) == ['stub:a', 'stub:b']
+
+    # b is the most recently used, but the only idle one
+    models.release('stub:b')
+    assert loader.unloaded == ['stub:b']
+    models.release('stub:a')
+    assert loader.unloaded == ['stub:b']
+    assert list(models.stats()['resident']) == ['stub:a']
+
+
+def test_concurrent_acquires_load_a_model_once():
+    loader = Loader()
+    models = registry(loader, ['stub:a'])
+    barrier = threading.Barrier(8)
+
+    def job():
+        barrier.wait()
+        use(models, 'stub:a')
+
+    threads = [threading.Thread(target=job) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.loaded == ['stub:a']
+
+
+def test_unknown_model_is_rejected():
+    models = registry(Loader(), ['stub:a'])
+    with pytest.raises(ValueError, match='Unknown model'):
+        models.acquire('stub:b')
+
+
+def test_voices_default_to_the_default_model():
+    voices = load_voices('{"calm": {"model": "stub:b", "speed": 0.9}}', 'default', 'stub:a')
+
+    assert voices['default'].model == 'stub:a' and voices['default'].options == {}
+    assert voices['calm'].model == 'stub:b' and voices['calm'].options == {'speed': 0.9}
@@ -0,0 +1,303 @@
+"""
+Admission control for synthesis work.
+
+A request that has to go to RunPod (anything not fully cached) takes one
+of ``slots`` synthesis slots first, and holds it until its audio has been
+sent. When no slot is free it waits in a bounded FIFO queue for its
+priority class. Interactive requests are always admitted before batch
+work (bulk requests, pre-warming and refresh-ahead). Batch work never
+holds more than ``batch_slots`` slots at once, so interactive traffic
+isn't stuck behind a bulk job.
+
+Requests are shed early, with AdmissionRejected (a 429 with Retry-After),
+instead of piling up until the worker timeout:
+
+- queue_full: the priority's queue is at its limit
+- key_limit: the API key already has ``key_limit`` requests admitted or
+  waiting
+- deadline: the expected wait plus synthesis time (from recent slot hold
+  times) exceeds the request's deadline
+- timeout: the deadline passed while the request waited
+
+Limits apply per worker process.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Union
+
+from metrics import (
+    ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS,
+    ADMISSION_WAIT_SECONDS
+)
+
+
+PRIORITIES = ('interactive', 'batch')
+
+# Weight of the latest slot hold time in the running estimate
+HOLD_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """A request shed by admission control; retry_after is in whole seconds"""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Ticket:
+    """A held synthesis slot, freed by release() or at the end of a with block"""
+
+    def __init__(self, controller: "AdmissionController", priority: str, key: Optional[str], waited: float):
+        self.controller = controller
+        self.priority = priority
+        self.key = key
+        self.waited = waited
+        self.acquired = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        """Free the slot; safe to call more than once"""
+        self.controller._release(self)
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    async def astream(self, chunks):
+        """Pass an async response body through, freeing the slot once it ends"""
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            self.release()
+
+
+class _Waiter:
+    """A queued request; wake() is called once it has been given a ticket"""
+
+    def __init__(self, priority: str, key: Optional[str], wake: Callable[[], None]):
+        self.priority = priority
+        self.key = key
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.ticket: Optional[Ticket] = None
+
+
+class AdmissionController:
+    """Priority queues in front of a fixed number of synthesis slots"""
+
+    def __init__(
+        self,
+        slots: int = 4,
+        batch_slots: Optional[int] = None,
+        queue_limits: Optional[Dict[str, int]] = None,
+        key_limit: int = 0,
+        hold_estimate: float = 1.0
+    ):
+        """
+        queue_limits maps priorities to their queue lengths (default
+        4 × slots); key_limit 0 disables the per-key limit; hold_estimate
+        is the assumed slot hold time until some have been measured
+        """
+        self.slots = max(1, slots)
+        self.batch_slots = self.slots if batch_slots is None else max(1, min(batch_slots, self.slots))
+        self.queue_limits = {priority: 4 * self.slots for priority in PRIORITIES}
+        self.queue_limits.update(queue_limits or {})
+        self.key_limit = key_limit
+
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in PRIORITIES}
+        self._active = {priority: 0 for priority in PRIORITIES}
+        self._hold = {priority: hold_estimate for priority in PRIORITIES}
+        self._keys: Dict[str, int] = {}
+
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.waited = {priority: 0.0 for priority in PRIORITIES}
+        self.rejected = {priority: {} for priority in PRIORITIES}
+
+    # Scheduling; every method below expects self._lock to be held
+
+    def _can_run(self, priority: str) -> bool:
+        if sum(self._active.values()) >= self.slots:
+            return False
+        return priority == 'interactive' or self._active['batch'] < self.batch_slots
+
+    def _ahead(self, priority: str) -> int:
+        """Requests a new one of this priority would queue behind"""
+        if priority == 'interactive':
+            return len(self._queues['interactive'])
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _expected_wait(self, priority: str) -> float:
+        capacity = self.slots if priority == 'interactive' else self.batch_slots
+        return (self._ahead(priority) + 1) * self._hold[priority] / capacity
+
+    def _reject(self, priority: str, reason: str, message: str, retry_after: float) -> AdmissionRejected:
+        counts = self.rejected[priority]
+        counts[reason] = counts.get(reason, 0) + 1
+        ADMISSION_REJECTIONS.labels(priority, reason).inc()
+        return AdmissionRejected(message, reason, retry_after)
+
+    def _grant(self, priority: str, key: Optional[str], waited: float) -> Ticket:
+        self._active[priority] += 1
+        self.admitted[priority] += 1
+        self.waited[priority] += waited
+        ADMISSION_ACTIVE.labels(priority).inc()
+        ADMISSION_WAIT_SECONDS.labels(priority).observe(waited)
+        return Ticket(self, priority, key, waited)
+
+    def _drop_key(self, key: Optional[str]) -> None:
+        if key is None:
+            return
+        count = self._keys.get(key, 0) - 1
+        if count > 0:
+            self._keys[key] = count
+        else:
+            self._keys.pop(key, None)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the oldest waiters, interactive first"""
+        now = time.monotonic()
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_run(priority):
+                waiter = queue.popleft()
+                ADMISSION_QUEUE_DEPTH.labels(priority).dec()
+                waiter.ticket = self._grant(priority, waiter.key, now - waiter.enqueued)
+                waiter.wake()
+
+    # Entry points
+
+    def _admit(
+        self, priority: str, key: Optional[str], timeout: Optional[float], wake: Callable[[], None]
+    ) -> Union[Ticket, _Waiter]:
+        """A ticket if a slot is free, else a queued waiter; raises AdmissionRejected"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}")
+        with self._lock:
+            if self.key_limit and key is not None and self._keys.get(key, 0) >= self.key_limit:
+                raise self._reject(
+                    priority, 'key_limit',
+                    f"Too many concurrent requests for this API key (limit {self.key_limit})",
+                    self._hold[priority]
+                )
+            if self._can_run(priority) and not self._ahead(priority):
+                if key is not None:
+                    self._keys[key] = self._keys.get(key, 0) + 1
+                return self._grant(priority, key, 0.0)
+
+            queue = self._queues[priority]
+            wait = self._expected_wait(priority)
+            if len(queue) >= self.queue_limits[priority]:
+                raise self._reject(priority, 'queue_full', "Server busy; request queue is full", wait)
+            if timeout is not None and wait + self._hold[priority] > timeout:
+                raise self._reject(
+                    priority, 'deadline',
+                    f"Server busy; expected wait of {wait:.1f}s exceeds the request deadline", wait
+                )
+            waiter = _Waiter(priority, key, wake)
+            queue.append(waiter)
+            if key is not None:
+                self._keys[key] = self._keys.get(key, 0) + 1
+            ADMISSION_QUEUE_DEPTH.labels(priority).inc()
+            return waiter
+
+    def _withdraw(self, waiter: _Waiter) -> Optional[Ticket]:
+        """Leave the queue; returns the ticket if the waiter was admitted meanwhile"""
+        with self._lock:
+            if waiter.ticket is not None:
+                return waiter.ticket
+            self._queues[waiter.priority].remove(waiter)
+            ADMISSION_QUEUE_DEPTH.labels(waiter.priority).dec()
+            self._drop_key(waiter.key)
+            return None
+
+    def _timed_out(self, waiter: _Waiter) -> AdmissionRejected:
+        with self._lock:
+            return self._reject(
+                waiter.priority, 'timeout', "Server busy; request deadline passed while queued",
+                self._expected_wait(waiter.priority)
+            )
+
+    def _release(self, ticket: Ticket) -> None:
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            held = time.monotonic() - ticket.acquired
+            self._hold[ticket.priority] += HOLD_SMOOTHING * (held - self._hold[ticket.priority])
+            self._active[ticket.priority] -= 1
+            ADMISSION_ACTIVE.labels(ticket.priority).dec()
+            self._drop_key(ticket.key)
+            self._dispatch()
+
+    def acquire(self, priority: str = 'interactive', key: Optional[str] = None,
+                timeout: Optional[float] = None) -> Ticket:
+        """Take a slot, waiting at most timeout seconds (None: no limit)"""
+        granted = threading.Event()
+        admitted = self._admit(priority, key, timeout, granted.set)
+        if isinstance(admitted, Ticket):
+            return admitted
+        granted.wait(timeout)
+        ticket = self._withdraw(admitted)
+        if ticket is None:
+            raise self._timed_out(admitted)
+        return ticket
+
+    async def acquire_async(self, priority: str = 'interactive', key: Optional[str] = None,
+                            timeout: Optional[float] = None) -> Ticket:
+        """Async counterpart of acquire(); waits without holding a thread"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            # Called with the lock held, possibly from another thread
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        admitted = self._admit(priority, key, timeout, wake)
+        if isinstance(admitted, Ticket):
+            return admitted
+        try:
+            await asyncio.wait({granted}, timeout=timeout)
+        except BaseException:
+            # Cancelled (the client went away): give up the place or the slot
+            ticket = self._withdraw(admitted)
+            if ticket is not None:
+                ticket.release()
+            raise
+        ticket = self._withdraw(admitted)
+        if ticket is None:
+            raise self._timed_out(admitted)
+        return ticket
+
+    def stats(self) -> Dict:
+        """Slot usage, queue depths, waits and rejections by priority"""
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'batch_slots': self.batch_slots,
+                'key_limit': self.key_limit,
+                'keys_active': len(self._keys),
+                'priorities': {
+                    priority: {
+                        'active': self._active[priority],
+                        'queued': len(self._queues[priority]),
+                        'queue_limit': self.queue_limits[priority],
+                        'admitted': self.admitted[priority],
+                        'avg_wait_seconds': round(
+                            self.waited[priority] / self.admitted[priority], 4
+                        ) if self.admitted[priority] else None,
+                        'hold_seconds': round(self._hold[priority], 3),
+                        'expected_wait_seconds': round(self._expected_wait(priority), 3),
+                        'rejected': dict(self.rejected[priority])
+                    }
+                    for priority in PRIORITIES
+                }
+            }
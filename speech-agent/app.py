@@ -1,14 +1,31 @@
-from flask import Flask, request, Response, send_from_directory, jsonify
+from flask import (
+    Flask, request, Response, send_from_directory, jsonify,
+    stream_with_context
+)
+from werkzeug.wsgi import wrap_file
+import hashlib
+import json
 import logging
 import os
-import requests
+import re
 import base64
-import hashlib
-import time
-from pathlib import Path
 
 # Import knowledge base
 from knowledge_base import get_knowledge_base
+import metrics
+import tracing
+from admission import PRIORITIES, AdmissionController, AdmissionRejected
+from batch_jobs import BatchJobs, stream_archive
+from prewarm import Prewarmer, QueryMiner
+from audio_cache import build_audio_cache
+from audio_formats import (
+    MEDIA_TYPES, FormatError, encode_audio, encode_stream, negotiate_format
+)
+from runpod_client import CircuitBreaker, RunPodClient
+from segmentation import split_text, synthesize_segments
+from single_flight import SingleFlight
+from voices import Voice, parse_voice
+from wav_utils import WavStitcher, finalize_wav, stitch_wavs
 
 app = Flask(__name__)
 logging.basicConfig(
@@ -16,6 +33,9 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Under gunicorn the master serves metrics (see gunicorn_config.py)
+metrics.start_server()
+
 # Initialize knowledge base
 kb = get_knowledge_base()
 kb.init_app(app)
@@ -23,107 +43,530 @@ kb.init_app(app)
 # RunPod API endpoint
 RUNPOD_API_ENDPOINT = os.getenv('RUNPOD_API_ENDPOINT')
 RUNPOD_API_KEY = os.getenv('RUNPOD_API_KEY')
+# "runsync" waits on /runsync (falling back to polling); "run" queues the
+# job on /run and polls /status
+RUNPOD_MODE = os.getenv('RUNPOD_MODE', 'runsync')
+RUNPOD_CONNECT_TIMEOUT = float(os.getenv('RUNPOD_CONNECT_TIMEOUT_SECONDS', 3.05))
+RUNPOD_READ_TIMEOUT = float(os.getenv('RUNPOD_READ_TIMEOUT_SECONDS', 30))
+# Keep below the gunicorn worker timeout (120s)
+RUNPOD_JOB_TIMEOUT = float(os.getenv('RUNPOD_JOB_TIMEOUT_SECONDS', 100))
+RUNPOD_MAX_RETRIES = int(os.getenv('RUNPOD_MAX_RETRIES', 3))
+RUNPOD_POOL_SIZE = int(os.getenv('RUNPOD_POOL_SIZE', 32))
+# Initial /status and /stream polling interval; backs off while idle
+RUNPOD_POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL_SECONDS', 0.1))
+RUNPOD_BREAKER_THRESHOLD = int(os.getenv('RUNPOD_BREAKER_THRESHOLD', 5))
+RUNPOD_BREAKER_RESET = float(os.getenv('RUNPOD_BREAKER_RESET_SECONDS', 30))
+
+
+def observe_runpod_result(result):
+    """Record RunPod's timing of a finished job in metrics and on the current trace span"""
+    metrics.observe_runpod_result(result)
+    tracing.annotate(
+        runpod_job_id=result.get('id'),
+        runpod_delay_seconds=result['delayTime'] / 1000 if result.get('delayTime') is not None else None,
+        runpod_execution_seconds=result['executionTime'] / 1000 if result.get('executionTime') is not None else None
+    )
+
+
+# Shared with the async client used by asgi_app.py
+RUNPOD_CLIENT_OPTIONS = {
+    "mode": RUNPOD_MODE,
+    "connect_timeout": RUNPOD_CONNECT_TIMEOUT,
+    "read_timeout": RUNPOD_READ_TIMEOUT,
+    "job_timeout": RUNPOD_JOB_TIMEOUT,
+    "max_retries": RUNPOD_MAX_RETRIES,
+    "poll_interval": RUNPOD_POLL_INTERVAL,
+    "pool_size": RUNPOD_POOL_SIZE,
+    "on_result": observe_runpod_result
+}
+
+runpod = RunPodClient(
+    RUNPOD_API_ENDPOINT,
+    RUNPOD_API_KEY,
+    breaker=CircuitBreaker(RUNPOD_BREAKER_THRESHOLD, RUNPOD_BREAKER_RESET),
+    **RUNPOD_CLIENT_OPTIONS
+)
+
+# Streaming configuration
+STREAMING_ENABLED = os.getenv('STREAMING_ENABLED', 'true').lower() == 'true'
+STREAM_HEADERS = {
+    # Disable proxy buffering so chunks reach the client as they arrive
+    "X-Accel-Buffering": "no",
+    "Cache-Control": "no-cache",
+    "Vary": "Accept"
+}
+
+# Segmentation configuration. Long inputs are split into segments that are
+# synthesized concurrently, so the request limit can exceed the per-job
+# limit enforced by the RunPod worker (1000 characters).
+MAX_TEXT_LENGTH = int(os.getenv('MAX_TEXT_LENGTH', 5000))
+MAX_SEGMENT_CHARS = min(int(os.getenv('MAX_SEGMENT_CHARS', 300)), 1000)
+SEGMENT_CONCURRENCY = int(os.getenv('SEGMENT_CONCURRENCY', 4))
+CROSSFADE_MS = int(os.getenv('CROSSFADE_MS', 0))
+
+# Content-addressed audio. Buffered /tts responses name their audio's URL,
+# /audio/<key>.<ext>, in Content-Location; it is served with ETags and
+# Range support and may be cached at the edge (see deployment/nginx.conf).
+AUDIO_MAX_AGE = int(os.getenv('AUDIO_MAX_AGE_SECONDS', 365 * 86400))
+# Raw PCM has no container to describe its layout, so it gets no URL
+AUDIO_URL_FORMATS = ('wav', 'opus', 'mp3', 'flac')
+AUDIO_NAME = re.compile(r'^([0-9a-f]{32})\.(wav|opus|mp3|flac)$')
+
+# Admission control (see admission.py). Requests that need RunPod take one
+# of ADMISSION_SLOTS per worker; the rest queue by priority or get a 429.
+ADMISSION_SLOTS = int(os.getenv('ADMISSION_SLOTS', 4))
+# Most slots batch work (bulk requests, pre-warming) may hold at once
+ADMISSION_BATCH_SLOTS = int(os.getenv('ADMISSION_BATCH_SLOTS', 2))
+# Under gunicorn's sync workers (see gunicorn_config.py) each queued request
+# holds one of GUNICORN_THREADS threads. By default at most half the threads
+# not holding slots queue, so the rest still serve cache hits and answer
+# 429s once the queue is full; ASGI workers queue without holding threads.
+SERVER_MODE = os.getenv('SERVER_MODE', 'flask')
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 16))
+ADMISSION_INTERACTIVE_QUEUE = int(os.getenv(
+    'ADMISSION_INTERACTIVE_QUEUE',
+    32 if SERVER_MODE == 'asgi' else max(1, (GUNICORN_THREADS - ADMISSION_SLOTS) // 2)
+))
+ADMISSION_BATCH_QUEUE = int(os.getenv('ADMISSION_BATCH_QUEUE', 64))
+# Requests admitted or queued per API key (0: no limit)
+ADMISSION_KEY_CONCURRENCY = int(os.getenv('ADMISSION_KEY_CONCURRENCY', 8))
+# Deadlines of requests without a shorter deadline_ms; kept under the
+# gunicorn worker timeout
+ADMISSION_DEADLINES = {
+    'interactive': float(os.getenv('ADMISSION_INTERACTIVE_DEADLINE_SECONDS', 30)),
+    'batch': float(os.getenv('ADMISSION_BATCH_DEADLINE_SECONDS', 110))
+}
 
+# Request tracing (see tracing.py): Server-Timing on every /tts response;
+# traces slower than TRACE_SLOW_MS, plus a TRACE_SAMPLE_RATE fraction of
+# the rest, are logged/exported as OTLP JSON to TRACE_EXPORT_FILE and/or
+# an OTLP/HTTP collector (e.g. http://collector:4318/v1/traces)
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'true').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 2000))
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE')
+TRACE_EXPORT_ENDPOINT = os.getenv('TRACE_EXPORT_ENDPOINT')
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'speech-agent')
 
-# Cache configuration
-CACHE_DIR = Path("./cache")
-CACHE_DIR.mkdir(exist_ok=True)
+tracer = tracing.Tracer(
+    TRACE_ENABLED,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_seconds=TRACE_SLOW_MS / 1000,
+    exporter=tracing.OTLPExporter(
+        TRACE_SERVICE_NAME, path=TRACE_EXPORT_FILE, endpoint=TRACE_EXPORT_ENDPOINT
+    ) if TRACE_EXPORT_FILE or TRACE_EXPORT_ENDPOINT else None
+)
+
+# Voice and model the worker renders with by default; both are part of
+# the cache key
+TTS_VOICE = os.getenv('TTS_VOICE', 'default')
+TTS_MODEL = os.getenv('TTS_MODEL', 'canopylabs/orpheus-3b-0.1-pretrained')
+# Comma-separated voices and models requests may pick (the worker's
+# TTS_VOICES presets and TTS_MODELS); the defaults are always allowed
+ALLOWED_VOICES = list(dict.fromkeys(
+    [TTS_VOICE] + [name.strip() for name in os.getenv('TTS_ALLOWED_VOICES', '').split(',') if name.strip()]
+))
+ALLOWED_MODELS = list(dict.fromkeys(
+    [TTS_MODEL] + [name.strip() for name in os.getenv('TTS_ALLOWED_MODELS', '').split(',') if name.strip()]
+))
+DEFAULT_VOICE = Voice(TTS_VOICE, TTS_MODEL)
+
+# Cache configuration. Entries are per normalized segment, so requests
+# that share sentences reuse each other's audio.
+CACHE_DIR = os.getenv('CACHE_DIR', './cache')
 # Default: 24 hours
 CACHE_EXPIRATION = int(os.getenv('CACHE_EXPIRATION_SECONDS', 86400))
+# Default: 1 GiB
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 1024 ** 3))
+CACHE_SWEEP_INTERVAL = int(os.getenv('CACHE_SWEEP_INTERVAL_SECONDS', 300))
+# Comma-separated tiers, fastest first: memory, redis, disk
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory,disk')
+MEMORY_CACHE_MAX_BYTES = int(os.getenv('MEMORY_CACHE_MAX_BYTES', 64 * 1024 ** 2))
+MEMORY_CACHE_TTL = int(os.getenv('MEMORY_CACHE_TTL_SECONDS', 300))
+REDIS_URL = os.getenv('REDIS_URL')
+# Pinned entries are never evicted or expired and survive /cache/clear
+CACHE_PIN_DIR = os.getenv('CACHE_PIN_DIR', os.path.join(CACHE_DIR, 'pinned'))
+# Hits on entries expiring within this many seconds re-synthesize them in
+# the background (0 disables refresh-ahead)
+CACHE_REFRESH_AHEAD = float(os.getenv('CACHE_REFRESH_AHEAD_SECONDS', CACHE_EXPIRATION / 10))
 
+# Cache pre-warming (see prewarm.py)
+PREWARM_ENABLED = os.getenv('PREWARM_ENABLED', 'true').lower() == 'true'
+# One phrase per line
+PREWARM_PHRASES_FILE = os.getenv('PREWARM_PHRASES_FILE')
+# Also keep the most frequent requests warm (0 disables)
+PREWARM_TOP_QUERIES = int(os.getenv('PREWARM_TOP_QUERIES', 100))
+PREWARM_MIN_COUNT = int(os.getenv('PREWARM_MIN_COUNT', 3))
+# Texts per second sent to RunPod, and texts per batch job
+PREWARM_RATE = float(os.getenv('PREWARM_RATE', 1.0))
+PREWARM_BATCH_SIZE = int(os.getenv('PREWARM_BATCH_SIZE', 8))
+# Off-peak window for scheduled runs, local time, e.g. "02:00-05:00"
+# (empty: any time)
+PREWARM_WINDOW = os.getenv('PREWARM_WINDOW', '')
+PREWARM_INTERVAL = float(os.getenv('PREWARM_INTERVAL_SECONDS', 3600))
+
+# Batch jobs (POST /tts/batch, see batch_jobs.py); their state is kept in
+# files so any worker can report on them
+BATCH_JOB_DIR = os.getenv('BATCH_JOB_DIR', os.path.join(CACHE_DIR, 'batch-jobs'))
+BATCH_JOB_MAX_TEXTS = int(os.getenv('BATCH_JOB_MAX_TEXTS', 10000))
+# RunPod batch jobs in flight per job (each also needs a batch admission
+# slot), and segments per RunPod batch job
+BATCH_JOB_CONCURRENCY = int(os.getenv('BATCH_JOB_CONCURRENCY', 4))
+BATCH_JOB_BATCH_SIZE = int(os.getenv('BATCH_JOB_BATCH_SIZE', 16))
+BATCH_JOB_RETENTION = float(os.getenv('BATCH_JOB_RETENTION_SECONDS', 7 * 86400))
+
+audio_cache = build_audio_cache(
+    CACHE_BACKEND,
+    CACHE_EXPIRATION,
+    cache_dir=CACHE_DIR,
+    max_bytes=CACHE_MAX_BYTES,
+    sweep_interval=CACHE_SWEEP_INTERVAL,
+    memory_max_bytes=MEMORY_CACHE_MAX_BYTES,
+    memory_ttl=MEMORY_CACHE_TTL,
+    redis_url=REDIS_URL,
+    pinned_dir=CACHE_PIN_DIR
+)
+
+# Concurrent misses for the same audio share one RunPod job. With the redis
+# tier configured this also holds across workers and hosts.
+SINGLE_FLIGHT_LEASE = float(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', 120))
+redis_tier = audio_cache.tier('redis')
+flight = SingleFlight(
+    redis_tier.client if redis_tier else None,
+    lease_ttl=SINGLE_FLIGHT_LEASE
+)
+
+admission = AdmissionController(
+    ADMISSION_SLOTS,
+    batch_slots=ADMISSION_BATCH_SLOTS,
+    queue_limits={
+        'interactive': ADMISSION_INTERACTIVE_QUEUE,
+        'batch': ADMISSION_BATCH_QUEUE
+    },
+    key_limit=ADMISSION_KEY_CONCURRENCY
+)
 
-def get_cached_audio(text):
-    """Get cached audio if available"""
-    text_hash = hashlib.md5(text.encode()).hexdigest()
-    cache_file = CACHE_DIR / f"{text_hash}.wav"
-    meta_file = CACHE_DIR / f"{text_hash}.meta"
-    
-    if cache_file.exists() and meta_file.exists():
-        # Check if cache is expired
-        try:
-            with open(meta_file, 'r') as f:
-                timestamp = float(f.read().strip())
-            
-            if time.time() - timestamp <= CACHE_EXPIRATION:
-                truncated = text[:50] + ('...' if len(text) > 50 else '')
-                logging.info(f"Cache hit for: {truncated}")
-                return cache_file.read_bytes()
-            else:
-                truncated = text[:50] + ('...' if len(text) > 50 else '')
-                logging.info(f"Cache expired for: {truncated}")
-                # Delete expired files
-                cache_file.unlink(missing_ok=True)
-                meta_file.unlink(missing_ok=True)
-        except Exception as e:
-            logging.error(f"Error reading cache metadata: {e}")
-            # Delete corrupted files
-            cache_file.unlink(missing_ok=True)
-            meta_file.unlink(missing_ok=True)
-    
-    return None
+
+def get_cached_audio(text, voice=DEFAULT_VOICE):
+    """Get cached audio if available, refreshing it in the background if it's about to expire"""
+    key = voice.cache_key(text)
+    with tracing.span('cache-lookup') as span:
+        audio_data, expires_in = audio_cache.get_with_expiry(key)
+        span.set(hit=audio_data is not None)
+    if audio_data is not None:
+        truncated = text[:50] + ('...' if len(text) > 50 else '')
+        logging.info(f"Cache hit for: {truncated}")
+        prewarmer.maybe_refresh(key, expires_in, lambda: refresh_audio(text, voice))
+    return audio_data
 
 
-def cache_audio(text, audio_data):
+def cache_audio(text, audio_data, voice=DEFAULT_VOICE):
     """Cache audio data"""
-    text_hash = hashlib.md5(text.encode()).hexdigest()
-    cache_file = CACHE_DIR / f"{text_hash}.wav"
-    meta_file = CACHE_DIR / f"{text_hash}.meta"
-    
-    # Write audio data
-    with open(cache_file, 'wb') as f:
-        f.write(audio_data)
-    
-    # Write timestamp for expiration
-    with open(meta_file, 'w') as f:
-        f.write(str(time.time()))
+    with tracing.span('cache-store', bytes=len(audio_data)):
+        audio_cache.set(voice.cache_key(text), audio_data)
     
     truncated = text[:50] + ('...' if len(text) > 50 else '')
     logging.info(f"Cached audio for: {truncated}")
 
 
-def generate_tts_from_runpod(text):
+def generate_tts_from_runpod(text, voice=DEFAULT_VOICE):
     """Generate TTS using RunPod serverless API"""
     try:
         # Check cache first
-        cached_audio = get_cached_audio(text)
+        cached_audio = get_cached_audio(text, voice)
         if cached_audio:
             return cached_audio
         
-        # Call RunPod API
-        headers = {
-            "Authorization": f"Bearer {RUNPOD_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        payload = {"input": {"text": text}}
-        
-        truncated = text[:50] + ('...' if len(text) > 50 else '')
-        logging.info(f"Calling RunPod API for: {truncated}")
-        response = requests.post(
-            RUNPOD_API_ENDPOINT, headers=headers, json=payload
+        # Identical concurrent requests wait for the first one's result
+        key = voice.cache_key(text)
+        return flight.do(
+            key,
+            lambda: _call_runpod(text, voice),
+            lookup=lambda: audio_cache.get(key)
         )
-        
-        if response.status_code != 200:
-            logging.error(f"RunPod API error: {response.text}")
-            raise Exception(f"RunPod API error: {response.status_code}")
-        
-        result = response.json()
-        
-        if "error" in result:
-            logging.error(f"RunPod processing error: {result['error']}")
-            raise Exception(result["error"])
-        
-        # Decode base64 audio
-        audio_data = base64.b64decode(result["audio"])
-        
-        # Cache the result
-        cache_audio(text, audio_data)
-        
-        return audio_data
     except Exception as e:
         logging.error(f"Error in TTS generation: {e}")
         raise
 
 
+def _call_runpod(text, voice=DEFAULT_VOICE):
+    """Synthesize text with one RunPod job and cache the result"""
+    truncated = text[:50] + ('...' if len(text) > 50 else '')
+    logging.info(f"Calling RunPod API for: {truncated}")
+    with tracing.span('runpod', operation='synthesize') as span, metrics.runpod_call('synthesize'):
+        output = runpod.synthesize(tracing.inject({"text": text, **voice.job_input(DEFAULT_VOICE)}))
+        tracing.add_worker_stages(output.get("meta", {}).get("stages"), span)
+    metrics.observe_worker_meta(output.get("meta"))
+    
+    # Decode base64 audio
+    with tracing.span('base64-decode'):
+        audio_data = base64.b64decode(output["audio"])
+    
+    # Cache the result
+    cache_audio(text, audio_data, voice)
+    
+    return audio_data
+
+
+def refresh_audio(text, voice=DEFAULT_VOICE):
+    """Synthesize text again ahead of its cache entry expiring, as batch work"""
+    with admission.acquire('batch'):
+        return _call_runpod(text, voice)
+
+
+def queued_batch(texts, voice=DEFAULT_VOICE):
+    """synthesize_batch as batch work (pre-warming, batch jobs), which waits for a batch slot"""
+    with admission.acquire('batch'):
+        return synthesize_batch(texts, voice)
+
+
+def synthesize_batch(texts, voice=DEFAULT_VOICE):
+    """Synthesize texts in one RunPod batch job; returns the audio of each (None if it failed)"""
+    with tracing.span('runpod', operation='batch', texts=len(texts)), metrics.runpod_call('batch'):
+        output = runpod.synthesize(tracing.inject({"texts": texts, **voice.job_input(DEFAULT_VOICE)}))
+    results = []
+    for result in output.get("results", []):
+        metrics.observe_worker_meta(result.get("meta"))
+        if "audio" in result:
+            results.append(base64.b64decode(result["audio"]))
+        else:
+            logging.error(f"RunPod batch item failed: {result.get('error')}")
+            results.append(None)
+    return results
+
+
+def stream_tts_from_runpod(text, voice=DEFAULT_VOICE):
+    """Yield audio chunks from RunPod as the worker produces them"""
+    truncated = text[:50] + ('...' if len(text) > 50 else '')
+    logging.info(f"Streaming from RunPod API for: {truncated}")
+    with tracing.span('runpod', operation='stream') as span, metrics.runpod_call('stream'):
+        job_input = {"text": text, "stream": True, **voice.job_input(DEFAULT_VOICE)}
+        for output in runpod.stream(tracing.inject(job_input)):
+            if "chunk" in output:
+                yield base64.b64decode(output["chunk"])
+            elif output.get("done"):
+                tracing.add_worker_stages(output.get("meta", {}).get("stages"), span)
+                metrics.observe_worker_meta(output.get("meta"))
+
+
+def _stream_into_cache(text, voice=DEFAULT_VOICE):
+    """Stream audio from RunPod, caching it once the job completes"""
+    audio_chunks = []
+    for chunk in stream_tts_from_runpod(text, voice):
+        audio_chunks.append(chunk)
+        yield chunk
+    cache_audio(text, finalize_wav(b''.join(audio_chunks)), voice)
+
+
+def stream_and_cache(text, voice=DEFAULT_VOICE):
+    """Relay streamed audio to the client; concurrent requests share the stream"""
+    key = voice.cache_key(text)
+    audio_size = 0
+    try:
+        # Produced on another thread, which continues this request's trace
+        for chunk in flight.stream(
+            key,
+            tracing.bind(lambda: tracing.stream(_stream_into_cache(text, voice))),
+            lookup=lambda: audio_cache.get(key)
+        ):
+            audio_size += len(chunk)
+            yield chunk
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated stream
+        logging.error(f"Error while streaming TTS: {e}")
+        return
+    
+    record_tts_interaction(text, audio_size)
+
+
+def synthesize_text(segments, cached, voice=DEFAULT_VOICE):
+    """
+    Assemble audio for a request from its segments, synthesizing only the
+    segments missing from the cache (each is cached as it completes)
+    """
+    if len(segments) == 1:
+        return cached[0] or generate_tts_from_runpod(segments[0], voice)
+    
+    generate = tracing.bind(lambda segment: generate_tts_from_runpod(segment, voice))
+    return stitch_wavs(
+        synthesize_segments(segments, generate, SEGMENT_CONCURRENCY, cached),
+        CROSSFADE_MS
+    )
+
+
+def stream_segments(text, segments, cached, voice=DEFAULT_VOICE):
+    """Relay each segment to the client as soon as it and its predecessors are ready"""
+    stitcher = WavStitcher(CROSSFADE_MS)
+    audio_size = 0
+    hits = sum(1 for audio in cached if audio is not None)
+    generate = tracing.bind(lambda segment: generate_tts_from_runpod(segment, voice))
+    try:
+        for segment_audio in synthesize_segments(segments, generate, SEGMENT_CONCURRENCY, cached):
+            chunk = stitcher.feed(segment_audio)
+            audio_size += len(chunk)
+            yield chunk
+        chunk = stitcher.finish()
+        audio_size += len(chunk)
+        yield chunk
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated stream
+        logging.error(f"Error while streaming segmented TTS: {e}")
+        return
+    
+    record_tts_interaction(text, audio_size, len(segments), hits)
+
+
+def recheck_cache(segments, cached, voice=DEFAULT_VOICE):
+    """cached with the segments that were missing looked up again"""
+    with tracing.span('cache-lookup', recheck=True):
+        return [
+            audio if audio is not None else audio_cache.get(voice.cache_key(segment))
+            for segment, audio in zip(segments, cached)
+        ]
+
+
+def negotiate_output(data):
+    """
+    Resolve the response format from the request's format, sample_rate
+    and bit_depth fields or its Accept header. Returns (format, None) or
+    (None, error response).
+    """
+    try:
+        return negotiate_format(
+            request.headers.get('Accept'),
+            data.get('format'),
+            data.get('sample_rate'),
+            data.get('bit_depth')
+        ), None
+    except FormatError as e:
+        # An explicit format field is a bad request; Accept is negotiation
+        return None, (str(e), 400 if data.get('format') else 406)
+
+
+def validate_tts_text(text):
+    """Return an error message if text can't be synthesized, else None"""
+    if not text:
+        return "No text provided"
+    if len(text) > MAX_TEXT_LENGTH:
+        return f"Text too long. Maximum {MAX_TEXT_LENGTH} characters allowed."
+    return None
+
+
+def admission_options(data, headers):
+    """
+    (priority, deadline in seconds, API key) of a request, from its
+    priority and deadline_ms fields and its X-API-Key header or bearer
+    token. Raises ValueError on invalid fields.
+    """
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    deadline = ADMISSION_DEADLINES[priority]
+    deadline_ms = data.get('deadline_ms')
+    if deadline_ms is not None:
+        if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0:
+            raise ValueError("deadline_ms must be a positive number")
+        deadline = min(deadline, deadline_ms / 1000)
+    key = headers.get('X-API-Key')
+    authorization = headers.get('Authorization', '')
+    if not key and authorization.startswith('Bearer '):
+        key = authorization[len('Bearer '):].strip()
+    return priority, deadline, key or None
+
+
+def rejected_headers(e):
+    """Headers of the 429 sent for an AdmissionRejected"""
+    return {"Retry-After": str(e.retry_after)}
+
+
+def response_audio_key(segments, fmt, voice=DEFAULT_VOICE):
+    """
+    (key, whole) of a buffered response's /audio URL. One segment of WAV
+    is served straight from that segment's cache entry (whole is False);
+    anything else is cached whole under a key derived from its segment
+    keys and format. (None, False) for formats without URLs.
+    """
+    if fmt.name not in AUDIO_URL_FORMATS:
+        return None, False
+    keys = [voice.cache_key(segment) for segment in segments]
+    if len(keys) == 1 and fmt.is_default:
+        return keys[0], False
+    parts = keys + [fmt.name, str(fmt.sample_rate or ''), str(fmt.bit_depth or ''), str(CROSSFADE_MS)]
+    return hashlib.md5('\x1f'.join(parts).encode()).hexdigest(), True
+
+
+def audio_headers(fmt, key):
+    """Headers of a buffered /tts response whose audio is cached under key"""
+    headers = {"Vary": "Accept"}
+    if key is not None:
+        headers["Content-Location"] = f"/audio/{key}.{fmt.name}"
+    return headers
+
+
+def record_tts_interaction(text, audio_size, segments=1, cached_segments=0):
+    """Record a TTS request, and how many of its segments were cached, in the knowledge base"""
+    trace = tracing.current_trace()
+    with tracing.span('kb-record'):
+        kb.record_interaction(
+            query=text,
+            response="[Audio response generated]",
+            metadata={
+                "type": "tts_request",
+                "text_length": len(text),
+                "audio_size": audio_size,
+                "segments": segments,
+                "cached_segments": cached_segments,
+                "trace_id": trace.trace_id if trace else None
+            }
+        )
+
+
+def phrase_segments(phrase, voice=DEFAULT_VOICE):
+    """(segment, cache key) pairs a phrase is cached as"""
+    return [
+        (segment, voice.cache_key(segment))
+        for segment in split_text(phrase, MAX_SEGMENT_CHARS)
+    ]
+
+
+prewarmer = Prewarmer(
+    audio_cache,
+    phrase_segments,
+    queued_batch,
+    CACHE_PIN_DIR,
+    phrases_file=PREWARM_PHRASES_FILE,
+    miner=QueryMiner(kb.log),
+    top_queries=PREWARM_TOP_QUERIES,
+    min_count=PREWARM_MIN_COUNT,
+    rate=PREWARM_RATE,
+    batch_size=PREWARM_BATCH_SIZE,
+    window=PREWARM_WINDOW,
+    interval=PREWARM_INTERVAL,
+    refresh_ahead=CACHE_REFRESH_AHEAD
+)
+if PREWARM_ENABLED:
+    prewarmer.ensure_running()
+
+
+def render_audio(parts, fmt):
+    """A response's audio from its segments' audio, as synthesize_text assembles it"""
+    audio_data = parts[0] if len(parts) == 1 else stitch_wavs(parts, CROSSFADE_MS)
+    return encode_audio(audio_data, fmt)
+
+
+batch_jobs = BatchJobs(
+    BATCH_JOB_DIR,
+    audio_cache,
+    phrase_segments,
+    queued_batch,
+    response_audio_key,
+    render_audio,
+    concurrency=BATCH_JOB_CONCURRENCY,
+    batch_size=BATCH_JOB_BATCH_SIZE,
+    retention=BATCH_JOB_RETENTION
+)
+
+
 @app.route('/')
 def index():
     return send_from_directory('.', 'index.html')
@@ -131,53 +574,329 @@ def index():
 
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
+    if PREWARM_ENABLED:
+        # Takes over the schedule if the worker running it died
+        prewarmer.ensure_running()
+    trace, token = tracer.start('tts', request.headers.get('traceparent'))
+    request_metrics = metrics.TTSRequestMetrics(on_finish=lambda status: tracer.finish(trace, status))
+    try:
+        try:
+            response = app.make_response(_text_to_speech(request_metrics))
+        except Exception:
+            request_metrics.finish(500)
+            raise
+        # Streams only show the stages done before their first byte
+        response.headers.extend(tracer.headers(trace))
+        if not request_metrics.streaming:
+            audio_bytes = response.calculate_content_length() if response.status_code == 200 else 0
+            request_metrics.first_byte()
+            request_metrics.finish(response.status_code, audio_bytes or 0)
+        metrics.sync_cache_stats(audio_cache.stats)
+        return response
+    finally:
+        if token is not None:
+            tracing.detach(token)
+
+
+def _text_to_speech(request_metrics):
     try:
-        text = request.json.get('text', '')
-        if not text:
+        data = request.json
+        text = data.get('text', '')
+        stream = data.get('stream', STREAMING_ENABLED)
+        error = validate_tts_text(text)  # Input validation
+        if error:
+            return error, 400
+        
+        fmt, error = negotiate_output(data)
+        if error:
+            return error
+        request_metrics.format = fmt.name
+        
+        try:
+            priority, deadline, api_key = admission_options(data, request.headers)
+            voice = parse_voice(data, DEFAULT_VOICE, ALLOWED_VOICES, ALLOWED_MODELS)
+        except ValueError as e:
+            return str(e), 400
+        
+        segments = split_text(text, MAX_SEGMENT_CHARS)
+        if not segments:
             return "No text provided", 400
-        if len(text) > 1000:  # Input validation
-            return "Text too long. Maximum 1000 characters allowed.", 400
+        
+        # Responses cached whole are served without assembling them again
+        audio_key, whole = response_audio_key(segments, fmt, voice)
+        if whole:
+            with tracing.span('cache-lookup', whole=True) as span:
+                audio_data = audio_cache.get(audio_key)
+                span.set(hit=audio_data is not None)
+            if audio_data is not None:
+                record_tts_interaction(text, len(audio_data), len(segments), len(segments))
+                return Response(
+                    audio_data, mimetype=fmt.media_type, headers=audio_headers(fmt, audio_key)
+                )
+        
+        # Look up every segment; only the misses go to RunPod
+        cached = [get_cached_audio(segment, voice) for segment in segments]
+        hits = sum(1 for audio in cached if audio is not None)
+        if len(segments) > 1:
+            logging.info(f"{hits}/{len(segments)} segments served from cache")
+        
+        # Fully cached requests skip the queue; the rest wait for a slot
+        ticket = None
+        if hits < len(segments):
+            try:
+                with tracing.span('admission', priority=priority):
+                    ticket = admission.acquire(priority, api_key, deadline)
+            except AdmissionRejected as e:
+                return str(e), 429, rejected_headers(e)
+            # Requests queued behind identical ones find their audio cached by now
+            cached = recheck_cache(segments, cached, voice)
+            hits = sum(1 for audio in cached if audio is not None)
+            if hits == len(segments):
+                ticket.release()
+                ticket = None
+        
+        # Stream misses straight through; hits are served in one piece
+        if stream and ticket is not None:
+            if len(segments) == 1:
+                body = stream_and_cache(segments[0], voice)
+            else:
+                body = stream_segments(text, segments, cached, voice)
+            response = Response(
+                stream_with_context(tracing.stream(request_metrics.stream(encode_stream(body, fmt)))),
+                mimetype=fmt.media_type,
+                headers=STREAM_HEADERS
+            )
+            # The slot is held until the stream ends, however it ends
+            response.call_on_close(ticket.release)
+            return response
         
         # Generate audio
-        audio_data = generate_tts_from_runpod(text)
+        try:
+            with tracing.span('synthesize', segments=len(segments), cached=hits):
+                audio_data = synthesize_text(segments, cached, voice)
+        finally:
+            if ticket is not None:
+                ticket.release()
         
         # Record the interaction in the knowledge base
-        kb.record_interaction(
-            query=text,
-            response="[Audio response generated]",
-            metadata={
-                "type": "tts_request",
-                "text_length": len(text),
-                "audio_size": len(audio_data)
-            }
-        )
+        record_tts_interaction(text, len(audio_data), len(segments), hits)
         
-        return Response(audio_data, mimetype='audio/wav')
+        with tracing.span('encode', format=fmt.name):
+            audio_data = encode_audio(audio_data, fmt)
+        if whole:
+            with tracing.span('cache-store', bytes=len(audio_data)):
+                audio_cache.set(audio_key, audio_data)
+        return Response(
+            audio_data,
+            mimetype=fmt.media_type,
+            headers=audio_headers(fmt, audio_key)
+        )
     except Exception as e:
         logging.error(f"Error in TTS endpoint: {e}")
         return "Internal server error", 500
 
 
+@app.route('/tts/batch', methods=['POST'])
+def submit_tts_batch():
+    """
+    Start rendering a "texts" list in the background. Takes the same
+    format, sample_rate, bit_depth, voice, model and speed fields as
+    /tts; responds 202 with the job, whose progress is at its Location.
+    """
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not texts or not all(isinstance(text, str) for text in texts):
+        return {"error": "texts must be a non-empty list of strings"}, 400
+    if len(texts) > BATCH_JOB_MAX_TEXTS:
+        return {"error": f"Too many texts. Maximum {BATCH_JOB_MAX_TEXTS} per job."}, 400
+    for index, text in enumerate(texts):
+        error = validate_tts_text(text)
+        if error:
+            return {"error": f"texts[{index}]: {error}"}, 400
+    
+    try:
+        fmt = negotiate_format(None, data.get('format'), data.get('sample_rate'), data.get('bit_depth'))
+    except FormatError as e:
+        return {"error": str(e)}, 400
+    if fmt.name not in AUDIO_URL_FORMATS:
+        return {"error": f"Batch jobs support: {', '.join(AUDIO_URL_FORMATS)}"}, 400
+    try:
+        voice = parse_voice(data, DEFAULT_VOICE, ALLOWED_VOICES, ALLOWED_MODELS)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
+    job = batch_jobs.submit(texts, fmt, voice)
+    logging.info(f"Batch job {job['id']} submitted: {len(texts)} texts as {fmt.name}")
+    return batch_job_summary(job), 202, {"Location": f"/tts/batch/{job['id']}"}
+
+
+def batch_job_summary(job):
+    """A job's state without its per-text results"""
+    summary = {name: value for name, value in job.items() if name != 'results'}
+    summary['status_url'] = f"/tts/batch/{job['id']}"
+    summary['archive_url'] = f"/tts/batch/{job['id']}/archive"
+    return summary
+
+
+@app.route('/tts/batch/<job_id>', methods=['GET'])
+def tts_batch_status(job_id):
+    """
+    A batch job's progress, and each text's status and /audio URL once
+    done. ?results=false leaves the per-text results out.
+    """
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return {"error": "No such batch job"}, 404
+    summary = batch_job_summary(job)
+    if request.args.get('results', 'true').lower() != 'false':
+        summary['results'] = job['results']
+    return jsonify(summary), 200
+
+
+@app.route('/tts/batch/<job_id>/archive', methods=['GET'])
+def tts_batch_archive(job_id):
+    """
+    A finished batch job's audio as a zip, streamed as it's read from the
+    cache: one file per text, named by its index, plus manifest.json
+    """
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return {"error": "No such batch job"}, 404
+    if job['status'] in ('queued', 'running'):
+        return {"error": "Batch job is still running"}, 409, {"Retry-After": "10"}
+    texts = batch_jobs.texts(job_id)
+    ext = job['format']['name']
+    
+    def entries():
+        manifest = []
+        for index, (text, result) in enumerate(zip(texts, job['results'])):
+            entry = {"index": index, "text": text, "status": result['status']}
+            audio_data = audio_cache.get(result['key']) if result['status'] == 'done' else None
+            if audio_data is not None:
+                entry["file"] = f"{index:05d}.{ext}"
+                yield entry["file"], audio_data
+            elif result['status'] == 'done':
+                entry.update(status="failed", error="Audio is no longer cached")
+            else:
+                entry["error"] = result.get('error')
+            manifest.append(entry)
+        yield "manifest.json", json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8')
+    
+    return Response(
+        stream_with_context(stream_archive(entries())),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="tts-batch-{job_id}.zip"'}
+    )
+
+
+@app.route('/audio/<name>', methods=['GET'])
+def cached_audio(name):
+    """
+    Serve cached audio at the content address /tts gave it, with a strong
+    ETag, conditional and Range requests and long-lived caching. Files are
+    handed to the server's sendfile (wsgi.file_wrapper) when whole.
+    """
+    match = AUDIO_NAME.match(name)
+    if not match:
+        return "Not found", 404
+    key, ext = match.groups()
+    
+    response = None
+    path = audio_cache.file_path(key)
+    if path is not None:
+        try:
+            audio_file = open(path, 'rb')
+        except FileNotFoundError:
+            # Evicted since it was looked up
+            audio_file = None
+        if audio_file is not None:
+            # Described from the open file, which a rewrite can't change
+            stat = os.fstat(audio_file.fileno())
+            response = Response(
+                wrap_file(request.environ, audio_file),
+                mimetype=MEDIA_TYPES[ext],
+                direct_passthrough=True
+            )
+            response.content_length = size = stat.st_size
+            response.last_modified = stat.st_mtime
+            response.set_etag(f"{key}-{stat.st_mtime_ns:x}-{size:x}")
+    if response is None:
+        # Only in tiers without files (memory, redis)
+        audio_data = audio_cache.get(key)
+        if audio_data is None:
+            return "Not found", 404
+        response = Response(audio_data, mimetype=MEDIA_TYPES[ext])
+        size = len(audio_data)
+        response.set_etag(hashlib.md5(audio_data).hexdigest())
+    
+    response.cache_control.public = True
+    response.cache_control.max_age = AUDIO_MAX_AGE
+    response.cache_control.immutable = True
+    # Announced on full responses too, so players know they can seek
+    response.accept_ranges = 'bytes'
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+
 @app.route('/cache/clear', methods=['POST'])
 def clear_cache():
     """Endpoint to clear the cache"""
     try:
-        # Delete all files in cache directory
-        count = 0
-        for file in CACHE_DIR.glob('*'):
-            file.unlink()
-            count += 1
+        count = audio_cache.clear()
         
-        logging.info(f"Cleared {count} files from cache")
+        logging.info(f"Cleared {count} entries from cache")
         return {
             "success": True,
-            "message": f"Cleared {count} files from cache"
+            "message": f"Cleared {count} entries from cache",
+            "pinned_kept": len(audio_cache.pinned_keys())
         }, 200
     except Exception as e:
         logging.error(f"Error clearing cache: {e}")
         return {"success": False, "error": str(e)}, 500
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Endpoint to report cache occupancy and hit/miss/eviction counters"""
+    stats = audio_cache.stats()
+    stats['single_flight'] = flight.stats()
+    stats['prewarm'] = prewarmer.stats()
+    return jsonify(stats), 200
+
+
+@app.route('/cache/prewarm', methods=['GET', 'POST'])
+def prewarm_cache():
+    """
+    POST starts a pre-warming run now, of the configured phrases or of a
+    "phrases" list; GET reports on the last run
+    """
+    if request.method == 'GET':
+        return jsonify(prewarmer.stats()), 200
+    data = request.get_json(silent=True) or {}
+    phrases = data.get('phrases')
+    if phrases is not None:
+        if not isinstance(phrases, list) or not all(isinstance(phrase, str) for phrase in phrases):
+            return {"error": "phrases must be a list of strings"}, 400
+        for phrase in phrases:
+            error = validate_tts_text(phrase)
+            if error:
+                return {"error": error}, 400
+    if not prewarmer.trigger(phrases):
+        return {"error": "A pre-warming run is already in progress"}, 409
+    return jsonify(prewarmer.stats()), 202
+
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """Endpoint to report synthesis slot usage, queue depths and rejections"""
+    return jsonify(admission.stats()), 200
+
+
+@app.route('/trace/stats', methods=['GET'])
+def trace_stats():
+    """Endpoint to report tracing settings, slow requests and export counts"""
+    return jsonify(tracer.stats()), 200
+
+
 @app.route('/knowledge', methods=['GET'])
 def knowledge_dashboard():
     """Simple dashboard for the knowledge base"""
@@ -0,0 +1,350 @@
+"""
+asyncio serving mode for the speech agent.
+
+Serves /tts and the cache endpoints natively on Starlette, with RunPod
+calls made through AsyncRunPodClient and cache and knowledge-base I/O run
+in a thread pool, so one worker can hold hundreds of pending syntheses
+without a thread each. Every other route (/, /knowledge/*) is delegated to
+the Flask app through WSGIMiddleware, so both modes expose the same API.
+
+Configuration, caches and the knowledge base are shared with app.py.
+Run with SERVER_MODE=asgi (see gunicorn_config.py) or directly:
+
+    uvicorn asgi_app:app --port 8000
+"""
+import base64
+import logging
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_app
+import metrics
+import tracing
+from admission import AdmissionRejected
+from audio_formats import AudioEncoder, FormatError, encode_audio, negotiate_format
+from app import (
+    ALLOWED_MODELS, ALLOWED_VOICES, CROSSFADE_MS, DEFAULT_VOICE,
+    MAX_SEGMENT_CHARS, RUNPOD_API_ENDPOINT, RUNPOD_API_KEY,
+    RUNPOD_BREAKER_RESET, RUNPOD_BREAKER_THRESHOLD, RUNPOD_CLIENT_OPTIONS,
+    SEGMENT_CONCURRENCY, SINGLE_FLIGHT_LEASE, STREAM_HEADERS,
+    STREAMING_ENABLED, admission, admission_options, audio_cache,
+    audio_headers, cache_audio, get_cached_audio, recheck_cache,
+    record_tts_interaction, redis_tier, rejected_headers, response_audio_key,
+    tracer, validate_tts_text
+)
+from runpod_client import AsyncRunPodClient, CircuitBreaker
+from segmentation import split_text, synthesize_segments_async
+from single_flight import AsyncSingleFlight
+from voices import parse_voice
+from wav_utils import WavStitcher, finalize_wav, stitch_wavs
+
+
+runpod = AsyncRunPodClient(
+    RUNPOD_API_ENDPOINT,
+    RUNPOD_API_KEY,
+    breaker=CircuitBreaker(RUNPOD_BREAKER_THRESHOLD, RUNPOD_BREAKER_RESET),
+    **RUNPOD_CLIENT_OPTIONS
+)
+flight = AsyncSingleFlight(
+    redis_tier.client if redis_tier else None,
+    lease_ttl=SINGLE_FLIGHT_LEASE
+)
+
+
+async def lookup_audio(key):
+    """Read a cache entry without blocking the event loop"""
+    return await run_in_threadpool(audio_cache.get, key)
+
+
+async def generate_tts(text, voice=DEFAULT_VOICE):
+    """Async counterpart of app.generate_tts_from_runpod"""
+    try:
+        cached_audio = await run_in_threadpool(get_cached_audio, text, voice)
+        if cached_audio:
+            return cached_audio
+
+        key = voice.cache_key(text)
+        return await flight.do(
+            key,
+            lambda: _call_runpod(text, voice),
+            lookup=lambda: lookup_audio(key)
+        )
+    except Exception as e:
+        logging.error(f"Error in TTS generation: {e}")
+        raise
+
+
+async def _call_runpod(text, voice=DEFAULT_VOICE):
+    """Synthesize text with one RunPod job and cache the result"""
+    truncated = text[:50] + ('...' if len(text) > 50 else '')
+    logging.info(f"Calling RunPod API for: {truncated}")
+    with tracing.span('runpod', operation='synthesize') as span, metrics.runpod_call('synthesize'):
+        output = await runpod.synthesize(tracing.inject({"text": text, **voice.job_input(DEFAULT_VOICE)}))
+        tracing.add_worker_stages(output.get("meta", {}).get("stages"), span)
+    metrics.observe_worker_meta(output.get("meta"))
+    with tracing.span('base64-decode'):
+        audio_data = base64.b64decode(output["audio"])
+    await run_in_threadpool(cache_audio, text, audio_data, voice)
+    return audio_data
+
+
+async def _stream_into_cache(text, voice=DEFAULT_VOICE):
+    """Stream audio from RunPod, caching it once the job completes"""
+    truncated = text[:50] + ('...' if len(text) > 50 else '')
+    logging.info(f"Streaming from RunPod API for: {truncated}")
+    audio_chunks = []
+    with tracing.span('runpod', operation='stream') as span, metrics.runpod_call('stream'):
+        job_input = {"text": text, "stream": True, **voice.job_input(DEFAULT_VOICE)}
+        async for output in runpod.stream(tracing.inject(job_input)):
+            if "chunk" in output:
+                chunk = base64.b64decode(output["chunk"])
+                audio_chunks.append(chunk)
+                yield chunk
+            elif output.get("done"):
+                tracing.add_worker_stages(output.get("meta", {}).get("stages"), span)
+                metrics.observe_worker_meta(output.get("meta"))
+    await run_in_threadpool(cache_audio, text, finalize_wav(b''.join(audio_chunks)), voice)
+
+
+async def stream_and_cache(text, voice=DEFAULT_VOICE):
+    """Relay streamed audio to the client; concurrent requests share the stream"""
+    key = voice.cache_key(text)
+    audio_size = 0
+    try:
+        async for chunk in flight.stream(
+            key,
+            lambda: _stream_into_cache(text, voice),
+            lookup=lambda: lookup_audio(key)
+        ):
+            audio_size += len(chunk)
+            yield chunk
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated stream
+        logging.error(f"Error while streaming TTS: {e}")
+        return
+
+    await run_in_threadpool(record_tts_interaction, text, audio_size)
+
+
+async def stream_segments(text, segments, cached, voice=DEFAULT_VOICE):
+    """Relay each segment as soon as it and its predecessors are ready"""
+    stitcher = WavStitcher(CROSSFADE_MS)
+    audio_size = 0
+    hits = sum(1 for audio in cached if audio is not None)
+    try:
+        async for segment_audio in synthesize_segments_async(
+            segments, lambda segment: generate_tts(segment, voice), SEGMENT_CONCURRENCY, cached
+        ):
+            chunk = stitcher.feed(segment_audio)
+            audio_size += len(chunk)
+            yield chunk
+        chunk = stitcher.finish()
+        audio_size += len(chunk)
+        yield chunk
+    except Exception as e:
+        logging.error(f"Error while streaming segmented TTS: {e}")
+        return
+
+    await run_in_threadpool(record_tts_interaction, text, audio_size, len(segments), hits)
+
+
+async def synthesize_text(segments, cached, voice=DEFAULT_VOICE):
+    """Async counterpart of app.synthesize_text"""
+    if len(segments) == 1:
+        return cached[0] or await generate_tts(segments[0], voice)
+
+    parts = [
+        audio async for audio in synthesize_segments_async(
+            segments, lambda segment: generate_tts(segment, voice), SEGMENT_CONCURRENCY, cached
+        )
+    ]
+    return stitch_wavs(parts, CROSSFADE_MS)
+
+
+async def encode_stream(chunks, fmt):
+    """Async counterpart of audio_formats.encode_stream"""
+    if fmt.is_default:
+        async for chunk in chunks:
+            yield chunk
+        return
+    encoder = AudioEncoder(fmt)
+    try:
+        async for chunk in chunks:
+            data = await run_in_threadpool(encoder.feed, chunk)
+            if data:
+                yield data
+        data = await run_in_threadpool(encoder.finish)
+        if data:
+            yield data
+    except Exception as e:
+        logging.error(f"Error while encoding {fmt.name} audio: {e}")
+    finally:
+        encoder.close()
+
+
+async def text_to_speech(request: Request):
+    if flask_app.PREWARM_ENABLED:
+        flask_app.prewarmer.ensure_running()
+    # The trace stays current for the rest of this request's task
+    trace, _ = tracer.start('tts', request.headers.get('traceparent'))
+    request_metrics = metrics.TTSRequestMetrics(on_finish=lambda status: tracer.finish(trace, status))
+    try:
+        response = await _text_to_speech(request, request_metrics)
+    except BaseException:
+        request_metrics.finish(500)
+        raise
+    response.headers.update(tracer.headers(trace))
+    if not request_metrics.streaming:
+        audio_bytes = len(response.body) if response.status_code == 200 else 0
+        request_metrics.first_byte()
+        request_metrics.finish(response.status_code, audio_bytes)
+    await run_in_threadpool(metrics.sync_cache_stats, audio_cache.stats)
+    return response
+
+
+async def _text_to_speech(request: Request, request_metrics):
+    try:
+        data = await request.json()
+        text = data.get('text', '')
+        stream = data.get('stream', STREAMING_ENABLED)
+        error = validate_tts_text(text)
+        if error:
+            return PlainTextResponse(error, 400)
+
+        try:
+            fmt = negotiate_format(
+                request.headers.get('accept'),
+                data.get('format'),
+                data.get('sample_rate'),
+                data.get('bit_depth')
+            )
+        except FormatError as e:
+            return PlainTextResponse(str(e), 400 if data.get('format') else 406)
+        request_metrics.format = fmt.name
+
+        try:
+            priority, deadline, api_key = admission_options(data, request.headers)
+            voice = parse_voice(data, DEFAULT_VOICE, ALLOWED_VOICES, ALLOWED_MODELS)
+        except ValueError as e:
+            return PlainTextResponse(str(e), 400)
+
+        segments = split_text(text, MAX_SEGMENT_CHARS)
+        if not segments:
+            return PlainTextResponse("No text provided", 400)
+
+        audio_key, whole = response_audio_key(segments, fmt, voice)
+        if whole:
+            with tracing.span('cache-lookup', whole=True) as span:
+                audio_data = await lookup_audio(audio_key)
+                span.set(hit=audio_data is not None)
+            if audio_data is not None:
+                await run_in_threadpool(
+                    record_tts_interaction, text, len(audio_data), len(segments), len(segments)
+                )
+                return Response(
+                    audio_data, media_type=fmt.media_type, headers=audio_headers(fmt, audio_key)
+                )
+
+        cached = await run_in_threadpool(
+            lambda: [get_cached_audio(segment, voice) for segment in segments]
+        )
+        hits = sum(1 for audio in cached if audio is not None)
+        if len(segments) > 1:
+            logging.info(f"{hits}/{len(segments)} segments served from cache")
+
+        # Queued requests wait without holding a thread
+        ticket = None
+        if hits < len(segments):
+            try:
+                with tracing.span('admission', priority=priority):
+                    ticket = await admission.acquire_async(priority, api_key, deadline)
+            except AdmissionRejected as e:
+                return PlainTextResponse(str(e), 429, headers=rejected_headers(e))
+            # Requests queued behind identical ones find their audio cached by now
+            cached = await run_in_threadpool(recheck_cache, segments, cached, voice)
+            hits = sum(1 for audio in cached if audio is not None)
+            if hits == len(segments):
+                ticket.release()
+                ticket = None
+
+        if stream and ticket is not None:
+            if len(segments) == 1:
+                body = stream_and_cache(segments[0], voice)
+            else:
+                body = stream_segments(text, segments, cached, voice)
+            # The slot is held until the stream ends, however it ends
+            return StreamingResponse(
+                ticket.astream(request_metrics.astream(encode_stream(body, fmt))),
+                media_type=fmt.media_type,
+                headers=STREAM_HEADERS,
+                background=BackgroundTask(ticket.release)
+            )
+
+        try:
+            with tracing.span('synthesize', segments=len(segments), cached=hits):
+                audio_data = await synthesize_text(segments, cached, voice)
+        finally:
+            if ticket is not None:
+                ticket.release()
+        await run_in_threadpool(record_tts_interaction, text, len(audio_data), len(segments), hits)
+        with tracing.span('encode', format=fmt.name):
+            audio_data = await run_in_threadpool(encode_audio, audio_data, fmt)
+        if whole:
+            with tracing.span('cache-store', bytes=len(audio_data)):
+                await run_in_threadpool(audio_cache.set, audio_key, audio_data)
+        return Response(
+            audio_data, media_type=fmt.media_type, headers=audio_headers(fmt, audio_key)
+        )
+    except Exception as e:
+        logging.error(f"Error in TTS endpoint: {e}")
+        return PlainTextResponse("Internal server error", 500)
+
+
+async def clear_cache(request: Request):
+    """Endpoint to clear the cache"""
+    try:
+        count = await run_in_threadpool(audio_cache.clear)
+        logging.info(f"Cleared {count} entries from cache")
+        return JSONResponse({
+            "success": True,
+            "message": f"Cleared {count} entries from cache",
+            "pinned_kept": len(audio_cache.pinned_keys())
+        })
+    except Exception as e:
+        logging.error(f"Error clearing cache: {e}")
+        return JSONResponse({"success": False, "error": str(e)}, 500)
+
+
+async def cache_stats(request: Request):
+    """Endpoint to report cache occupancy and hit/miss/eviction counters"""
+    stats = await run_in_threadpool(audio_cache.stats)
+    stats['single_flight'] = flight.stats()
+    stats['prewarm'] = await run_in_threadpool(flask_app.prewarmer.stats)
+    return JSONResponse(stats)
+
+
+async def shutdown():
+    await runpod.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/tts', text_to_speech, methods=['POST']),
+        Route('/cache/clear', clear_cache, methods=['POST']),
+        Route('/cache/stats', cache_stats, methods=['GET']),
+        # Everything else is served by the Flask app in a thread pool
+        Mount('/', app=WSGIMiddleware(flask_app.app))
+    ],
+    on_shutdown=[shutdown]
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=8000)
@@ -0,0 +1,796 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:  # Only needed when the redis tier is configured
+    redis = None
+
+
+def _is_entry(entry: os.DirEntry) -> bool:
+    """Entry files are named by their key alone, whatever the audio format"""
+    return '.' not in entry.name and entry.is_file()
+
+
+def _migrate_wav_names(directory: Path) -> None:
+    """Rename <key>.wav files, as older versions named every entry, to <key>"""
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.wav') and entry.is_file():
+            try:
+                os.replace(entry.path, directory / entry.name[:-4])
+            except OSError as e:
+                logging.error(f"Could not rename cache file {entry.name}: {e}")
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache of audio blobs on local disk.
+
+    Each entry is a single file named by its key. Sizes, creation times and
+    recency live in an in-memory index that is persisted to one compact
+    ``index.json`` and rebuilt from it (plus a directory scan) on startup.
+    Entries are evicted least-recently-used first once the byte budget is
+    exceeded, and a background thread sweeps out expired entries.
+
+    Several gunicorn workers may share the directory: files written by
+    another process are adopted on first access or at the next sweep, and
+    files removed by another process are treated as misses.
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        ttl: int,
+        sweep_interval: int = 300
+    ):
+        """Initialize the cache and rebuild its index"""
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+
+        # key -> [size, created]; ordered from least to most recently used
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._load_index()
+        self._stop = threading.Event()
+        self._sweeper = None
+        if sweep_interval > 0:
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, name="cache-sweeper", daemon=True
+            )
+            self._sweeper.start()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def _load_index(self) -> None:
+        """Rebuild the in-memory index from index.json and the directory"""
+        entries = {}
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == self.INDEX_VERSION:
+                # Stored in LRU order, so insertion order restores recency
+                for key, size, created in index['entries']:
+                    entries[key] = [size, created]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Error loading cache index, rescanning: {e}")
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            _migrate_wav_names(self.cache_dir)
+            on_disk = self._scan()
+            for key, entry in entries.items():
+                if key in on_disk:
+                    # Trust the file size over the index
+                    entry[0] = on_disk.pop(key)[0]
+                    self._entries[key] = entry
+            # Files the index doesn't know about count as least recent,
+            # oldest first
+            for key, entry in sorted(on_disk.items(), key=lambda kv: kv[1][1], reverse=True):
+                self._entries[key] = entry
+                self._entries.move_to_end(key, last=False)
+            self._bytes = sum(size for size, _ in self._entries.values())
+            self._dirty = True
+            self._evict()
+
+        logging.info(
+            f"Audio cache loaded: {len(self._entries)} entries, "
+            f"{self._bytes // 1024}KB"
+        )
+
+    def _scan(self) -> Dict[str, list]:
+        """List cache files on disk, migrating legacy .meta timestamps"""
+        found = {}
+        for entry in os.scandir(self.cache_dir):
+            if _is_entry(entry):
+                stat = entry.stat()
+                found[entry.name] = [stat.st_size, stat.st_mtime]
+        for entry in os.scandir(self.cache_dir):
+            name = entry.name
+            if name.endswith('.meta'):
+                # Older versions kept the timestamp in a file per entry
+                key = name[:-5]
+                try:
+                    if key in found:
+                        with open(entry.path, 'r') as f:
+                            found[key][1] = float(f.read().strip())
+                except (OSError, ValueError):
+                    pass
+                Path(entry.path).unlink(missing_ok=True)
+        return found
+
+    def _save_index(self) -> None:
+        """Persist the index atomically"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'version': self.INDEX_VERSION,
+                'entries': [[key, size, created] for key, (size, created) in self._entries.items()]
+            }
+            self._dirty = False
+        tmp_file = self.index_file.with_name(f"index.json.{os.getpid()}.tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_file, self.index_file)
+
+    def _remove(self, key: str) -> None:
+        """Drop an entry from the index and disk; caller holds the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[0]
+            self._dirty = True
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """Evict least recently used entries until within budget"""
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def _expired(self, created: float, now: float) -> bool:
+        return now - created > self.ttl
+
+    def _restat(self, key: str, entry: list) -> None:
+        """Pick up a newer copy written by another worker; caller holds the lock"""
+        try:
+            entry[1] = max(entry[1], self._path(key).stat().st_mtime)
+        except FileNotFoundError:
+            pass
+
+    def _fresh(self, key: str) -> bool:
+        """
+        Whether key has an unexpired entry, marking it recently used;
+        counts a miss if not. Caller holds the lock.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None:
+            # Another worker may have written it
+            try:
+                stat = self._path(key).stat()
+            except FileNotFoundError:
+                self.misses += 1
+                return False
+            entry = [stat.st_size, stat.st_mtime]
+            self._entries[key] = entry
+            self._bytes += entry[0]
+            self._dirty = True
+            self._evict()
+            if key not in self._entries:
+                # Larger than the whole budget
+                self.misses += 1
+                return False
+        if self._expired(entry[1], now):
+            self._restat(key, entry)
+        if self._expired(entry[1], now):
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached blob for key, or None on a miss"""
+        path = self._path(key)
+        with self._lock:
+            if not self._fresh(key):
+                return None
+
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            # Evicted by another worker
+            with self._lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def file_path(self, key: str) -> Optional[Path]:
+        """
+        The file holding key's blob, or None on a miss. It can still be
+        replaced or evicted before it is opened.
+        """
+        with self._lock:
+            if not self._fresh(key):
+                return None
+            self.hits += 1
+        return self._path(key)
+
+    def set(self, key: str, data: bytes) -> None:
+        """Store a blob, evicting older entries if over budget"""
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[key] = [len(data), time.time()]
+            self._bytes += len(data)
+            self._dirty = True
+            self._evict()
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """Seconds until an entry expires, or None if it isn't cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            remaining = entry[1] + self.ttl - time.time()
+            if remaining < self.ttl / 2:
+                # Refreshed by another worker since this one indexed it?
+                self._restat(key, entry)
+                remaining = entry[1] + self.ttl - time.time()
+            return remaining
+
+    def delete(self, key: str) -> None:
+        """Remove an entry"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> int:
+        """Remove every entry and return how many were removed"""
+        with self._lock:
+            count = 0
+            for entry in os.scandir(self.cache_dir):
+                if _is_entry(entry) or entry.name.endswith(('.meta', '.tmp')):
+                    Path(entry.path).unlink(missing_ok=True)
+                    count += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._dirty = True
+        self._save_index()
+        return count
+
+    def sweep(self) -> int:
+        """Adopt files from other workers, drop expired entries, save the index"""
+        now = time.time()
+        # Scan without holding the lock; entries written since are kept
+        on_disk = self._scan()
+        with self._lock:
+            for key, (size, created) in list(self._entries.items()):
+                if key not in on_disk and created < now:
+                    # Removed by another worker
+                    del self._entries[key]
+                    self._bytes -= size
+                    self._dirty = True
+            # Newest first, so the oldest adopted file ends up least recent
+            for key, entry in sorted(on_disk.items(), key=lambda kv: kv[1][1], reverse=True):
+                if key not in self._entries:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key, last=False)
+                    self._bytes += entry[0]
+                    self._dirty = True
+                elif entry[1] > self._entries[key][1]:
+                    # Rewritten (refreshed) by another worker
+                    self._bytes += entry[0] - self._entries[key][0]
+                    self._entries[key][:] = entry
+                    self._dirty = True
+
+            expired = [key for key, (_, created) in self._entries.items() if self._expired(created, now)]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+            self._evict()
+
+        self._save_index()
+        if expired:
+            logging.info(f"Cache sweep removed {len(expired)} expired entries")
+        return len(expired)
+
+    def _sweep_loop(self) -> None:
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Error sweeping cache: {e}")
+
+    def close(self) -> None:
+        """Stop the sweeper and persist the index"""
+        self._stop.set()
+        self._save_index()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and occupancy for monitoring"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class MemoryCache:
+    """
+    In-process LRU cache of audio blobs bounded by total bytes.
+
+    Sits in front of the shared tiers so hot phrases are served without a
+    network round trip or disk read. Entries expire after ``ttl`` seconds,
+    which also bounds how long a worker can serve audio that was cleared
+    elsewhere.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int):
+        """Initialize an empty cache"""
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (data, created); ordered from least to most recently used
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached blob for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, data: bytes) -> None:
+        """Store a blob, evicting older entries if over budget"""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (data, time.time())
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        """Remove an entry"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> int:
+        """Remove every entry and return how many were removed"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return count
+
+    def close(self) -> None:
+        """Nothing to release"""
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and occupancy for monitoring"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class RedisCache:
+    """
+    Audio cache shared by every worker and host through Redis.
+
+    Expiry is delegated to Redis key TTLs and eviction to the server's
+    ``maxmemory-policy``. Redis errors are logged and treated as misses so
+    an unavailable Redis degrades to synthesizing instead of failing.
+    """
+
+    def __init__(self, client, ttl: int, prefix: str = "tts:audio:"):
+        """Wrap a redis.Redis (or compatible, e.g. fakeredis) client"""
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, ttl: int, **kwargs) -> 'RedisCache':
+        """Connect using a redis:// URL"""
+        if redis is None:
+            raise RuntimeError("The redis cache tier requires the redis package")
+        return cls(redis.Redis.from_url(url), ttl, **kwargs)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached blob for key, or None on a miss"""
+        try:
+            data = self.client.get(self.prefix + key)
+        except Exception as e:
+            logging.error(f"Redis cache read failed: {e}")
+            self._count('errors')
+            self._count('misses')
+            return None
+        self._count('misses' if data is None else 'hits')
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        """Store a blob with the configured TTL"""
+        try:
+            self.client.set(self.prefix + key, data, ex=self.ttl)
+        except Exception as e:
+            logging.error(f"Redis cache write failed: {e}")
+            self._count('errors')
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """Seconds until an entry expires, or None if it isn't cached"""
+        try:
+            remaining = self.client.ttl(self.prefix + key)
+        except Exception as e:
+            logging.error(f"Redis cache TTL read failed: {e}")
+            self._count('errors')
+            return None
+        # -2: no such key; -1: no expiry
+        return remaining if remaining >= 0 else None
+
+    def delete(self, key: str) -> None:
+        """Remove an entry"""
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as e:
+            logging.error(f"Redis cache delete failed: {e}")
+            self._count('errors')
+
+    def clear(self) -> int:
+        """Remove every entry under the prefix and return how many were removed"""
+        count = 0
+        batch = []
+        try:
+            for name in self.client.scan_iter(match=f"{self.prefix}*", count=500):
+                batch.append(name)
+                if len(batch) >= 500:
+                    count += self.client.delete(*batch)
+                    batch = []
+            if batch:
+                count += self.client.delete(*batch)
+        except Exception as e:
+            # Leave the other tiers to be cleared
+            logging.error(f"Redis cache clear failed: {e}")
+            self._count('errors')
+        return count
+
+    def close(self) -> None:
+        """Release pooled connections"""
+        self.client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors
+            }
+
+
+class PinnedCache:
+    """
+    Audio blobs that are never evicted or expired, one file per entry.
+
+    Entries are only written by pin(): ordinary cache writes pass this
+    tier by, and clear() leaves it alone, so pinned phrases survive
+    /cache/clear and expiry until they are unpinned. Nothing is indexed in
+    memory, so every worker sees the pins of the others immediately.
+    """
+
+    def __init__(self, directory: str):
+        """Initialize, creating the directory if needed"""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _migrate_wav_names(self.directory)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the pinned blob for key, or None"""
+        try:
+            data = self._path(key).read_bytes()
+        except FileNotFoundError:
+            data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def file_path(self, key: str) -> Optional[Path]:
+        """The file holding the pinned blob for key, or None"""
+        path = self._path(key)
+        exists = path.exists()
+        with self._lock:
+            if exists:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return path if exists else None
+
+    def set(self, key: str, data: bytes) -> None:
+        """Ordinary writes don't pin"""
+
+    def pin(self, key: str, data: bytes) -> None:
+        """Store a blob until it is unpinned"""
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def unpin(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def is_pinned(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def keys(self) -> List[str]:
+        return [entry.name for entry in os.scandir(self.directory) if _is_entry(entry)]
+
+    def delete(self, key: str) -> None:
+        """Remove an entry (unpins it)"""
+        self.unpin(key)
+
+    def clear(self) -> int:
+        """Pinned entries are kept"""
+        return 0
+
+    def close(self) -> None:
+        """Nothing to release"""
+
+    def stats(self) -> Dict[str, Any]:
+        """Occupancy and counters for monitoring"""
+        entries = 0
+        size = 0
+        for entry in os.scandir(self.directory):
+            if _is_entry(entry):
+                entries += 1
+                size += entry.stat().st_size
+        with self._lock:
+            return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+
+class TieredCache:
+    """
+    Chain of caches checked fastest first.
+
+    A hit in a slower tier is copied into every faster tier in front of it;
+    writes go to every tier. A ``pinned`` tier, if configured, holds
+    entries that must never be evicted (see PinnedCache).
+    """
+
+    def __init__(self, tiers: List[Tuple[str, Any]]):
+        """tiers is a list of (name, cache) pairs, fastest first"""
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tier(self, name: str) -> Optional[Any]:
+        """Return the named tier, or None if it isn't configured"""
+        for tier_name, cache in self.tiers:
+            if tier_name == name:
+                return cache
+        return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the blob from the fastest tier that has it"""
+        return self._lookup(key, False)[0]
+
+    def get_with_expiry(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        """
+        Like get(), plus the seconds until the entry expires from the tier
+        that served it. That is only known for the shared tiers (disk,
+        redis): a hit in the first tier, or in the pinned tier, gives None.
+        """
+        return self._lookup(key, True)
+
+    def _lookup(self, key: str, with_expiry: bool) -> Tuple[Optional[bytes], Optional[float]]:
+        for i, (_, cache) in enumerate(self.tiers):
+            data = cache.get(key)
+            if data is not None:
+                for _, faster in self.tiers[:i]:
+                    faster.set(key, data)
+                with self._lock:
+                    self.hits += 1
+                expires_in = None
+                if with_expiry and i > 0 and hasattr(cache, 'expires_in'):
+                    expires_in = cache.expires_in(key)
+                return data, expires_in
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def file_path(self, key: str) -> Optional[Path]:
+        """
+        A file holding key's blob, from the first tier that keeps files
+        (pinned, disk), so it can be sent with sendfile; None if none has it
+        """
+        for _, cache in self.tiers:
+            if hasattr(cache, 'file_path'):
+                path = cache.file_path(key)
+                if path is not None:
+                    with self._lock:
+                        self.hits += 1
+                    return path
+        return None
+
+    def set(self, key: str, data: bytes) -> None:
+        """Store a blob in every tier"""
+        for _, cache in self.tiers:
+            cache.set(key, data)
+
+    def delete(self, key: str) -> None:
+        """Remove an entry from every tier"""
+        for _, cache in self.tiers:
+            cache.delete(key)
+
+    def pin(self, key: str, data: bytes) -> bool:
+        """Keep a blob in the pinned tier; False if there is none"""
+        pinned = self.tier('pinned')
+        if pinned is None:
+            return False
+        pinned.pin(key, data)
+        return True
+
+    def unpin(self, key: str) -> None:
+        pinned = self.tier('pinned')
+        if pinned is not None:
+            pinned.unpin(key)
+
+    def is_pinned(self, key: str) -> bool:
+        pinned = self.tier('pinned')
+        return pinned is not None and pinned.is_pinned(key)
+
+    def pinned_keys(self) -> List[str]:
+        pinned = self.tier('pinned')
+        return pinned.keys() if pinned is not None else []
+
+    def clear(self) -> int:
+        """Clear every tier; tiers overlap, so the largest count is returned"""
+        return max(cache.clear() for _, cache in self.tiers)
+
+    def close(self) -> None:
+        """Close every tier"""
+        for _, cache in self.tiers:
+            cache.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Overall counters plus per-tier stats"""
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses}
+        stats['tiers'] = {name: cache.stats() for name, cache in self.tiers}
+        return stats
+
+
+def build_audio_cache(
+    backend: str,
+    ttl: int,
+    cache_dir: str = "./cache",
+    max_bytes: int = 1024 ** 3,
+    sweep_interval: int = 300,
+    memory_max_bytes: int = 64 * 1024 ** 2,
+    memory_ttl: int = 300,
+    redis_url: Optional[str] = None,
+    redis_client=None,
+    pinned_dir: Optional[str] = None
+) -> TieredCache:
+    """
+    Build the cache described by a comma-separated tier list, fastest
+    first, e.g. ``"memory,redis"`` or ``"memory,redis,disk"``.
+
+    ``redis_client`` overrides ``redis_url``, which lets a fakeredis
+    instance stand in for a server. With ``pinned_dir`` a pinned tier is
+    added right after the memory tier (or first, without one).
+    """
+    tiers = []
+    for name in (part.strip() for part in backend.split(',')):
+        if not name:
+            continue
+        if name == 'memory':
+            tiers.append((name, MemoryCache(memory_max_bytes, min(memory_ttl, ttl))))
+        elif name == 'redis':
+            if redis_client is not None:
+                tiers.append((name, RedisCache(redis_client, ttl)))
+            elif redis_url:
+                tiers.append((name, RedisCache.from_url(redis_url, ttl)))
+            else:
+                raise ValueError("The redis cache tier requires REDIS_URL")
+        elif name == 'disk':
+            tiers.append((name, DiskCache(cache_dir, max_bytes, ttl, sweep_interval)))
+        else:
+            raise ValueError(f"Unknown cache tier: {name}")
+    if not tiers:
+        raise ValueError("At least one cache tier must be configured")
+    if pinned_dir:
+        position = 1 if tiers[0][0] == 'memory' else 0
+        tiers.insert(position, ('pinned', PinnedCache(pinned_dir)))
+
+    logging.info(f"Audio cache tiers: {', '.join(name for name, _ in tiers)}")
+    return TieredCache(tiers)
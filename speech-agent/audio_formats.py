@@ -0,0 +1,310 @@
+"""
+Output audio formats and content negotiation for /tts.
+
+Audio is synthesized and cached as 16-bit WAV and converted to the format
+the client asked for on the way out: WAV or raw PCM, Opus in Ogg, MP3 or
+FLAC, optionally at another sample rate or bit depth. WAV and PCM at the
+source layout are produced in-process; everything else is encoded by an
+ffmpeg subprocess fed incrementally, so chunked responses stay streaming.
+
+runpod-tts-service/audio_formats.py is the worker's copy of the encoder.
+"""
+import logging
+import shutil
+import subprocess
+import threading
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from wav_utils import WavParams, build_wav_header, finalize_wav, parse_wav
+
+
+FFMPEG = shutil.which('ffmpeg')
+
+MEDIA_TYPES = {
+    'wav': 'audio/wav',
+    'pcm': 'audio/L16',
+    'opus': 'audio/ogg; codecs=opus',
+    'mp3': 'audio/mpeg',
+    'flac': 'audio/flac'
+}
+
+# Names accepted in the "format" field besides the canonical ones
+FORMAT_ALIASES = {'wave': 'wav', 'l16': 'pcm', 'raw': 'pcm', 'ogg': 'opus'}
+
+# Media ranges accepted in the Accept header
+ACCEPT_TYPES = {
+    'audio/wav': 'wav',
+    'audio/wave': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/vnd.wave': 'wav',
+    'audio/l16': 'pcm',
+    'audio/pcm': 'pcm',
+    'application/octet-stream': 'pcm',
+    'audio/ogg': 'opus',
+    'audio/opus': 'opus',
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+    'audio/flac': 'flac',
+    'audio/x-flac': 'flac',
+    'audio/*': 'wav',
+    '*/*': 'wav'
+}
+
+SAMPLE_RATES = (8000, 12000, 16000, 22050, 24000, 44100, 48000)
+BIT_DEPTHS = {'wav': (8, 16, 24, 32), 'pcm': (8, 16, 24, 32), 'flac': (16, 24)}
+
+# ffmpeg raw sample formats by bytes per sample (8-bit PCM is unsigned)
+RAW_FORMATS = {1: 'u8', 2: 's16le', 3: 's24le', 4: 's32le'}
+
+# ffmpeg output options for the compressed formats
+CODEC_ARGS = {
+    'opus': ['-c:a', 'libopus', '-b:a', '32k', '-f', 'ogg'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3'],
+    'flac': ['-c:a', 'flac', '-f', 'flac']
+}
+
+
+class FormatError(ValueError):
+    """The requested output format can't be produced"""
+
+
+class OutputFormat(NamedTuple):
+    """Encoding of a response; None keeps the source sample rate/bit depth"""
+    name: str = 'wav'
+    sample_rate: Optional[int] = None
+    bit_depth: Optional[int] = None
+
+    @property
+    def is_default(self) -> bool:
+        """True if the cached WAV can be served unchanged"""
+        return self == OutputFormat()
+
+    @property
+    def media_type(self) -> str:
+        if self.name != 'pcm':
+            return MEDIA_TYPES[self.name]
+        media_type = f"audio/L{self.bit_depth or 16}"
+        if self.sample_rate:
+            media_type += f";rate={self.sample_rate}"
+        return media_type
+
+
+def _parse_accept(accept: str):
+    """Yield media ranges from an Accept header, most preferred first"""
+    ranges = []
+    for position, part in enumerate(accept.split(',')):
+        media_range, *params = [p.strip() for p in part.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_range and quality > 0:
+            ranges.append((-quality, position, media_range.lower()))
+    for _, _, media_range in sorted(ranges):
+        yield media_range
+
+
+def negotiate_format(
+    accept: Optional[str] = None,
+    requested: Optional[str] = None,
+    sample_rate=None,
+    bit_depth=None
+) -> OutputFormat:
+    """
+    Pick the output format from the request's "format" field or, failing
+    that, its Accept header. Raises FormatError if nothing acceptable can
+    be produced.
+    """
+    if requested:
+        name = str(requested).lower()
+        name = FORMAT_ALIASES.get(name, name)
+        if name not in MEDIA_TYPES:
+            raise FormatError(
+                f"Unsupported format '{requested}'. "
+                f"Supported: {', '.join(MEDIA_TYPES)}"
+            )
+    elif accept:
+        # Skip types this server can't encode so a lower-q fallback wins
+        name = next(
+            (
+                ACCEPT_TYPES[r] for r in _parse_accept(accept)
+                if r in ACCEPT_TYPES and (FFMPEG or ACCEPT_TYPES[r] in ('wav', 'pcm'))
+            ),
+            None
+        )
+        if name is None:
+            raise FormatError(
+                "None of the accepted media types can be produced. "
+                f"Supported: {', '.join(MEDIA_TYPES.values())}"
+            )
+    else:
+        name = 'wav'
+
+    try:
+        sample_rate = int(sample_rate) if sample_rate else None
+        bit_depth = int(bit_depth) if bit_depth else None
+    except (TypeError, ValueError):
+        raise FormatError("sample_rate and bit_depth must be integers")
+    if sample_rate is not None and sample_rate not in SAMPLE_RATES:
+        raise FormatError(
+            f"Unsupported sample rate {sample_rate}. "
+            f"Supported: {', '.join(map(str, SAMPLE_RATES))}"
+        )
+    if bit_depth is not None and bit_depth not in BIT_DEPTHS.get(name, ()):
+        raise FormatError(f"Unsupported bit depth {bit_depth} for {name}")
+
+    fmt = OutputFormat(name, sample_rate, bit_depth)
+    needs_ffmpeg = name not in ('wav', 'pcm') or sample_rate or bit_depth not in (None, 16)
+    if needs_ffmpeg and not FFMPEG:
+        raise FormatError(f"Format {name} is not available on this server")
+    return fmt
+
+
+class AudioEncoder:
+    """
+    Incrementally convert a WAV stream to an OutputFormat.
+
+    ``feed`` takes the stream in arbitrary pieces (the first must eventually
+    contain the whole header) and returns whatever output is ready;
+    ``finish`` flushes the rest. ffmpeg's output is drained by a reader
+    thread so writes never deadlock on a full pipe.
+    """
+
+    def __init__(self, fmt: OutputFormat):
+        self.fmt = fmt
+        self.params: Optional[WavParams] = None
+        self._head = b''
+        self._passthrough = False
+        self._process = None
+        self._reader = None
+        self._output = bytearray()
+        self._lock = threading.Lock()
+
+    def _start(self, source: WavParams) -> bytes:
+        fmt = self.fmt
+        self.params = WavParams(
+            source.channels,
+            fmt.sample_rate or source.sample_rate,
+            (fmt.bit_depth or 16) // 8 if fmt.name in ('wav', 'pcm') else source.sample_width
+        )
+        if fmt.name in ('wav', 'pcm') and self.params == source:
+            self._passthrough = True
+            return b''
+
+        if not FFMPEG:
+            raise FormatError(f"Format {fmt.name} is not available on this server")
+        args = [
+            FFMPEG, '-hide_banner', '-loglevel', 'error',
+            '-f', RAW_FORMATS[source.sample_width],
+            '-ar', str(source.sample_rate), '-ac', str(source.channels),
+            '-i', 'pipe:0', '-ar', str(self.params.sample_rate)
+        ]
+        if fmt.name in ('wav', 'pcm'):
+            raw = RAW_FORMATS[self.params.sample_width]
+            args += ['-c:a', 'pcm_' + raw, '-f', raw]
+        else:
+            args += CODEC_ARGS[fmt.name]
+            if fmt.name == 'flac' and fmt.bit_depth == 24:
+                args += ['-sample_fmt', 's32', '-bits_per_raw_sample', '24']
+        args.append('pipe:1')
+
+        self._process = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self._reader = threading.Thread(target=self._drain, daemon=True)
+        self._reader.start()
+        return build_wav_header(self.params) if fmt.name == 'wav' else b''
+
+    def _drain(self) -> None:
+        while True:
+            data = self._process.stdout.read1(65536)
+            if not data:
+                return
+            with self._lock:
+                self._output += data
+
+    def _take(self) -> bytes:
+        with self._lock:
+            data = bytes(self._output)
+            self._output.clear()
+        return data
+
+    def _convert(self, pcm: bytes) -> bytes:
+        if self._passthrough:
+            return pcm
+        if pcm:
+            self._process.stdin.write(pcm)
+            self._process.stdin.flush()
+        return self._take()
+
+    def feed(self, data: bytes) -> bytes:
+        """Add the next piece of the WAV stream; returns encoded output"""
+        if self.params is not None:
+            return self._convert(data)
+
+        self._head += data
+        try:
+            source, pcm = parse_wav(self._head)
+        except ValueError:
+            # Header incomplete; wait for more
+            return b''
+        head, self._head = self._head, b''
+        prefix = self._start(source)
+        if self._passthrough and self.fmt.name == 'wav':
+            return head
+        return prefix + self._convert(pcm)
+
+    def finish(self) -> bytes:
+        """Flush the encoder and return the remaining output"""
+        if self._process is None:
+            return b''
+        self._process.stdin.close()
+        self._reader.join()
+        error = self._process.stderr.read().decode(errors='replace').strip()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {error}")
+        return self._take()
+
+    def close(self) -> None:
+        """Abort encoding, e.g. when the client went away"""
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+
+def encode_audio(wav: bytes, fmt: OutputFormat) -> bytes:
+    """Convert a complete WAV blob"""
+    if fmt.is_default:
+        return wav
+    encoder = AudioEncoder(fmt)
+    try:
+        data = encoder.feed(wav) + encoder.finish()
+    finally:
+        encoder.close()
+    return finalize_wav(data) if fmt.name == 'wav' else data
+
+
+def encode_stream(chunks: Iterable[bytes], fmt: OutputFormat) -> Iterator[bytes]:
+    """Convert a streamed WAV, yielding output as it becomes available"""
+    if fmt.is_default:
+        yield from chunks
+        return
+    encoder = AudioEncoder(fmt)
+    try:
+        for chunk in chunks:
+            data = encoder.feed(chunk)
+            if data:
+                yield data
+        data = encoder.finish()
+        if data:
+            yield data
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated stream
+        logging.error(f"Error while encoding {fmt.name} audio: {e}")
+    finally:
+        encoder.close()
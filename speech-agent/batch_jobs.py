@@ -0,0 +1,320 @@
+"""
+Asynchronous batch synthesis jobs (POST /tts/batch).
+
+A job renders many texts in the background:
+
+1. Texts whose whole response is already cached are done at once, and
+   texts that repeat within the job are rendered once.
+2. The segments of the rest are deduplicated across the job and looked
+   up in the cache. Only the misses go to RunPod, in batch jobs of
+   ``batch_size`` segments, ``concurrency`` at a time. Each call waits for
+   a batch admission slot (see admission.py), so a nightly render never
+   takes the slots interactive requests need.
+3. Each text's audio is assembled and cached under its content address,
+   served at /audio/<key>.<ext>.
+
+Job state is a JSON file per job in ``directory``, rewritten as the job
+progresses, so every worker can report on a job another one runs. A job
+whose state hasn't changed for ``stale_after`` seconds is reported as
+interrupted (its worker died). Jobs are deleted ``retention`` seconds
+after they were submitted.
+"""
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from admission import AdmissionRejected
+
+
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class _Run:
+    """A job being rendered by this worker"""
+
+    def __init__(self, jobs: "BatchJobs", state: Dict[str, Any], texts: List[str], fmt, voice):
+        self.jobs = jobs
+        self.state = state
+        self.texts = texts
+        self.fmt = fmt
+        self.voice = voice
+        self.lock = threading.Lock()
+        self.saved = 0.0
+
+    def save(self, force: bool = False) -> None:
+        """Persist the state, at most every save_interval unless forced"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.saved < self.jobs.save_interval:
+                return
+            self.saved = now
+            self.state['updated'] = time.time()
+            self.jobs._write(self.state)
+
+    def count(self, section: str, field: str, amount: int = 1) -> None:
+        with self.lock:
+            self.state[section][field] += amount
+
+    def finish_items(self, indices: List[int], key: Optional[str] = None, error: Optional[str] = None) -> None:
+        if error is None:
+            result = {'status': 'done', 'key': key, 'url': f"/audio/{key}.{self.fmt.name}"}
+        else:
+            result = {'status': 'failed', 'error': error}
+        with self.lock:
+            for index in indices:
+                self.state['results'][index] = dict(result)
+            self.state['items']['done' if error is None else 'failed'] += len(indices)
+        self.save()
+
+
+class BatchJobs:
+    """Background batch synthesis jobs with file-backed state"""
+
+    def __init__(
+        self,
+        directory,
+        cache,
+        segments: Callable[[str, Any], List[Tuple[str, str]]],
+        synthesize_batch: Callable[[List[str], Any], List[Optional[bytes]]],
+        response_key: Callable[[List[str], Any, Any], Tuple[Optional[str], bool]],
+        render: Callable[[List[bytes], Any], bytes],
+        concurrency: int = 4,
+        batch_size: int = 16,
+        retention: float = 7 * 86400,
+        stale_after: float = 600,
+        save_interval: float = 1.0
+    ):
+        """
+        segments(text, voice) gives a text's (segment text, cache key)
+        pairs; synthesize_batch(texts, voice) returns the audio (None on
+        failure) of each text; response_key(segment texts, fmt, voice)
+        gives the (key, whole) of a text's audio, whole meaning it's
+        assembled from its segments by render(segment audio, fmt). voice
+        is whatever the job was submitted with.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cache = cache
+        self.segments = segments
+        self.synthesize_batch = synthesize_batch
+        self.response_key = response_key
+        self.render = render
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.retention = retention
+        self.stale_after = stale_after
+        self.save_interval = save_interval
+
+    def _state_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _texts_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.texts.json"
+
+    def _write(self, state: Dict[str, Any]) -> None:
+        path = self._state_path(state['id'])
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def submit(self, texts: List[str], fmt, voice) -> Dict[str, Any]:
+        """Start rendering texts in the background; returns the job's state"""
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        with open(self._texts_path(job_id), 'w', encoding='utf-8') as f:
+            json.dump(texts, f, ensure_ascii=False)
+        now = time.time()
+        state = {
+            'id': job_id,
+            'status': 'queued',
+            'created': now,
+            'updated': now,
+            'format': fmt._asdict(),
+            'voice': voice._asdict(),
+            'items': {'total': len(texts), 'done': 0, 'failed': 0},
+            'segments': {'unique': 0, 'cached': 0, 'synthesized': 0, 'failed': 0},
+            'results': [{'status': 'pending'} for _ in texts]
+        }
+        self._write(state)
+        run = _Run(self, state, texts, fmt, voice)
+        threading.Thread(target=self._run, args=(run,), name=f"tts-batch-{job_id[:8]}", daemon=True).start()
+        return state
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job's state, or None if there is no such job"""
+        if not JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id), 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state['status'] in ('queued', 'running') and time.time() - state['updated'] > self.stale_after:
+            state['status'] = 'interrupted'
+        return state
+
+    def texts(self, job_id: str) -> List[str]:
+        with open(self._texts_path(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def cleanup(self) -> int:
+        """Delete jobs submitted more than retention seconds ago"""
+        cutoff = time.time() - self.retention
+        removed = 0
+        for path in self.directory.glob('*.texts.json'):
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+                job_id = path.name.split('.', 1)[0]
+                self._state_path(job_id).unlink(missing_ok=True)
+                path.unlink(missing_ok=True)
+                removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    # Rendering
+
+    def _run(self, run: _Run) -> None:
+        started = time.time()
+        run.state['status'] = 'running'
+        run.save(force=True)
+        try:
+            self._render(run)
+            run.state['status'] = 'done'
+        except Exception as e:
+            logging.error(f"Batch job {run.state['id']} failed: {e}")
+            run.state['status'] = 'failed'
+            run.state['error'] = str(e)
+        run.state['seconds'] = round(time.time() - started, 3)
+        run.save(force=True)
+        items = run.state['items']
+        logging.info(
+            f"Batch job {run.state['id']} {run.state['status']}: {items['done']}/{items['total']} "
+            f"texts in {run.state['seconds']}s, {run.state['segments']['synthesized']} segments synthesized"
+        )
+
+    def _render(self, run: _Run) -> None:
+        # Texts with the same audio are rendered once: key -> [indices, segments, whole]
+        groups: Dict[str, list] = {}
+        for index, text in enumerate(run.texts):
+            segments = self.segments(text, run.voice)
+            key, whole = self.response_key([segment for segment, _ in segments], run.fmt, run.voice)
+            if key in groups:
+                groups[key][0].append(index)
+            else:
+                groups[key] = [[index], segments, whole]
+
+        # Whole responses already cached need nothing else
+        unique = {}
+        remaining = []
+        for key, (indices, segments, whole) in groups.items():
+            if whole and self.cache.get(key) is not None:
+                run.finish_items(indices, key)
+                continue
+            remaining.append(key)
+            for segment, segment_key in segments:
+                unique.setdefault(segment_key, segment)
+        run.state['segments']['unique'] = len(unique)
+
+        missing = [(key, text) for key, text in unique.items() if self.cache.get(key) is None]
+        run.count('segments', 'cached', len(unique) - len(missing))
+        run.save()
+
+        failed = set()
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="tts-batch-call") as executor:
+            for batch, keys in zip(batches, executor.map(lambda batch: self._synthesize(run, batch), batches)):
+                failed.update(keys)
+
+            def assemble(key):
+                indices, segments, whole = groups[key]
+                if any(segment_key in failed for _, segment_key in segments):
+                    run.finish_items(indices, error="Synthesis failed")
+                    return
+                if not whole:
+                    run.finish_items(indices, segments[0][1])
+                    return
+                parts = [self.cache.get(segment_key) for _, segment_key in segments]
+                if any(part is None for part in parts):
+                    run.finish_items(indices, error="Segment audio left the cache before assembly")
+                    return
+                try:
+                    self.cache.set(key, self.render(parts, run.fmt))
+                except Exception as e:
+                    logging.error(f"Batch job {run.state['id']}: assembling audio failed: {e}")
+                    run.finish_items(indices, error=f"Assembling audio failed: {e}")
+                    return
+                run.finish_items(indices, key)
+
+            list(executor.map(assemble, remaining))
+
+    def _synthesize(self, run: _Run, batch: List[Tuple[str, str]]) -> List[str]:
+        """Synthesize and cache a batch of segments; returns the keys that failed"""
+        texts = [text for _, text in batch]
+        while True:
+            try:
+                results = self.synthesize_batch(texts, run.voice)
+                break
+            except AdmissionRejected as e:
+                # The batch queue is full; wait for room rather than fail
+                time.sleep(e.retry_after)
+            except Exception as e:
+                logging.error(f"Batch job {run.state['id']}: RunPod batch of {len(batch)} failed: {e}")
+                run.count('segments', 'failed', len(batch))
+                run.save()
+                return [key for key, _ in batch]
+
+        failed = []
+        for (key, _), data in zip(batch, results):
+            if data is None:
+                failed.append(key)
+            else:
+                self.cache.set(key, data)
+        # A short result list means the rest failed
+        failed += [key for key, _ in batch[len(results):]]
+        run.count('segments', 'synthesized', len(batch) - len(failed))
+        run.count('segments', 'failed', len(failed))
+        run.save()
+        return failed
+
+
+class _Chunks(io.RawIOBase):
+    """Unseekable write target that hands back what was written since the last take()"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_archive(entries: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Zip (name, data) pairs as a stream of chunks, one entry in memory at a time"""
+    out = _Chunks()
+    # Stored: the audio is already compressed, or WAV that barely deflates
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield out.take()
+    yield out.take()
@@ -1,9 +1,48 @@
+import glob
+import os
+
+# "flask" serves app.py on sync workers; "asgi" serves asgi_app.py on
+# uvicorn workers, where each worker handles many requests concurrently
+server_mode = os.getenv('SERVER_MODE', 'flask')
+
 bind = "0.0.0.0:8000"
 workers = 4  # Increased for production
-threads = 4
-worker_class = "sync"
+if server_mode == "asgi":
+    wsgi_app = "asgi_app:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "app:app"
+    # More threads than admission slots (ADMISSION_SLOTS), so requests can
+    # queue by priority and cache hits are served while the slots are busy.
+    # app.py sizes the interactive queue from this count.
+    threads = int(os.getenv('GUNICORN_THREADS', 16))
+    worker_class = "sync"
 timeout = 120
 keepalive = 5
 accesslog = "/var/log/gunicorn-access.log"
 errorlog = "/var/log/gunicorn-error.log"
 loglevel = "info"
+
+# Workers write metrics to a shared directory and the master serves their
+# sum on METRICS_PORT. Set before the workers import prometheus_client.
+if os.getenv('ENABLE_METRICS', 'true').lower() == 'true':
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-metrics')
+
+
+def when_ready(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        # Samples left by a previous run would be summed in; cleared before
+        # importing metrics, which creates this process's files
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+    import metrics
+    if metrics.ENABLE_METRICS:
+        metrics.serve_multiprocess()
+        server.log.info(f"Serving metrics on port {metrics.METRICS_PORT}")
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_worker_dead(worker.pid)
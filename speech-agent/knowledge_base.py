@@ -1,13 +1,29 @@
+import io
 import json
 import hashlib
 import logging
+import os
+import threading
+import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 
 
 from flask import Flask
 
+from knowledge_index import (
+    KIND_DOCUMENT, InvertedIndex, SearchHit, knowledge_text, make_snippet
+)
+from knowledge_ingest import (
+    CHUNK_SIZE, JOB_COMPLETED, JOB_FAILED, JOB_PROCESSING, ExtractionError,
+    IngestQueue, JobStore, find_extractor, split_passages
+)
+from knowledge_log import AppendLog, BatchWriter, LogPosition
+from knowledge_stats import KnowledgeStats, dir_bytes, format_cursor, parse_cursor
+from knowledge_vectors import VectorIndex, load_embedder, np
+from metrics import KB_OPERATION_SECONDS
+
 
 # Configure logging
 logging.basicConfig(
@@ -15,12 +31,81 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Storage configuration
+KB_STORAGE_DIR = os.getenv('KB_STORAGE_DIR', './knowledge')
+# Default: 64 MiB per log segment
+KB_SEGMENT_MAX_BYTES = int(os.getenv('KB_SEGMENT_MAX_BYTES', 64 * 1024 ** 2))
+# Record interactions from a background thread instead of the request path
+KB_ASYNC_WRITES = os.getenv('KB_ASYNC_WRITES', 'true').lower() == 'true'
+KB_FLUSH_INTERVAL = float(os.getenv('KB_FLUSH_INTERVAL_MS', 50)) / 1000
+KB_FSYNC = os.getenv('KB_FSYNC', 'false').lower() == 'true'
+# Smallest number of newly indexed records merged into the index checkpoint
+KB_INDEX_CHECKPOINT_DOCS = int(os.getenv('KB_INDEX_CHECKPOINT_DOCS', 10000))
+# Semantic search (requires numpy): "hashing" or a sentence-transformers model
+KB_SEMANTIC_ENABLED = os.getenv('KB_SEMANTIC_ENABLED', 'true').lower() == 'true'
+KB_EMBEDDING_MODEL = os.getenv('KB_EMBEDDING_MODEL', 'hashing')
+KB_EMBEDDING_DIM = int(os.getenv('KB_EMBEDDING_DIM', 256))
+KB_EMBEDDING_BATCH = int(os.getenv('KB_EMBEDDING_BATCH', 64))
+# Weight of semantic similarity against keyword score in hybrid mode
+KB_HYBRID_ALPHA = float(os.getenv('KB_HYBRID_ALPHA', 0.5))
+
+# Target length of the passages documents are split into for search
+KB_PASSAGE_CHARS = int(os.getenv('KB_PASSAGE_CHARS', 1000))
+
+# Hourly dashboard aggregates kept, and log records between checkpoints
+# of the counters (each worker reads only what came after at startup)
+KB_STATS_HOURS = int(os.getenv('KB_STATS_HOURS', 7 * 24))
+KB_STATS_CHECKPOINT_RECORDS = int(os.getenv('KB_STATS_CHECKPOINT_RECORDS', 1000))
+
+# Passage records appended to the log per write during ingestion
+PASSAGE_BATCH = 64
+
+QUERY_MODES = ('keyword', 'semantic', 'hybrid')
+MAX_TOP_K = 100
+MAX_PAGE_SIZE = 200
+
 
 class KnowledgeBase:
-    """Knowledge base for storing and retrieving information"""
+    """
+    Knowledge base for storing and retrieving information.
+    
+    Knowledge entries and document metadata are records in an append-only,
+    segment-rotated log (see knowledge_log.py), so adding one costs the same
+    however large the knowledge base is and concurrent gunicorn workers
+    never overwrite each other's updates. Each process keeps the document
+    table and counters in memory and catches up on records appended by
+    other workers before answering reads; both are checkpointed with the
+    log position they cover (see knowledge_stats.py), so a worker starting
+    up reads only the records appended since.
     
-    def __init__(self, app: Flask = None, storage_dir: str = "./knowledge"):
-        """Initialize the knowledge base"""
+    Queries are answered from an inverted index over the log (see
+    knowledge_index.py) that is brought up to date the same way and,
+    in semantic or hybrid mode, from embeddings of every entry (see
+    knowledge_vectors.py).
+    
+    Uploaded documents are spooled to disk and processed by a background
+    thread (see knowledge_ingest.py): their text is extracted and split
+    into passage records, and the document record that makes them
+    searchable is written last.
+    """
+    
+    def __init__(
+        self,
+        app: Flask = None,
+        storage_dir: str = "./knowledge",
+        segment_max_bytes: int = 64 * 1024 ** 2,
+        async_writes: bool = True,
+        flush_interval: float = 0.05,
+        fsync: bool = False,
+        checkpoint_docs: int = 10000,
+        embedder=None,
+        embedding_batch: int = 64,
+        hybrid_alpha: float = 0.5,
+        passage_chars: int = 1000,
+        stats_hours: int = 168,
+        stats_checkpoint_records: int = 1000
+    ):
+        """Initialize the knowledge base; semantic search is enabled by passing an embedder"""
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(exist_ok=True)
         
@@ -28,18 +113,32 @@ class KnowledgeBase:
         self.docs_dir = self.storage_dir / "documents"
         self.docs_dir.mkdir(exist_ok=True)
         
-        self.memory_dir = self.storage_dir / "memory"
-        self.memory_dir.mkdir(exist_ok=True)
+        self.log = AppendLog(self.storage_dir / "log", segment_max_bytes, fsync)
+        self.writer = BatchWriter(
+            self.log, flush_interval=flush_interval,
+            on_write=KB_OPERATION_SECONDS.labels('batch_write').observe
+        ) if async_writes else None
+        self.index = InvertedIndex(self.storage_dir / "index", checkpoint_docs)
+        self.vectors = None
+        if embedder is not None:
+            self.vectors = VectorIndex(
+                self.storage_dir / "vectors", self.log, self._record_text,
+                embedder, batch_size=embedding_batch
+            )
+        self.hybrid_alpha = hybrid_alpha
+        self.passage_chars = passage_chars
+        self.jobs = JobStore(self.storage_dir / "jobs")
+        self.ingest_queue = IngestQueue(self._ingest)
         
-        self.index_file = self.storage_dir / "index.json"
+        # In-memory view of the log, advanced by _refresh()
+        self.stats = KnowledgeStats(
+            self.storage_dir / "stats.json", stats_hours, stats_checkpoint_records
+        )
+        self._state_lock = threading.Lock()
         
-        # Initialize index
-        if not self.index_file.exists():
-            self._save_index({
-                "documents": {},
-                "interactions": [],
-                "last_updated": datetime.now().isoformat()
-            })
+        self._migrate_legacy()
+        self.stats.load(self.log.end())
+        self._refresh()
         
         # Register with Flask app if provided
         if app is not None:
@@ -73,9 +172,21 @@ class KnowledgeBase:
                 if not query:
                     return jsonify({"error": "Query is required"}), 400
                 
+                mode = request.json.get('mode', 'keyword')
+                if mode not in QUERY_MODES:
+                    return jsonify({"error": f"mode must be one of {', '.join(QUERY_MODES)}"}), 400
+                if mode != 'keyword' and self.vectors is None:
+                    return jsonify({"error": "Semantic search is not enabled"}), 400
+                try:
+                    top_k = int(request.json.get('top_k', 10))
+                except (TypeError, ValueError):
+                    top_k = 0
+                if not 1 <= top_k <= MAX_TOP_K:
+                    return jsonify({"error": f"top_k must be between 1 and {MAX_TOP_K}"}), 400
+                
                 # Query the knowledge base
-                results = self.query(query)
-                return jsonify({"results": results}), 200
+                results = self.query(query, top_k, mode)
+                return jsonify({"results": results, "mode": mode}), 200
             except Exception as e:
                 logging.error(f"Error querying knowledge: {e}")
                 return jsonify({"error": str(e)}), 500
@@ -92,22 +203,34 @@ class KnowledgeBase:
                 if file.filename == '':
                     return jsonify({"error": "No selected file"}), 400
                 
-                # Process and store the document
-                doc_id = self.add_document(
+                # Spool the upload to disk and extract it in the background
+                job = self.submit_document(
                     file.filename,
-                    file.read(),
+                    file.stream,
                     file.content_type
                 )
                 
                 return jsonify({
                     "success": True,
-                    "document_id": doc_id,
-                    "filename": file.filename
-                }), 200
+                    "document_id": job['document_id'],
+                    "filename": file.filename,
+                    "job_id": job['id'],
+                    "status": job['status'],
+                    "status_url": f"/knowledge/document/jobs/{job['id']}"
+                }), 202
             except Exception as e:
                 logging.error(f"Error uploading document: {e}")
                 return jsonify({"error": str(e)}), 500
         
+        @app.route('/knowledge/document/jobs/<job_id>', methods=['GET'])
+        def get_ingest_job(job_id):
+            from flask import jsonify
+            
+            job = self.jobs.get(job_id)
+            if job is None:
+                return jsonify({"error": "Job not found"}), 404
+            return jsonify(job), 200
+        
         @app.route('/knowledge/document/<doc_id>', methods=['GET'])
         def get_document(doc_id):
             from flask import send_file, jsonify
@@ -129,31 +252,125 @@ class KnowledgeBase:
         
         @app.route('/knowledge/stats', methods=['GET'])
         def get_stats():
-            from flask import jsonify
+            from flask import request, jsonify
             
             try:
-                stats = self.get_stats()
+                hours = request.args.get('hours', 24, type=int)
+                stats = self.get_stats(hours)
                 return jsonify(stats), 200
             except Exception as e:
                 logging.error(f"Error getting stats: {e}")
                 return jsonify({"error": str(e)}), 500
+        
+        @app.route('/knowledge/interactions', methods=['GET'])
+        def list_interactions():
+            from flask import request, jsonify
+            
+            try:
+                limit = request.args.get('limit', 50, type=int)
+                if not 1 <= limit <= MAX_PAGE_SIZE:
+                    return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+                cursor = request.args.get('cursor')
+                try:
+                    before = parse_cursor(cursor) if cursor else None
+                except ValueError:
+                    return jsonify({"error": "Invalid cursor"}), 400
+                
+                page = self.list_interactions(limit, before, request.args.get('type'))
+                return jsonify(page), 200
+            except Exception as e:
+                logging.error(f"Error listing interactions: {e}")
+                return jsonify({"error": str(e)}), 500
+    
+    def _migrate_legacy(self) -> None:
+        """Move entries from the old index.json + memory/*.json layout into the log"""
+        index_file = self.storage_dir / "index.json"
+        memory_dir = self.storage_dir / "memory"
+        if not index_file.exists():
+            return
+        
+        with self.log.locked():
+            # Another worker may have migrated while we waited for the lock
+            if not index_file.exists():
+                return
+            try:
+                with open(index_file, 'r') as f:
+                    index = json.load(f)
+            except Exception as e:
+                logging.error(f"Error loading legacy index: {e}")
+                index = {}
+            
+            entries = []
+            memory_files = list(memory_dir.glob("*.json")) if memory_dir.exists() else []
+            for file_path in memory_files:
+                try:
+                    with open(file_path, 'r') as f:
+                        entries.append(json.load(f))
+                except Exception as e:
+                    logging.error(f"Error migrating knowledge file {file_path}: {e}")
+            entries.sort(key=lambda data: data.get('timestamp', ''))
+            
+            records = [
+                {"kind": "document", "id": doc_id, "meta": meta}
+                for doc_id, meta in index.get('documents', {}).items()
+            ]
+            records += [{"kind": "knowledge", "data": data} for data in entries]
+            self.log.append_locked(records)
+            
+            for file_path in memory_files:
+                file_path.unlink()
+            index_file.unlink()
+        logging.info(
+            f"Migrated {len(entries)} knowledge entries and "
+            f"{len(records) - len(entries)} documents to the append-only log"
+        )
     
-    def _load_index(self) -> Dict:
-        """Load the index file"""
+    def _refresh(self) -> None:
+        """Catch up on records appended since the last refresh (by any worker)"""
+        with self._state_lock:
+            for _, position, record in self.log.scan(self.stats.position):
+                self.stats.apply(record, position)
+            self.stats.maybe_save()
+        self.index.catch_up(self.log, self._record_text)
+        if self.vectors is not None:
+            # New entries are embedded in the background by one worker
+            self.vectors.ensure_running()
+    
+    def _record_text(self, record: Dict[str, Any]) -> Optional[str]:
+        """Searchable text of a passage record, or of a document stored as one text"""
+        if record.get('kind') == 'passage':
+            return record.get('text')
+        meta = record.get('meta', {})
+        if record.get('kind') == 'document' and meta.get('has_text') and 'passages' not in meta:
+            return self._document_text(record['id'])
+        return None
+    
+    def _document_text(self, doc_id: str) -> Optional[str]:
+        """Extracted text of a document added before passages, if it has any"""
         try:
-            with open(self.index_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"Error loading index: {e}")
-            return {"documents": {}, "interactions": [], "last_updated": datetime.now().isoformat()}
+            with open(self.docs_dir / f"{doc_id}.txt", 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def _append(self, record: Dict[str, Any], wait: bool = True) -> None:
+        """Write a record now, or queue it for the background writer"""
+        if wait or self.writer is None:
+            with KB_OPERATION_SECONDS.labels('write').time():
+                self.log.append([record])
+        else:
+            self.writer.put(record)
     
-    def _save_index(self, index: Dict):
-        """Save the index file"""
-        with open(self.index_file, 'w') as f:
-            json.dump(index, f, indent=2)
+    def flush(self) -> None:
+        """Wait until queued interactions have been written"""
+        if self.writer is not None:
+            self.writer.flush()
     
-    def add_knowledge(self, data: Dict[str, Any]) -> str:
-        """Add knowledge to the knowledge base"""
+    def add_knowledge(self, data: Dict[str, Any], wait: bool = True) -> str:
+        """
+        Add knowledge to the knowledge base. With wait=False the entry is
+        written in the background and may not be visible to reads yet.
+        """
         # Generate a unique ID for this knowledge
         knowledge_id = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
         
@@ -161,76 +378,135 @@ class KnowledgeBase:
         data['timestamp'] = datetime.now().isoformat()
         data['id'] = knowledge_id
         
-        # Save to file
-        knowledge_file = self.memory_dir / f"{knowledge_id}.json"
-        with open(knowledge_file, 'w') as f:
-            json.dump(data, f, indent=2)
-        
-        # Update index
-        index = self._load_index()
-        index['interactions'].append({
-            'id': knowledge_id,
-            'timestamp': data['timestamp'],
-            'type': data.get('type', 'general'),
-            'summary': data.get('summary', '')
-        })
-        index['last_updated'] = datetime.now().isoformat()
-        self._save_index(index)
+        self._append({"kind": "knowledge", "data": data}, wait)
         
         logging.info(f"Added knowledge with ID: {knowledge_id}")
         return knowledge_id
     
+    def _spool(self, stream) -> Tuple[str, int]:
+        """Copy an upload to the documents directory in chunks; returns (id, size)"""
+        digest = hashlib.md5()
+        size = 0
+        tmp_path = self.docs_dir / f".upload.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            # Content addressed, so concurrent writers agree
+            doc_id = digest.hexdigest()
+            os.replace(tmp_path, self.docs_dir / doc_id)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return doc_id, size
+    
+    def _create_job(self, filename: str, stream, content_type: str) -> Dict[str, Any]:
+        doc_id, size = self._spool(stream)
+        job = self.jobs.create(
+            document_id=doc_id,
+            filename=filename,
+            content_type=content_type or 'application/octet-stream',
+            size=size
+        )
+        self._refresh()
+        meta = self.stats.documents.get(doc_id)
+        if meta is not None and 'passages' in meta:
+            # Already extracted; re-recording it is enough
+            self._record_document(job, meta.get('extractor'), meta['passages'])
+            self.jobs.update(job, status=JOB_COMPLETED, passages=meta['passages'])
+        return job
+    
+    def submit_document(self, filename: str, stream, content_type: str) -> Dict[str, Any]:
+        """Store an upload from a file-like object and queue its ingestion; returns the job"""
+        job = self._create_job(filename, stream, content_type)
+        if job['status'] != JOB_COMPLETED:
+            self.ingest_queue.put(dict(job))
+        return job
+    
     def add_document(self, filename: str, content: bytes, content_type: str) -> str:
-        """Add a document to the knowledge base"""
-        # Generate a unique ID for this document
-        doc_id = hashlib.md5(content).hexdigest()
-        
-        # Save document
-        doc_path = self.docs_dir / doc_id
-        with open(doc_path, 'wb') as f:
-            f.write(content)
-        
-        # Extract text if possible (simplified version)
-        text_content = ""
-        if content_type.startswith('text/'):
-            text_content = content.decode('utf-8', errors='ignore')
-        
-        # Update index
-        index = self._load_index()
-        index['documents'][doc_id] = {
-            'filename': filename,
-            'content_type': content_type,
-            'size': len(content),
-            'added': datetime.now().isoformat(),
-            'has_text': bool(text_content)
-        }
-        index['last_updated'] = datetime.now().isoformat()
-        self._save_index(index)
-        
-        # If we have text content, store it separately for searching
-        if text_content:
-            text_path = self.docs_dir / f"{doc_id}.txt"
-            with open(text_path, 'w', encoding='utf-8') as f:
-                f.write(text_content)
+        """Add a document to the knowledge base, extracting it before returning"""
+        job = self._create_job(filename, io.BytesIO(content), content_type)
+        if job['status'] != JOB_COMPLETED:
+            self._ingest(job)
+        return job['document_id']
+    
+    def _record_document(self, job: Dict[str, Any], extractor: Optional[str], passages: int) -> None:
+        self._append({
+            "kind": "document",
+            "id": job['document_id'],
+            "meta": {
+                'filename': job['filename'],
+                'content_type': job['content_type'],
+                'size': job['size'],
+                'added': datetime.now().isoformat(),
+                'has_text': passages > 0,
+                'extractor': extractor,
+                'passages': passages
+            }
+        })
+    
+    def _ingest(self, job: Dict[str, Any]) -> None:
+        """Extract a spooled document into passage records, then record the document"""
+        with KB_OPERATION_SECONDS.labels('ingest').time():
+            self._ingest_document(job)
+    
+    def _ingest_document(self, job: Dict[str, Any]) -> None:
+        doc_id = job['document_id']
+        self.jobs.update(job, status=JOB_PROCESSING)
+        found = find_extractor(job['filename'], job['content_type'])
+        name = found[0] if found else None
+        passages = 0
+        error = None
+        if found:
+            records = []
+            try:
+                for text in split_passages(found[1](self.docs_dir / doc_id), self.passage_chars):
+                    if not text.strip():
+                        continue
+                    records.append({"kind": "passage", "id": doc_id, "n": passages, "text": text})
+                    passages += 1
+                    if len(records) >= PASSAGE_BATCH:
+                        self.log.append(records)
+                        records = []
+                self.log.append(records)
+            except ExtractionError as e:
+                error = str(e)
+            except Exception as e:
+                logging.error(f"Error extracting {job['filename']}: {e}")
+                error = f"Extraction failed: {e}"
         
-        logging.info(f"Added document: {filename} (ID: {doc_id})")
-        return doc_id
+        # Passages only become searchable once the document is recorded, so
+        # a failed extraction leaves the document downloadable without text
+        if error:
+            passages = 0
+        self._record_document(job, name, passages)
+        if error:
+            self.jobs.update(job, status=JOB_FAILED, error=error, passages=0)
+            logging.warning(f"Stored document {job['filename']} without text: {error}")
+        else:
+            self.jobs.update(job, status=JOB_COMPLETED, passages=passages)
+            logging.info(f"Added document: {job['filename']} (ID: {doc_id}, {passages} passages)")
     
     def get_document(self, doc_id: str) -> Optional[tuple]:
         """Get a document from the knowledge base"""
-        index = self._load_index()
+        self._refresh()
         
-        if doc_id not in index['documents']:
+        if doc_id not in self.stats.documents:
             return None, None
         
         doc_path = self.docs_dir / doc_id
         if not doc_path.exists():
             return None, None
         
-        return str(doc_path), index['documents'][doc_id]
+        return str(doc_path), self.stats.documents[doc_id]
     
     def record_interaction(self, query: str, response: str, metadata: Optional[Dict[str, Any]] = None) -> str:
-        """Record an interaction with the system"""
+        """Record an interaction with the system (written in the background)"""
         interaction = {
             'type': 'interaction',
             'query': query,
@@ -241,76 +517,170 @@ class KnowledgeBase:
         if metadata:
             interaction.update(metadata)
         
-        return self.add_knowledge(interaction)
+        return self.add_knowledge(interaction, wait=False)
     
-    def query(self, query_text: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Query the knowledge base (simple implementation)"""
-        results = []
+    def _hybrid_search(self, query_text: str, limit: int) -> List[SearchHit]:
+        """
+        Blend max-normalized BM25 with cosine similarity over the union of
+        both candidate lists
+        """
+        keyword = self.index.search(query_text, limit)
+        semantic = self.vectors.search(query_text, limit)
+        top_keyword = max((hit.score for hit in keyword), default=0) or 1
+        combined: Dict[LogPosition, list] = {}
+        for hit in keyword:
+            combined[hit.position] = [(1 - self.hybrid_alpha) * hit.score / top_keyword, hit]
+        for similarity, kind, position in semantic:
+            entry = combined.setdefault(position, [0.0, SearchHit(0.0, kind, position, 0)])
+            entry[0] += self.hybrid_alpha * max(similarity, 0.0)
+        ranked = sorted(combined.values(), key=lambda entry: entry[0], reverse=True)
+        return [hit._replace(score=score) for score, hit in ranked[:limit]]
+    
+    def query(self, query_text: str, limit: int = 10, mode: str = 'keyword') -> List[Dict[str, Any]]:
+        """
+        Query the knowledge base. keyword ranks by BM25; semantic by
+        embedding similarity; hybrid blends the two.
+        """
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode: {mode}")
+        with KB_OPERATION_SECONDS.labels(f'query_{mode}').time():
+            return self._query(query_text, limit, mode)
+    
+    def _query(self, query_text: str, limit: int, mode: str) -> List[Dict[str, Any]]:
+        self._refresh()
         
-        # Load all knowledge files
-        for file_path in self.memory_dir.glob("*.json"):
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                
-                # Simple text matching (in a real system, use vector search)
-                score = 0
-                if 'query' in data and query_text.lower() in data['query'].lower():
-                    score += 3
-                if 'response' in data and query_text.lower() in data['response'].lower():
-                    score += 2
-                if 'summary' in data and query_text.lower() in data['summary'].lower():
-                    score += 4
-                
-                if score > 0:
-                    results.append({
-                        'id': data.get('id'),
-                        'data': data,
-                        'score': score
-                    })
-            except Exception as e:
-                logging.error(f"Error processing knowledge file {file_path}: {e}")
+        # Re-added entries and re-uploaded documents are indexed once per
+        # record, so ask for extra hits to fill the limit after deduplication
+        if mode == 'keyword':
+            hits = self.index.search(query_text, limit * 2)
+        elif self.vectors is None:
+            raise ValueError("Semantic search is not enabled")
+        elif mode == 'semantic':
+            hits = [
+                SearchHit(similarity, kind, position, 0)
+                for similarity, kind, position in self.vectors.search(query_text, limit * 2)
+            ]
+        else:
+            hits = self._hybrid_search(query_text, limit * 2)
         
-        # Search in document text files
-        index = self._load_index()
-        for doc_id, metadata in index['documents'].items():
-            text_path = self.docs_dir / f"{doc_id}.txt"
-            if text_path.exists() and metadata.get('has_text'):
-                try:
-                    with open(text_path, 'r', encoding='utf-8') as f:
-                        text_content = f.read()
-                    
-                    if query_text.lower() in text_content.lower():
-                        results.append({
-                            'id': doc_id,
-                            'type': 'document',
-                            'filename': metadata.get('filename'),
-                            'score': 1,
-                            'snippet': text_content[:200] + '...' if len(text_content) > 200 else text_content
-                        })
-                except Exception as e:
-                    logging.error(f"Error searching document {doc_id}: {e}")
+        results = []
+        seen = set()
+        for hit in hits:
+            record = self.log.read(hit.position)
+            if record is None:
+                continue
+            
+            if hit.kind == KIND_DOCUMENT:
+                doc_id = record['id']
+                meta = self.stats.documents.get(doc_id)
+                # Passages of a document still being ingested are skipped
+                if doc_id in seen or meta is None:
+                    continue
+                text = self._record_text(record)
+                if text is None:
+                    continue
+                seen.add(doc_id)
+                result = {
+                    'id': doc_id,
+                    'type': 'document',
+                    'filename': meta.get('filename'),
+                    'score': hit.score,
+                    'snippet': make_snippet(text, hit.snippet_offset)
+                }
+                if record['kind'] == 'passage':
+                    result['passage'] = record['n']
+                results.append(result)
+            else:
+                data = record['data']
+                if data.get('id') in seen:
+                    continue
+                seen.add(data.get('id'))
+                text, _ = knowledge_text(data)
+                results.append({
+                    'id': data.get('id'),
+                    'data': data,
+                    'score': hit.score,
+                    'snippet': make_snippet(text, hit.snippet_offset)
+                })
+            
+            if len(results) >= limit:
+                break
         
-        # Sort by score and limit results
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results[:limit]
+        return results
     
-    def get_stats(self) -> Dict[str, Any]:
-        """Get statistics about the knowledge base"""
-        index = self._load_index()
+    def get_stats(self, hours: int = 24) -> Dict[str, Any]:
+        """
+        Get statistics about the knowledge base, with hourly aggregates of
+        the last ``hours`` hours. Nothing here walks the storage directory:
+        the counters are kept as records are read, and the size is the log
+        segments, the documents' recorded sizes and the index files.
+        """
+        self._refresh()
         
+        storage_bytes = (
+            self.log.size() + self.stats.document_bytes
+            + dir_bytes(self.storage_dir / "index") + dir_bytes(self.storage_dir / "vectors")
+        )
         return {
-            'document_count': len(index['documents']),
-            'interaction_count': len(index['interactions']),
-            'last_updated': index['last_updated'],
-            'storage_size_kb': sum(f.stat().st_size for f in self.storage_dir.glob('**/*') if f.is_file()) // 1024
+            'document_count': len(self.stats.documents),
+            'interaction_count': self.stats.interaction_count,
+            'pending_writes': self.writer.pending() if self.writer else 0,
+            'pending_ingestion': self.ingest_queue.pending(),
+            'last_updated': self.stats.last_updated,
+            'log_segments': len(self.log.segments()),
+            'index': self.index.stats(),
+            'vectors': self.vectors.stats() if self.vectors else None,
+            'storage_size_kb': storage_bytes // 1024,
+            'aggregates': self.stats.aggregates(hours)
         }
+    
+    def list_interactions(
+        self, limit: int = 50, before: Optional[LogPosition] = None, kind: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        A page of knowledge entries, newest first, optionally only those of
+        one type. Pages are read backwards from the log position in
+        ``before`` (the previous page's cursor), so each costs the same at
+        any size.
+        """
+        with KB_OPERATION_SECONDS.labels('list').time():
+            items = []
+            cursor = None
+            for position, record in self.log.scan_back(before):
+                if record.get('kind') != 'knowledge':
+                    continue
+                data = record['data']
+                if kind is not None and data.get('type') != kind:
+                    continue
+                items.append(data)
+                if len(items) >= limit:
+                    cursor = format_cursor(position)
+                    break
+            return {"interactions": items, "next_cursor": cursor}
 
 
-        # Singleton instance
-        kb = KnowledgeBase()
+# Singleton instance, created on first use so importing this module
+# (e.g. from the benchmarks) doesn't open the default storage directory
+kb = None
 
 
-        def get_knowledge_base():
-            """Get the knowledge base instance"""
-            return kb
+def get_knowledge_base():
+    """Get the knowledge base instance"""
+    global kb
+    if kb is None:
+        kb = KnowledgeBase(
+            storage_dir=KB_STORAGE_DIR,
+            segment_max_bytes=KB_SEGMENT_MAX_BYTES,
+            async_writes=KB_ASYNC_WRITES,
+            flush_interval=KB_FLUSH_INTERVAL,
+            fsync=KB_FSYNC,
+            checkpoint_docs=KB_INDEX_CHECKPOINT_DOCS,
+            embedder=load_embedder(KB_EMBEDDING_MODEL, KB_EMBEDDING_DIM)
+            if KB_SEMANTIC_ENABLED and np is not None else None,
+            embedding_batch=KB_EMBEDDING_BATCH,
+            hybrid_alpha=KB_HYBRID_ALPHA,
+            passage_chars=KB_PASSAGE_CHARS,
+            stats_hours=KB_STATS_HOURS,
+            stats_checkpoint_records=KB_STATS_CHECKPOINT_RECORDS
+        )
+    return kb
@@ -0,0 +1,443 @@
+"""
+Inverted full-text index for the knowledge base.
+
+Every knowledge entry, document passage and (legacy) whole text document
+in the log is a numbered index document. For each term the index keeps a postings list of (document,
+weighted term frequency, offset of the term's first occurrence), ranks
+matches with BM25 and uses the offsets to cut snippets around the match.
+
+The bulk of the index lives in a checkpoint file, ``index.bin``, that is
+memory-mapped rather than loaded: the term dictionary is binary-searched
+in place and postings are read straight out of the mapping. Records
+appended to the log after the checkpoint are indexed into an in-memory
+delta. Once the delta grows past a fraction of the checkpoint, one worker
+merges the two into a new checkpoint (written aside and renamed into
+place) and the others switch to it on their next catch-up.
+"""
+import heapq
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: checkpoints are not coordinated across processes
+    fcntl = None
+
+from knowledge_log import AppendLog, LogPosition
+
+
+TOKEN = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 64
+
+# Field boosts for knowledge entries, in the order fields are concatenated
+FIELD_WEIGHTS = (('summary', 4), ('query', 3), ('response', 2))
+
+KIND_KNOWLEDGE = 0
+KIND_DOCUMENT = 1
+
+MAGIC = b'KBIX'
+VERSION = 1
+# magic, version, log segment, log offset, documents, terms, total length
+HEADER = struct.Struct('<4sIIQIIQ')
+MAX_TF = 0xFFFF
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str):
+    """Yield (term, offset) for each word in text"""
+    for match in TOKEN.finditer(text):
+        term = match.group().lower()
+        if len(term) <= MAX_TOKEN_LENGTH:
+            yield term, match.start()
+
+
+def knowledge_text(data: Dict) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    Searchable text of a knowledge entry and the (end offset, weight) of
+    each field in it
+    """
+    parts = []
+    fields = []
+    length = 0
+    for name, weight in FIELD_WEIGHTS:
+        value = data.get(name)
+        if isinstance(value, str) and value:
+            if parts:
+                parts.append('\n')
+                length += 1
+            parts.append(value)
+            length += len(value)
+            fields.append((length, weight))
+    return ''.join(parts), fields
+
+
+def make_snippet(text: str, offset: int, width: int = 200) -> str:
+    """Cut about width characters of text around offset, on word boundaries"""
+    if len(text) <= width:
+        return text
+    start = max(0, min(offset - width // 4, len(text) - width))
+    if start:
+        space = text.find(' ', start, offset)
+        start = space + 1 if space >= 0 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > offset else end
+    snippet = text[start:end].strip()
+    return ('...' if start else '') + snippet + ('...' if end < len(text) else '')
+
+
+class SearchHit(NamedTuple):
+    """A ranked match; position locates its record in the log"""
+    score: float
+    kind: int
+    position: LogPosition
+    snippet_offset: int
+
+
+class _Postings:
+    """Growable postings list for the in-memory delta"""
+    __slots__ = ('docs', 'tfs', 'offsets')
+
+    def __init__(self):
+        self.docs = array('I')
+        self.tfs = array('H')
+        self.offsets = array('I')
+
+
+def _pad(f) -> None:
+    """Align the next section to 8 bytes"""
+    f.write(b'\0' * (-f.tell() % 8))
+
+
+class _Checkpoint:
+    """A memory-mapped index file"""
+
+    def __init__(self, path: Path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, segment, offset, docs, terms, total = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} knowledge index")
+        self.position = LogPosition(segment, offset)
+        self.doc_count = docs
+        self.term_count = terms
+        self.total_length = total
+
+        cursor = HEADER.size
+        cursor += -cursor % 8
+
+        def section(fmt, count):
+            nonlocal cursor
+            size = array(fmt).itemsize * count
+            data = view[cursor:cursor + size].cast(fmt)
+            cursor += size
+            cursor += -cursor % 8
+            return data
+
+        self.kinds = section('B', docs)
+        self.segments = section('I', docs)
+        self.offsets = section('Q', docs)
+        self.lengths = section('I', docs)
+        self.term_offsets = section('Q', terms + 1)
+        self.postings_starts = section('Q', terms + 1)
+        self.terms_blob = view[cursor:cursor + (self.term_offsets[terms] if terms else 0)]
+        cursor += len(self.terms_blob)
+        cursor += -cursor % 8
+        postings = self.postings_starts[terms] if terms else 0
+        self.posting_docs = section('I', postings)
+        self.posting_tfs = section('H', postings)
+        self.posting_offsets = section('I', postings)
+
+    def term(self, i: int) -> bytes:
+        return bytes(self.terms_blob[self.term_offsets[i]:self.term_offsets[i + 1]])
+
+    def find(self, term: bytes) -> Optional[int]:
+        """Binary-search the term dictionary; returns the term number"""
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.term(mid)
+            if current < term:
+                lo = mid + 1
+            elif current > term:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def postings(self, i: int):
+        start, end = self.postings_starts[i], self.postings_starts[i + 1]
+        return (
+            self.posting_docs[start:end],
+            self.posting_tfs[start:end],
+            self.posting_offsets[start:end]
+        )
+
+
+class InvertedIndex:
+    """BM25 full-text index over the knowledge log"""
+
+    def __init__(self, directory, checkpoint_docs: int = 10000):
+        """checkpoint_docs is the smallest delta worth merging into the checkpoint"""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / "index.bin"
+        self.checkpoint_docs = checkpoint_docs
+        self._lock = threading.RLock()
+        self._base: Optional[_Checkpoint] = None
+        self._loaded = None
+        self._reset_delta()
+        self._load()
+
+    def _reset_delta(self) -> None:
+        self._postings: Dict[str, _Postings] = {}
+        self._kinds = array('B')
+        self._segments = array('I')
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._delta_length = 0
+        self.position = self._base.position if self._base else None
+
+    def _file_version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> None:
+        """Map the checkpoint file, if there is a usable one"""
+        self._loaded = self._file_version()
+        try:
+            self._base = _Checkpoint(self.path)
+        except FileNotFoundError:
+            self._base = None
+        except Exception as e:
+            logging.error(f"Ignoring unreadable knowledge index: {e}")
+            self._base = None
+        self._reset_delta()
+
+    def _checkpoint_changed(self) -> bool:
+        return self._file_version() != self._loaded
+
+    @property
+    def base_docs(self) -> int:
+        return self._base.doc_count if self._base else 0
+
+    @property
+    def doc_count(self) -> int:
+        return self.base_docs + len(self._kinds)
+
+    def _add(self, kind: int, position: LogPosition, text: str, fields=None) -> None:
+        """Index one record's text"""
+        doc = self.doc_count
+        terms: Dict[str, List[int]] = {}
+        length = 0
+        field = 0
+        for term, offset in tokenize(text):
+            weight = 1
+            if fields:
+                while field < len(fields) - 1 and offset >= fields[field][0]:
+                    field += 1
+                weight = fields[field][1]
+            entry = terms.get(term)
+            if entry is None:
+                terms[term] = [weight, offset]
+            else:
+                entry[0] += weight
+            length += 1
+
+        for term, (tf, offset) in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = _Postings()
+            postings.docs.append(doc)
+            postings.tfs.append(min(tf, MAX_TF))
+            postings.offsets.append(offset)
+        self._kinds.append(kind)
+        self._segments.append(position.segment)
+        self._offsets.append(position.offset)
+        self._lengths.append(length)
+        self._delta_length += length
+
+    def catch_up(self, log: AppendLog, load_text: Callable[[Dict], Optional[str]]) -> int:
+        """
+        Index records appended since the last catch-up. load_text returns
+        the text of a document or passage record, or None if it has none.
+        Returns the number of records indexed.
+        """
+        with self._lock:
+            if self._checkpoint_changed():
+                # Another worker wrote a newer checkpoint; drop our delta
+                # and continue from where that checkpoint ends
+                self._load()
+
+            indexed = 0
+            for start, end, record in log.scan(self.position):
+                kind = record.get('kind')
+                if kind == 'knowledge':
+                    text, fields = knowledge_text(record.get('data', {}))
+                    self._add(KIND_KNOWLEDGE, start, text, fields)
+                    indexed += 1
+                elif kind in ('document', 'passage'):
+                    text = load_text(record)
+                    if text:
+                        self._add(KIND_DOCUMENT, start, text)
+                        indexed += 1
+                self.position = end
+
+            if len(self._kinds) >= max(self.checkpoint_docs, self.base_docs // 4):
+                self.checkpoint()
+            return indexed
+
+    def _lookup(self, term: str):
+        """Yield (docs, tfs, offsets) postings for term from every layer"""
+        if self._base is not None:
+            i = self._base.find(term.encode('utf-8'))
+            if i is not None:
+                yield self._base.postings(i)
+        postings = self._postings.get(term)
+        if postings is not None:
+            yield postings.docs, postings.tfs, postings.offsets
+
+    def _doc(self, doc: int) -> Tuple[int, LogPosition]:
+        base = self.base_docs
+        if doc < base:
+            return self._base.kinds[doc], LogPosition(self._base.segments[doc], self._base.offsets[doc])
+        doc -= base
+        return self._kinds[doc], LogPosition(self._segments[doc], self._offsets[doc])
+
+    def search(self, query: str, limit: int = 10) -> List[SearchHit]:
+        """Rank documents matching any query term by BM25"""
+        with self._lock:
+            total_docs = self.doc_count
+            if not total_docs:
+                return []
+            base = self.base_docs
+            total_length = (self._base.total_length if self._base else 0) + self._delta_length
+            average_length = total_length / total_docs or 1
+            base_lengths = self._base.lengths if self._base else None
+
+            scores: Dict[int, float] = {}
+            # Snippet anchor: the first occurrence of the rarest matched term
+            anchors: Dict[int, Tuple[float, int]] = {}
+            for term in dict.fromkeys(term for term, _ in tokenize(query)):
+                layers = list(self._lookup(term))
+                df = sum(len(docs) for docs, _, _ in layers)
+                if not df:
+                    continue
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                for docs, tfs, offsets in layers:
+                    for doc, tf, offset in zip(docs, tfs, offsets):
+                        length = base_lengths[doc] if doc < base else self._lengths[doc - base]
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                        scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                        anchor = anchors.get(doc)
+                        if anchor is None or idf > anchor[0]:
+                            anchors[doc] = (idf, offset)
+
+            hits = []
+            for doc, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1]):
+                kind, position = self._doc(doc)
+                hits.append(SearchHit(score, kind, position, anchors[doc][1]))
+            return hits
+
+    def checkpoint(self) -> bool:
+        """
+        Merge the delta into a new checkpoint file. Returns False if another
+        worker is already writing one.
+        """
+        with self._lock:
+            lock_file = open(self.directory / "index.lock", 'a')
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return False
+                if self._checkpoint_changed():
+                    # Someone else just merged; pick theirs up next catch-up
+                    return False
+                self._write()
+                self._load()
+                return True
+            finally:
+                lock_file.close()
+
+    def _write(self) -> None:
+        base = self._base
+        # term -> (number in the checkpoint, delta postings)
+        terms: Dict[bytes, list] = {}
+        if base is not None:
+            for i in range(base.term_count):
+                terms[base.term(i)] = [i, None]
+        for term, postings in self._postings.items():
+            terms.setdefault(term.encode('utf-8'), [None, None])[1] = postings
+        ordered = sorted(terms.items())
+
+        tmp_path = self.directory / f".index.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            position = self.position or LogPosition(1, 0)
+            total_length = (base.total_length if base else 0) + self._delta_length
+            f.write(HEADER.pack(
+                MAGIC, VERSION, position.segment, position.offset,
+                self.doc_count, len(ordered), total_length
+            ))
+            _pad(f)
+            for column in ('kinds', 'segments', 'offsets', 'lengths'):
+                if base is not None:
+                    f.write(getattr(base, column))
+                f.write(getattr(self, '_' + column))
+                _pad(f)
+
+            term_offsets = array('Q', [0])
+            postings_starts = array('Q', [0])
+            for term, (i, delta) in ordered:
+                term_offsets.append(term_offsets[-1] + len(term))
+                count = len(delta.docs) if delta is not None else 0
+                if i is not None:
+                    count += base.postings_starts[i + 1] - base.postings_starts[i]
+                postings_starts.append(postings_starts[-1] + count)
+            for data in (term_offsets, postings_starts, b''.join(term for term, _ in ordered)):
+                f.write(data)
+                _pad(f)
+
+            # Postings are three parallel arrays; within a term, checkpoint
+            # documents come before (lower-numbered) delta documents
+            for column, name in enumerate(('docs', 'tfs', 'offsets')):
+                for term, (i, delta) in ordered:
+                    if i is not None:
+                        f.write(base.postings(i)[column])
+                    if delta is not None:
+                        f.write(getattr(delta, name))
+                _pad(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logging.info(
+            f"Wrote knowledge index checkpoint: {self.doc_count} documents, "
+            f"{len(ordered)} terms"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                'indexed_documents': self.doc_count,
+                'checkpoint_documents': self.base_docs,
+                'delta_documents': len(self._kinds),
+                'checkpoint_terms': self._base.term_count if self._base else 0,
+                'delta_terms': len(self._postings)
+            }
@@ -0,0 +1,325 @@
+"""
+Streaming document ingestion for the knowledge base.
+
+Uploads are hashed and spooled to disk in fixed-size chunks, then handed
+to a background thread that extracts their text and splits it into
+passages. Extractors are generators registered per content type and file
+extension; each yields the text a piece at a time (a page, a paragraph,
+a block of lines), so neither spooling nor extraction holds more than a
+bounded part of the document in memory, whatever its size.
+
+Job status lives in small JSON files next to the knowledge log, so any
+worker can report on a job that another worker is processing.
+"""
+import codecs
+import html.parser
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import uuid
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF uploads are stored without text
+    PdfReader = None
+
+
+CHUNK_SIZE = 1024 ** 2
+# Decoded text handed to the passage splitter at a time
+TEXT_PIECE_CHARS = 64 * 1024
+
+JOB_QUEUED = 'queued'
+JOB_PROCESSING = 'processing'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+class ExtractionError(Exception):
+    """The document's text could not be extracted"""
+
+
+# Extractors: (name, content types, file extensions, function)
+EXTRACTORS: List[Tuple[str, Tuple[str, ...], Tuple[str, ...], Callable[[Path], Iterator[str]]]] = []
+
+
+def extractor(name: str, content_types: Iterable[str] = (), extensions: Iterable[str] = ()):
+    """Register a function that yields the text of a file piece by piece"""
+    def register(fn):
+        EXTRACTORS.append((name, tuple(content_types), tuple(extensions), fn))
+        return fn
+    return register
+
+
+def find_extractor(filename: str, content_type: str) -> Optional[Tuple[str, Callable[[Path], Iterator[str]]]]:
+    """Pick an extractor by content type, then by extension, then any text/*"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    extension = os.path.splitext(filename or '')[1].lower()
+    for name, content_types, _, fn in EXTRACTORS:
+        if content_type in content_types:
+            return name, fn
+    for name, _, extensions, fn in EXTRACTORS:
+        if extension in extensions:
+            return name, fn
+    if content_type.startswith('text/'):
+        return 'text', extract_text
+    return None
+
+
+def _read_text(path: Path) -> Iterator[str]:
+    """Decode a UTF-8 file incrementally"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(TEXT_PIECE_CHARS)
+            if not data:
+                break
+            yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+@extractor('text', ('text/plain', 'text/csv'), ('.txt', '.csv', '.log'))
+def extract_text(path: Path) -> Iterator[str]:
+    return _read_text(path)
+
+
+MARKDOWN_RULES = [
+    (re.compile(r'^\s{0,3}(#{1,6}|>+|[-*+]|\d+[.)])\s+'), ''),
+    (re.compile(r'^\s*(```|~~~).*$'), ''),
+    (re.compile(r'!?\[([^\]]*)\]\([^)]*\)'), r'\1'),
+    (re.compile(r'<[^>]+>'), ''),
+    (re.compile(r'(?<!\w)(\*{1,3}|_{1,3}|`+)(\S.*?\S|\S)\1(?!\w)'), r'\2')
+]
+
+
+@extractor('markdown', ('text/markdown', 'text/x-markdown'), ('.md', '.markdown'))
+def extract_markdown(path: Path) -> Iterator[str]:
+    lines = []
+    size = 0
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            for pattern, replacement in MARKDOWN_RULES:
+                line = pattern.sub(replacement, line)
+            lines.append(line)
+            size += len(line)
+            if size >= TEXT_PIECE_CHARS:
+                yield ''.join(lines)
+                lines, size = [], 0
+    yield ''.join(lines)
+
+
+class _HTMLText(html.parser.HTMLParser):
+    """Collects visible text, with a line break after each block element"""
+
+    SKIP = {'script', 'style', 'noscript', 'template', 'head'}
+    BLOCKS = {
+        'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+        'section', 'article', 'blockquote', 'pre', 'table', 'title'
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(re.sub(r'[ \t\r\n]+', ' ', data))
+
+    def take(self) -> str:
+        text, self.parts = ''.join(self.parts), []
+        return text
+
+
+@extractor('html', ('text/html', 'application/xhtml+xml'), ('.html', '.htm', '.xhtml'))
+def extract_html(path: Path) -> Iterator[str]:
+    parser = _HTMLText()
+    for piece in _read_text(path):
+        parser.feed(piece)
+        yield parser.take()
+    parser.close()
+    yield parser.take()
+
+
+@extractor('pdf', ('application/pdf',), ('.pdf',))
+def extract_pdf(path: Path) -> Iterator[str]:
+    if PdfReader is None:
+        raise ExtractionError("PDF text extraction requires pypdf")
+    try:
+        # Given a path pypdf reads the whole file into memory; a file
+        # object is read from as pages are parsed
+        with open(path, 'rb') as f:
+            for page in PdfReader(f).pages:
+                yield (page.extract_text() or '') + '\n\n'
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"Could not read PDF: {e}")
+
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+@extractor(
+    'docx',
+    ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',),
+    ('.docx',)
+)
+def extract_docx(path: Path) -> Iterator[str]:
+    try:
+        archive = zipfile.ZipFile(path)
+        xml = archive.open('word/document.xml')
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ExtractionError(f"Not a Word document: {e}")
+    with archive, xml:
+        parts: List[str] = []
+        size = 0
+        stack = []
+        try:
+            for event, element in ElementTree.iterparse(xml, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(element)
+                    continue
+                stack.pop()
+                tag = element.tag
+                if tag == WORD_NS + 't':
+                    parts.append(element.text or '')
+                    size += len(parts[-1])
+                elif tag == WORD_NS + 'tab':
+                    parts.append('\t')
+                elif tag in (WORD_NS + 'br', WORD_NS + 'cr'):
+                    parts.append('\n')
+                elif tag == WORD_NS + 'p':
+                    parts.append('\n')
+                    # Drop finished paragraphs so the tree never grows
+                    if stack:
+                        stack[-1].remove(element)
+                    if size >= TEXT_PIECE_CHARS:
+                        yield ''.join(parts)
+                        parts, size = [], 0
+        except ElementTree.ParseError as e:
+            raise ExtractionError(f"Corrupt Word document: {e}")
+        yield ''.join(parts)
+
+
+def split_passages(pieces: Iterable[str], size: int = 1000) -> Iterator[str]:
+    """
+    Regroup a stream of text into consecutive passages of about size
+    characters, cut at a paragraph, sentence or word boundary. The passages
+    concatenate back to the full text.
+    """
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= size * 2:
+            cut = _boundary(buffer, size)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    while len(buffer) > size:
+        cut = _boundary(buffer, size)
+        yield buffer[:cut]
+        buffer = buffer[cut:]
+    if buffer:
+        yield buffer
+
+
+def _boundary(text: str, size: int) -> int:
+    """Best place to end a passage of about size characters"""
+    window = text[:int(size * 1.5)]
+    for separator in ('\n\n', '\n', '. ', ' '):
+        cut = window.rfind(separator, size // 2)
+        if cut >= 0:
+            return cut + len(separator)
+    return size
+
+
+class JobStore:
+    """Ingestion job status, one JSON file per job"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _write(self, job: Dict) -> None:
+        tmp_path = self.directory / f".{job['id']}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['id']))
+
+    def create(self, **fields) -> Dict:
+        now = datetime.now().isoformat()
+        job = {'id': uuid.uuid4().hex, 'status': JOB_QUEUED, 'created': now, 'updated': now}
+        job.update(fields)
+        self._write(job)
+        return job
+
+    def update(self, job: Dict, **fields) -> Dict:
+        job.update(fields, updated=datetime.now().isoformat())
+        self._write(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            return None
+        try:
+            with open(self._path(job_id), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+class IngestQueue:
+    """Runs ingestion jobs one at a time on a background thread"""
+
+    def __init__(self, process: Callable[[Dict], None]):
+        self.process = process
+        self._queue: "queue.Queue[Dict]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def put(self, job: Dict) -> None:
+        self._queue.put(job)
+        # Started lazily so workers forked after import get their own thread
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="kb-ingest", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                self.process(job)
+            except Exception as e:
+                logging.error(f"Error ingesting document {job.get('document_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def join(self) -> None:
+        """Block until every queued job has been processed"""
+        self._queue.join()
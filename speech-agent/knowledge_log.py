@@ -0,0 +1,320 @@
+"""
+Append-only storage for the knowledge base.
+
+Records are JSON lines appended to numbered segment files
+(``segment-000001.log``, ...); once the active segment reaches
+``segment_max_bytes`` the next append starts a new one. Appends from every
+thread and worker process are serialized by an exclusive lock on
+``log.lock`` and each batch goes out in a single write, so a record is
+either fully in the log or, after a crash mid-write, a torn trailing line
+that readers skip and the next writer terminates.
+
+Readers resume from a LogPosition and only parse what was appended since,
+so neither appending nor catching up costs more as the log grows.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+
+SEGMENT_NAME = "segment-{:06d}.log"
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{6})\.log$')
+
+
+class LogPosition(NamedTuple):
+    """A point in the log: segment number and byte offset within it"""
+    segment: int
+    offset: int
+
+
+class AppendLog:
+    """Segment-rotated append-only log of JSON records"""
+
+    def __init__(
+        self,
+        directory,
+        segment_max_bytes: int = 64 * 1024 ** 2,
+        fsync: bool = False
+    ):
+        """Initialize; fsync makes every append durable at some latency cost"""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._lock_path = self.directory / "log.lock"
+
+    def segment_path(self, number: int) -> Path:
+        return self.directory / SEGMENT_NAME.format(number)
+
+    def segments(self) -> List[int]:
+        """Numbers of the existing segments, oldest first"""
+        numbers = []
+        for path in self.directory.iterdir():
+            match = SEGMENT_PATTERN.match(path.name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    @contextmanager
+    def locked(self):
+        """Hold the writer lock across threads and worker processes"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, records: List[Dict[str, Any]]) -> None:
+        """Append records atomically with respect to other writers"""
+        if not records:
+            return
+        with self.locked():
+            self.append_locked(records)
+
+    def append_locked(self, records: List[Dict[str, Any]]) -> None:
+        """Append records; the caller must hold locked()"""
+        data = b''.join(
+            json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8') + b'\n'
+            for record in records
+        )
+        segments = self.segments()
+        number = segments[-1] if segments else 1
+        fd = os.open(self.segment_path(number), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size >= self.segment_max_bytes:
+                os.close(fd)
+                number += 1
+                fd = os.open(self.segment_path(number), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            elif size and os.pread(fd, 1, size - 1) != b'\n':
+                # Terminate a line torn by a crashed writer
+                data = b'\n' + data
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def scan(
+        self, start: Optional[LogPosition] = None
+    ) -> Iterator[Tuple[LogPosition, LogPosition, Dict[str, Any]]]:
+        """
+        Yield (position of the record, position after it, record) for every
+        complete record from start (default: the beginning of the log)
+        """
+        for number in self.segments():
+            if start is not None and number < start.segment:
+                continue
+            offset = start.offset if start is not None and number == start.segment else 0
+            try:
+                with open(self.segment_path(number), 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            # Still being written (or torn); stop before it
+                            break
+                        offset += len(line)
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            logging.warning(
+                                f"Skipping corrupt record in segment {number} at {offset - len(line)}"
+                            )
+                            continue
+                        yield LogPosition(number, offset - len(line)), LogPosition(number, offset), record
+            except FileNotFoundError:
+                continue
+
+    def scan_back(
+        self, before: Optional[LogPosition] = None, block_size: int = 64 * 1024
+    ) -> Iterator[Tuple[LogPosition, Dict[str, Any]]]:
+        """
+        Yield (position, record) for every complete record before `before`
+        (default: the end of the log), newest first, reading segments
+        backwards a block at a time
+        """
+        for number in reversed(self.segments()):
+            if before is not None and number > before.segment:
+                continue
+            try:
+                with open(self.segment_path(number), 'rb') as f:
+                    end = before.offset if before is not None and number == before.segment else os.fstat(f.fileno()).st_size
+                    # A line that starts in the previous block; always ends with a newline
+                    carry = b''
+                    while end > 0:
+                        start = max(0, end - block_size)
+                        f.seek(start)
+                        data = f.read(end - start) + carry
+                        end = start
+                        # The last piece is empty or a line still being written
+                        lines = data.split(b'\n')[:-1]
+                        offset = start
+                        if start > 0 and lines:
+                            carry = lines[0] + b'\n'
+                            lines = lines[1:]
+                            offset += len(carry)
+                        positions = []
+                        for line in lines:
+                            positions.append(offset)
+                            offset += len(line) + 1
+                        for offset, line in zip(reversed(positions), reversed(lines)):
+                            if not line:
+                                continue
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                # A line torn by a crashed writer
+                                continue
+                            yield LogPosition(number, offset), record
+            except FileNotFoundError:
+                continue
+
+    def read(self, position: LogPosition) -> Optional[Dict[str, Any]]:
+        """Return the record starting at position, or None"""
+        try:
+            with open(self.segment_path(position.segment), 'rb') as f:
+                f.seek(position.offset)
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        if not line.endswith(b'\n'):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def end(self) -> LogPosition:
+        """Position just past the last byte currently in the log"""
+        segments = self.segments()
+        if not segments:
+            return LogPosition(1, 0)
+        try:
+            return LogPosition(segments[-1], self.segment_path(segments[-1]).stat().st_size)
+        except FileNotFoundError:
+            return LogPosition(segments[-1], 0)
+
+    def size(self) -> int:
+        """Total bytes across segments"""
+        total = 0
+        for number in self.segments():
+            try:
+                total += self.segment_path(number).stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+
+class BatchWriter:
+    """
+    Appends records to an AppendLog from a background thread.
+
+    put() only enqueues, so the caller never waits on disk I/O or the
+    cross-process lock; the writer appends whatever accumulated (up to
+    ``max_batch`` records) in one locked write every ``flush_interval``.
+    Anything still queued at interpreter exit is written by an atexit hook.
+    """
+
+    def __init__(
+        self,
+        log: AppendLog,
+        max_batch: int = 256,
+        flush_interval: float = 0.05,
+        on_write: Optional[Callable[[float], None]] = None
+    ):
+        """on_write is called with the duration of each successful batch append"""
+        self.log = log
+        self.on_write = on_write
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.errors = 0
+        atexit.register(self.flush)
+
+    def _ensure_started(self) -> None:
+        # Started lazily so workers forked after import get their own thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="kb-writer", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, record: Dict[str, Any]) -> None:
+        """Queue a record for writing"""
+        self._queue.put(record)
+        self._ensure_started()
+
+    def _fill(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Top batch up with whatever is already queued"""
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            start = time.perf_counter()
+            self.log.append(batch)
+            self.batches += 1
+            if self.on_write is not None:
+                self.on_write(time.perf_counter() - start)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Failed to write {len(batch)} knowledge records: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._fill([self._queue.get()])
+            if len(batch) < self.max_batch and self.flush_interval > 0:
+                # Let concurrent requests join this batch
+                time.sleep(self.flush_interval)
+                self._fill(batch)
+            self._write(batch)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self) -> None:
+        """Block until every queued record has been written"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+            return
+        # No writer thread (e.g. at shutdown): write synchronously
+        while not self._queue.empty():
+            try:
+                batch = self._fill([self._queue.get_nowait()])
+            except queue.Empty:
+                return
+            self._write(batch)
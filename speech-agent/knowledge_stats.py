@@ -0,0 +1,210 @@
+"""
+Counters and hourly aggregates over the knowledge log.
+
+Every record appended to the log updates the in-memory summary: the
+document table, interaction count, document bytes and, per hour of the
+records' timestamps, requests, TTS requests, a text length histogram and
+segment cache hits. The summary is checkpointed to ``stats.json`` with the
+log position it covers, so a worker starting up only reads the records
+appended after it instead of the whole log, and the dashboard never walks
+the storage directory.
+
+Checkpoints are written by whichever worker has caught up on enough new
+records. Each is complete on its own, so a worker replacing a newer one
+with an older one only means the next start-up reads a few more records.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from knowledge_log import LogPosition
+
+
+# Upper bounds of the text length histogram's buckets (the last is open)
+LENGTH_BUCKETS = (50, 200, 1000, 5000)
+LENGTH_LABELS = ['<50', '50-199', '200-999', '1000-4999', '5000+']
+
+
+def length_bucket(length: int) -> int:
+    for i, bound in enumerate(LENGTH_BUCKETS):
+        if length < bound:
+            return i
+    return len(LENGTH_BUCKETS)
+
+
+def _empty_hour() -> Dict[str, Any]:
+    return {
+        'requests': 0,
+        'tts_requests': 0,
+        'text_length': [0] * len(LENGTH_LABELS),
+        'segments': 0,
+        'cached_segments': 0
+    }
+
+
+class KnowledgeStats:
+    """Summary of the log, kept current record by record and checkpointed"""
+
+    def __init__(self, path, hours: int = 168, checkpoint_records: int = 1000, checkpoint_interval: float = 60):
+        """
+        hours is how many hourly buckets are kept; a checkpoint is written
+        once checkpoint_records records (or any, after checkpoint_interval
+        seconds) have been applied since the last
+        """
+        self.path = Path(path)
+        self.hours = hours
+        self.checkpoint_records = checkpoint_records
+        self.checkpoint_interval = checkpoint_interval
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+        self.position: Optional[LogPosition] = None
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.interaction_count = 0
+        self.document_bytes = 0
+        self.last_updated = None
+        self.hourly: Dict[str, Dict[str, Any]] = {}
+
+    def load(self, log_end: LogPosition) -> bool:
+        """Start from the checkpoint, if there is one the log still extends past"""
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            position = LogPosition(*state['position'])
+            fields = (state['documents'], state['interaction_count'], state['document_bytes'],
+                      state['last_updated'], state['hourly'])
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring unreadable knowledge stats checkpoint: {e}")
+            return False
+        if position > log_end:
+            # The log was replaced since; count it again from the start
+            logging.warning("Knowledge stats checkpoint is ahead of the log; ignoring it")
+            return False
+        self.position = position
+        (self.documents, self.interaction_count, self.document_bytes,
+         self.last_updated, self.hourly) = fields
+        return True
+
+    def apply(self, record: Dict[str, Any], position: LogPosition) -> None:
+        """Count one log record; position is where the log continues after it"""
+        kind = record.get('kind')
+        if kind == 'document':
+            meta = record['meta']
+            if record['id'] not in self.documents:
+                # Content addressed: a re-recorded document is the same bytes
+                self.document_bytes += meta.get('size') or 0
+            self.documents[record['id']] = meta
+            self.last_updated = meta.get('added', self.last_updated)
+        elif kind == 'knowledge':
+            data = record['data']
+            self.interaction_count += 1
+            self.last_updated = data.get('timestamp', self.last_updated)
+            self._count_hour(data)
+        self.position = position
+        self._unsaved += 1
+
+    def _count_hour(self, data: Dict[str, Any]) -> None:
+        timestamp = data.get('timestamp')
+        if not timestamp or data.get('type') not in ('interaction', 'tts_request'):
+            return
+        hour = timestamp[:13]
+        bucket = self.hourly.get(hour)
+        if bucket is None:
+            bucket = self.hourly[hour] = _empty_hour()
+            if len(self.hourly) > self.hours:
+                for old in sorted(self.hourly)[:len(self.hourly) - self.hours]:
+                    del self.hourly[old]
+                if hour not in self.hourly:
+                    return
+        bucket['requests'] += 1
+        if data['type'] == 'tts_request':
+            bucket['tts_requests'] += 1
+            length = data.get('text_length', len(data.get('query') or ''))
+            bucket['text_length'][length_bucket(length)] += 1
+            bucket['segments'] += data.get('segments', 0)
+            bucket['cached_segments'] += data.get('cached_segments', 0)
+
+    def maybe_save(self) -> bool:
+        """Checkpoint if enough has been applied since the last one"""
+        if not self._unsaved:
+            return False
+        if self._unsaved < self.checkpoint_records and time.monotonic() - self._saved_at < self.checkpoint_interval:
+            return False
+        self.save()
+        return True
+
+    def save(self) -> None:
+        state = {
+            'position': list(self.position) if self.position else [1, 0],
+            'documents': self.documents,
+            'interaction_count': self.interaction_count,
+            'document_bytes': self.document_bytes,
+            'last_updated': self.last_updated,
+            'hourly': self.hourly
+        }
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Failed to write knowledge stats checkpoint: {e}")
+            return
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def aggregates(self, hours: int = 24) -> Dict[str, Any]:
+        """Per-hour buckets of the last ``hours`` hours with data, and their totals"""
+        keys = sorted(self.hourly)[-hours:] if hours > 0 else []
+        totals = _empty_hour()
+        buckets = []
+        for hour in keys:
+            bucket = self.hourly[hour]
+            for name, value in bucket.items():
+                if name == 'text_length':
+                    totals[name] = [a + b for a, b in zip(totals[name], value)]
+                else:
+                    totals[name] += value
+            buckets.append(dict(bucket, hour=hour))
+        return {
+            'hours': buckets,
+            'requests': totals['requests'],
+            'tts_requests': totals['tts_requests'],
+            'text_length': dict(zip(LENGTH_LABELS, totals['text_length'])),
+            'cache_hit_ratio': round(totals['cached_segments'] / totals['segments'], 4)
+            if totals['segments'] else None
+        }
+
+
+def dir_bytes(directory) -> int:
+    """Total size of the files directly in a directory"""
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def format_cursor(position: LogPosition) -> str:
+    return f"{position.segment}.{position.offset}"
+
+
+def parse_cursor(cursor: str) -> LogPosition:
+    """The log position a cursor stands for; raises ValueError if it's malformed"""
+    segment, offset = cursor.split('.')
+    position = LogPosition(int(segment), int(offset))
+    if position.segment < 1 or position.offset < 0:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return position
@@ -0,0 +1,352 @@
+"""
+Semantic (vector) search for the knowledge base.
+
+Knowledge entries and document passages are embedded in batches by a
+background thread and stored as rows of a float32 matrix on disk, which
+every worker memory-maps. Nearest neighbours come from a random-hyperplane
+LSH index over the matrix (multi-probe, several tables), re-ranked by
+exact cosine similarity; small collections are simply scanned.
+
+Only one worker embeds at a time: whichever holds ``embed.lock`` tails the
+knowledge log, appends rows and then publishes the new row count in
+``meta.json``. If it exits, the lock is released and another worker takes
+over on its next query.
+
+Embeddings come from a sentence-transformers model when one is configured
+and installed, otherwise from a hashing vectorizer (word, bigram and
+character-trigram features), which needs nothing beyond NumPy.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Semantic search is disabled without NumPy
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker embeds into its own process
+    fcntl = None
+
+from knowledge_index import KIND_DOCUMENT, KIND_KNOWLEDGE, knowledge_text, tokenize
+from knowledge_log import AppendLog, LogPosition
+
+
+# kind, log segment, log offset of each row
+POSITION_DTYPE = [('kind', '<u1'), ('segment', '<u4'), ('offset', '<u8')]
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words, word bigrams and character trigrams"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str):
+        words = [term for term, _ in tokenize(text)]
+        for word in words:
+            yield word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                yield '#' + padded[i:i + 3], 0.5
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 0.5
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if (h >> 31) & 1 else -1.0
+                vectors[row, h % self.dim] += sign * weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+class SentenceTransformerEmbedder:
+    """A sentence-transformers model run on the CPU"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        return self.model.encode(
+            texts, batch_size=32, normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def load_embedder(model: str = 'hashing', dim: int = 256):
+    """Embedder for a model name; 'hashing' or any failure uses the hashing vectorizer"""
+    if model and model != 'hashing':
+        try:
+            return SentenceTransformerEmbedder(model)
+        except Exception as e:
+            logging.warning(f"Could not load embedding model {model}, using hashing vectorizer: {e}")
+    return HashingEmbedder(dim)
+
+
+class VectorIndex:
+    """Memory-mapped embedding matrix with an LSH nearest-neighbour index"""
+
+    def __init__(
+        self,
+        directory,
+        log: AppendLog,
+        load_text: Callable[[Dict], Optional[str]],
+        embedder=None,
+        batch_size: int = 64,
+        poll_interval: float = 1.0,
+        tables: int = 8,
+        bits: int = 12,
+        exact_max: int = 20000
+    ):
+        """exact_max: collections up to this many rows are scanned exactly"""
+        if np is None:
+            raise RuntimeError("Semantic search requires numpy")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.log = log
+        self.load_text = load_text
+        self.embedder = embedder or HashingEmbedder()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.exact_max = exact_max
+
+        self.matrix_path = self.directory / "matrix.f32"
+        self.positions_path = self.directory / "positions.bin"
+        self.meta_path = self.directory / "meta.json"
+
+        dim = self.embedder.dim
+        self.planes = np.random.default_rng(0).standard_normal((tables, bits, dim)).astype(np.float32)
+        self._bit_values = (1 << np.arange(bits, dtype=np.int64))
+
+        self._lock = threading.Lock()
+        self._meta_version = None
+        self._count = 0
+        self._matrix = None
+        self._positions = None
+        # LSH tables over rows [0, self._hashed): sorted codes and row order
+        self._codes = None
+        self._order = None
+        self._hashed = 0
+
+        self._lead_lock = None
+        self._thread = None
+        self._last_attempt = 0.0
+        self.embedded = 0
+
+    # Reading
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get('embedder') != self.embedder.name or meta.get('dim') != self.embedder.dim:
+            # Written by a different embedder; the leader rebuilds it
+            return None
+        return meta
+
+    def _refresh(self) -> None:
+        """Map rows published since the last call"""
+        try:
+            stat = os.stat(self.meta_path)
+            version = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            version = None
+        if version == self._meta_version:
+            return
+        meta = self._read_meta()
+        self._meta_version = version
+        count = meta['count'] if meta else 0
+        if count < self._count or count == 0:
+            # Rebuilt from scratch
+            self._codes = self._order = None
+            self._hashed = 0
+        self._count = count
+        if not count:
+            self._matrix = self._positions = None
+            return
+        dim = self.embedder.dim
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(count, dim))
+        self._positions = np.memmap(self.positions_path, dtype=POSITION_DTYPE, mode='r', shape=(count,))
+
+        # Hash new rows into the LSH tables once enough have accumulated
+        if count > self.exact_max and count - self._hashed >= max(1000, self._hashed // 4):
+            self._hash_rows()
+
+    def _codes_for(self, vectors: "np.ndarray") -> "np.ndarray":
+        """LSH codes of vectors, one column per table"""
+        bits = np.einsum('tbd,nd->ntb', self.planes, vectors) > 0
+        return bits.astype(np.int64) @ self._bit_values
+
+    def _hash_rows(self) -> None:
+        codes = []
+        for start in range(0, self._count, 65536):
+            codes.append(self._codes_for(np.asarray(self._matrix[start:start + 65536])))
+        codes = np.concatenate(codes)
+        self._order = np.argsort(codes, axis=0, kind='stable')
+        self._codes = np.take_along_axis(codes, self._order, axis=0)
+        self._hashed = self._count
+
+    def _candidates(self, vector: "np.ndarray") -> "np.ndarray":
+        """Rows sharing a bucket (or a bucket one bit away) with vector"""
+        code = self._codes_for(vector[None, :])[0]
+        probes = code[None, :] ^ np.concatenate(([0], self._bit_values))[:, None]
+        found = []
+        for table in range(self.planes.shape[0]):
+            column = self._codes[:, table]
+            lo = np.searchsorted(column, probes[:, table], side='left')
+            hi = np.searchsorted(column, probes[:, table], side='right')
+            for start, end in zip(lo, hi):
+                if end > start:
+                    found.append(self._order[start:end, table])
+        # Rows published since the tables were built are always scanned
+        found.append(np.arange(self._hashed, self._count))
+        return np.unique(np.concatenate(found)) if found else np.arange(0)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, int, LogPosition]]:
+        """Return (cosine similarity, kind, log position) of the nearest rows"""
+        self.ensure_running()
+        with self._lock:
+            self._refresh()
+            if not self._count:
+                return []
+            vector = self.embedder.embed([query])[0]
+            if self._codes is None:
+                rows = np.arange(self._count)
+                scores = np.asarray(self._matrix) @ vector
+            else:
+                rows = self._candidates(vector)
+                if len(rows) < limit:
+                    # Too few neighbours in the probed buckets: scan everything
+                    rows = np.arange(self._count)
+                scores = np.asarray(self._matrix[rows]) @ vector
+            if len(rows) > limit:
+                top = np.argpartition(-scores, limit)[:limit]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-scores[top])]
+            hits = []
+            for i in top:
+                row = self._positions[rows[i]]
+                hits.append((
+                    float(scores[i]), int(row['kind']),
+                    LogPosition(int(row['segment']), int(row['offset']))
+                ))
+            return hits
+
+    # Embedding (leader only)
+
+    def ensure_running(self) -> None:
+        """Become the embedding worker if nobody else is"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        now = time.monotonic()
+        if now - self._last_attempt < self.poll_interval:
+            return
+        self._last_attempt = now
+        lock_file = open(self.directory / "embed.lock", 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return
+        # Held for the life of the process; released by the OS if it dies
+        self._lead_lock = lock_file
+        self._thread = threading.Thread(target=self._run, name="kb-embedder", daemon=True)
+        self._thread.start()
+
+    def _write_meta(self, count: int, position: LogPosition) -> None:
+        tmp_path = self.directory / f".meta.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "embedder": self.embedder.name,
+                "dim": self.embedder.dim,
+                "count": count,
+                "segment": position.segment,
+                "offset": position.offset
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _run(self) -> None:
+        meta = self._read_meta()
+        count = meta['count'] if meta else 0
+        position = LogPosition(meta['segment'], meta['offset']) if meta else None
+        row_bytes = self.embedder.dim * 4
+        # Drop rows written after the last published count (crash mid-batch)
+        position_bytes = np.dtype(POSITION_DTYPE).itemsize
+        for path, size in ((self.matrix_path, count * row_bytes), (self.positions_path, count * position_bytes)):
+            with open(path, 'ab') as f:
+                f.truncate(size)
+        if meta is None:
+            self._write_meta(0, LogPosition(1, 0))
+
+        while True:
+            try:
+                count, position = self._embed_new(count, position)
+            except Exception as e:
+                logging.error(f"Error embedding knowledge records: {e}")
+            time.sleep(self.poll_interval)
+
+    def _embed_new(self, count: int, position: Optional[LogPosition]):
+        """Embed records appended since position; returns the new state"""
+        texts, rows = [], []
+
+        def flush(end):
+            nonlocal count, texts, rows
+            if texts:
+                vectors = self.embedder.embed(texts)
+                with open(self.matrix_path, 'ab') as f:
+                    f.write(vectors.astype(np.float32).tobytes())
+                with open(self.positions_path, 'ab') as f:
+                    f.write(np.array(rows, dtype=POSITION_DTYPE).tobytes())
+                count += len(texts)
+                self.embedded += len(texts)
+            self._write_meta(count, end)
+            texts, rows = [], []
+
+        end = position
+        for start, end, record in self.log.scan(position):
+            kind = record.get('kind')
+            text = None
+            if kind == 'knowledge':
+                text, _ = knowledge_text(record.get('data', {}))
+                code = KIND_KNOWLEDGE
+            elif kind in ('document', 'passage'):
+                text = self.load_text(record)
+                code = KIND_DOCUMENT
+            if text:
+                texts.append(text)
+                rows.append((code, start.segment, start.offset))
+            if len(texts) >= self.batch_size:
+                flush(end)
+        if end != position:
+            flush(end)
+        return count, end
+
+    def stats(self) -> Dict:
+        """Counters for monitoring"""
+        with self._lock:
+            self._refresh()
+            return {
+                'embedder': self.embedder.name,
+                'vectors': self._count,
+                'lsh_rows': self._hashed,
+                'embedding_worker': self._thread is not None and self._thread.is_alive()
+            }
@@ -0,0 +1,322 @@
+"""
+Prometheus metrics for the speech agent.
+
+Exported on METRICS_PORT (scraped per prometheus.yml) when ENABLE_METRICS
+is set and prometheus-client is installed; otherwise every metric is a
+no-op. Under gunicorn each worker writes its samples to
+PROMETHEUS_MULTIPROC_DIR and the master serves the sum over workers (see
+gunicorn_config.py); a standalone process serves its own.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # Metrics are disabled without prometheus-client
+    prometheus_client = None
+
+
+ENABLE_METRICS = (
+    os.getenv('ENABLE_METRICS', 'true').lower() == 'true'
+    and prometheus_client is not None
+)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4)
+
+# Seconds between exports of the caches' own counters
+CACHE_SYNC_INTERVAL = 1.0
+
+
+class _NoOp:
+    """Stands in for every metric when metrics are disabled"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+
+def _metric(kind: str, name: str, documentation: str, labels=(), **kwargs):
+    if not ENABLE_METRICS:
+        return _NoOp()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+TTS_REQUEST_SECONDS = _metric(
+    'Histogram', 'tts_request_duration_seconds',
+    "End-to-end /tts latency, until the last byte is sent",
+    ('mode', 'status'), buckets=LATENCY_BUCKETS
+)
+TTS_FIRST_BYTE_SECONDS = _metric(
+    'Histogram', 'tts_time_to_first_byte_seconds',
+    "Time from receiving a /tts request to its first audio byte",
+    ('mode',), buckets=LATENCY_BUCKETS
+)
+TTS_IN_FLIGHT = _metric(
+    'Gauge', 'tts_requests_in_flight', "/tts requests being served",
+    multiprocess_mode='livesum'
+)
+TTS_AUDIO_BYTES = _metric(
+    'Counter', 'tts_audio_bytes', "Audio bytes sent to clients", ('format',)
+)
+
+RUNPOD_REQUEST_SECONDS = _metric(
+    'Histogram', 'runpod_request_duration_seconds',
+    "Round trip of a RunPod job, from submission to its last output",
+    ('operation', 'outcome'), buckets=LATENCY_BUCKETS
+)
+RUNPOD_QUEUE_SECONDS = _metric(
+    'Histogram', 'runpod_queue_wait_seconds',
+    "Time RunPod jobs waited for a worker (delayTime; includes cold starts)",
+    buckets=LATENCY_BUCKETS
+)
+RUNPOD_EXECUTION_SECONDS = _metric(
+    'Histogram', 'runpod_execution_seconds',
+    "Time RunPod workers spent executing jobs (executionTime)",
+    buckets=LATENCY_BUCKETS
+)
+
+WORKER_QUEUE_SECONDS = _metric(
+    'Histogram', 'tts_worker_queue_wait_seconds',
+    "Time texts waited for a synthesis batch on the worker",
+    buckets=FAST_BUCKETS
+)
+WORKER_FIRST_CHUNK_SECONDS = _metric(
+    'Histogram', 'tts_worker_first_chunk_seconds',
+    "Time from submission to the model's first audio chunk on the worker",
+    buckets=LATENCY_BUCKETS
+)
+WORKER_SYNTHESIS_SECONDS = _metric(
+    'Histogram', 'tts_worker_synthesis_seconds',
+    "Model synthesis time per text", buckets=LATENCY_BUCKETS
+)
+WORKER_REAL_TIME_FACTOR = _metric(
+    'Histogram', 'tts_worker_real_time_factor',
+    "Synthesis time divided by audio duration", buckets=RTF_BUCKETS
+)
+WORKER_COLD_STARTS = _metric(
+    'Counter', 'tts_worker_cold_starts', "Jobs that were a worker's first"
+)
+WORKER_MODEL_INIT_SECONDS = _metric(
+    'Histogram', 'tts_worker_model_init_seconds',
+    "Model load time of cold-started workers", buckets=LATENCY_BUCKETS
+)
+WORKER_STARTUP_PHASE_SECONDS = _metric(
+    'Histogram', 'tts_worker_startup_phase_seconds',
+    "Time cold-started workers spent in each startup phase (device, import, load, warmup)",
+    ('phase',), buckets=LATENCY_BUCKETS
+)
+
+CACHE_EVENTS = _metric(
+    'Counter', 'tts_cache_events', "Audio cache lookups and removals by tier",
+    ('tier', 'event')
+)
+
+ADMISSION_QUEUE_DEPTH = _metric(
+    'Gauge', 'tts_admission_queue_depth', "Requests waiting for a synthesis slot",
+    ('priority',), multiprocess_mode='livesum'
+)
+ADMISSION_ACTIVE = _metric(
+    'Gauge', 'tts_admission_active', "Synthesis slots in use",
+    ('priority',), multiprocess_mode='livesum'
+)
+ADMISSION_WAIT_SECONDS = _metric(
+    'Histogram', 'tts_admission_wait_seconds',
+    "Time admitted requests waited for a synthesis slot",
+    ('priority',), buckets=LATENCY_BUCKETS
+)
+ADMISSION_REJECTIONS = _metric(
+    'Counter', 'tts_admission_rejections', "Requests shed by admission control",
+    ('priority', 'reason')
+)
+
+KB_OPERATION_SECONDS = _metric(
+    'Histogram', 'knowledge_operation_duration_seconds',
+    "Knowledge base operation latency", ('operation',), buckets=FAST_BUCKETS
+)
+
+
+class TTSRequestMetrics:
+    """Latency, first byte and bytes sent for one /tts request"""
+
+    def __init__(self, on_finish: Optional[Callable[[int], None]] = None):
+        """on_finish is called with the status once the request is done"""
+        self.start = time.perf_counter()
+        self.mode = 'buffered'
+        self.format = 'wav'
+        self.on_finish = on_finish
+        self._finished = False
+        TTS_IN_FLIGHT.inc()
+
+    @property
+    def streaming(self) -> bool:
+        return self.mode == 'stream'
+
+    def first_byte(self) -> None:
+        TTS_FIRST_BYTE_SECONDS.labels(self.mode).observe(time.perf_counter() - self.start)
+
+    def finish(self, status: int, audio_bytes: int = 0) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        TTS_IN_FLIGHT.dec()
+        TTS_REQUEST_SECONDS.labels(self.mode, str(status)).observe(time.perf_counter() - self.start)
+        if audio_bytes:
+            TTS_AUDIO_BYTES.labels(self.format).inc(audio_bytes)
+        if self.on_finish is not None:
+            self.on_finish(status)
+
+    def stream(self, chunks):
+        """Pass a response body through, timing its first and last byte"""
+        # Set now: the body isn't iterated until after the view returns
+        self.mode = 'stream'
+        return self._stream(chunks)
+
+    def _stream(self, chunks):
+        size = 0
+        try:
+            for chunk in chunks:
+                if chunk and not size:
+                    self.first_byte()
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.finish(200, size)
+
+    def astream(self, chunks):
+        """Async counterpart of stream()"""
+        self.mode = 'stream'
+        return self._astream(chunks)
+
+    async def _astream(self, chunks):
+        size = 0
+        try:
+            async for chunk in chunks:
+                if chunk and not size:
+                    self.first_byte()
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.finish(200, size)
+
+
+@contextmanager
+def runpod_call(operation: str):
+    """Time a RunPod job round trip, labelled by how it ended"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    except GeneratorExit:
+        # The client went away mid-stream
+        outcome = 'cancelled'
+        raise
+    finally:
+        RUNPOD_REQUEST_SECONDS.labels(operation, outcome).observe(time.perf_counter() - start)
+
+
+def observe_runpod_result(result: Dict[str, Any]) -> None:
+    """Record RunPod's own timing of a finished job (milliseconds)"""
+    if result.get('delayTime') is not None:
+        RUNPOD_QUEUE_SECONDS.observe(result['delayTime'] / 1000)
+    if result.get('executionTime') is not None:
+        RUNPOD_EXECUTION_SECONDS.observe(result['executionTime'] / 1000)
+
+
+def observe_worker_meta(meta: Optional[Dict[str, Any]]) -> None:
+    """Record the timing a worker reported in a job's meta"""
+    if not meta:
+        return
+    for key, metric in (
+        ('queue_wait_seconds', WORKER_QUEUE_SECONDS),
+        ('first_chunk_seconds', WORKER_FIRST_CHUNK_SECONDS),
+        ('synthesis_seconds', WORKER_SYNTHESIS_SECONDS),
+        ('real_time_factor', WORKER_REAL_TIME_FACTOR)
+    ):
+        if meta.get(key) is not None:
+            metric.observe(meta[key])
+    if meta.get('cold_start'):
+        WORKER_COLD_STARTS.inc()
+        if meta.get('model_init_seconds') is not None:
+            WORKER_MODEL_INIT_SECONDS.observe(meta['model_init_seconds'])
+        for phase, seconds in (meta.get('startup_phases') or {}).items():
+            WORKER_STARTUP_PHASE_SECONDS.labels(phase).observe(seconds)
+
+
+_cache_lock = threading.Lock()
+_cache_seen: Dict[tuple, int] = {}
+_cache_synced = 0.0
+
+CACHE_COUNTERS = (
+    ('hits', 'hit'), ('misses', 'miss'), ('evictions', 'eviction'),
+    ('expirations', 'expiration')
+)
+
+
+def sync_cache_stats(stats_fn) -> None:
+    """
+    Export growth in the audio cache's per-tier counters since the last
+    call. The tiers keep their own counters; reading them at most every
+    CACHE_SYNC_INTERVAL keeps the cache hot path free of metrics calls.
+    """
+    global _cache_synced
+    if not ENABLE_METRICS:
+        return
+    now = time.monotonic()
+    with _cache_lock:
+        if now - _cache_synced < CACHE_SYNC_INTERVAL:
+            return
+        _cache_synced = now
+        for tier, counters in stats_fn().get('tiers', {}).items():
+            for field, event in CACHE_COUNTERS:
+                value = counters.get(field)
+                if value is None:
+                    continue
+                seen = _cache_seen.get((tier, event), 0)
+                if value > seen:
+                    CACHE_EVENTS.labels(tier, event).inc(value - seen)
+                _cache_seen[(tier, event)] = value
+
+
+def start_server() -> None:
+    """Serve this process's metrics, unless a gunicorn master serves them"""
+    if not ENABLE_METRICS or os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    try:
+        prometheus_client.start_http_server(METRICS_PORT)
+        logging.info(f"Serving metrics on port {METRICS_PORT}")
+    except OSError as e:
+        logging.warning(f"Could not serve metrics on port {METRICS_PORT}: {e}")
+
+
+def serve_multiprocess() -> None:
+    """Serve the metrics of every worker; called by the gunicorn master before forking"""
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    prometheus_client.start_http_server(METRICS_PORT, registry=registry)
+
+
+def mark_worker_dead(pid: int) -> None:
+    """Drop a dead worker's live gauges"""
+    if ENABLE_METRICS and os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
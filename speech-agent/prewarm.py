@@ -0,0 +1,353 @@
+"""
+Cache pre-warming and refresh-ahead.
+
+Keeps the audio of common phrases (greetings, menu prompts, error
+messages) cached ahead of demand, so they are served at cache-hit speed
+even right after a deploy, a /cache/clear or expiry. Phrases come from a
+file and from the most frequent TTS requests in the knowledge log. A
+background run synthesizes the segments missing from the cache in RunPod
+batch jobs, at most ``rate`` texts per second, and pins every phrase's
+segments so they are never evicted or expired. Scheduled runs happen only
+inside the off-peak window; one runs at startup and POST /cache/prewarm
+starts one at any time. Only one worker (whichever holds ``prewarm.lock``)
+runs the schedule; the last run's report is kept in ``prewarm.json`` for
+every worker to show.
+
+Refresh-ahead: a cache hit on an entry that expires within
+``refresh_ahead`` seconds queues its text to be synthesized again in the
+background, so hot entries don't expire on the request path.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker runs the schedule
+    fcntl = None
+
+from knowledge_log import AppendLog, LogPosition
+
+
+def parse_window(window: str) -> Optional[Tuple[int, int]]:
+    """'HH:MM-HH:MM' as (start, end) minutes after midnight; None (always) if empty"""
+    if not window or not window.strip():
+        return None
+    try:
+        start, end = (part.strip() for part in window.split('-'))
+        minutes = []
+        for value in (start, end):
+            hours, mins = value.split(':')
+            minutes.append(int(hours) * 60 + int(mins))
+    except ValueError:
+        raise ValueError(f"Invalid prewarm window {window!r}; expected HH:MM-HH:MM")
+    return minutes[0], minutes[1]
+
+
+def in_window(window: Optional[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    """Whether now (local time) falls in the window, which may wrap past midnight"""
+    if window is None:
+        return True
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def load_phrases(path: Optional[str]) -> List[str]:
+    """One phrase per line; blank lines and lines starting with # are skipped"""
+    if not path:
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    except FileNotFoundError:
+        logging.warning(f"Prewarm phrase file not found: {path}")
+        return []
+
+
+class QueryMiner:
+    """
+    Counts TTS request texts in the knowledge log, reading only what was
+    appended since the last update. Once more than max_tracked distinct
+    texts are counted, those seen once are dropped.
+    """
+
+    def __init__(self, log: AppendLog, max_tracked: int = 100000):
+        self.log = log
+        self.max_tracked = max_tracked
+        self.counts: Counter = Counter()
+        self._position: Optional[LogPosition] = None
+
+    def update(self) -> None:
+        for _, end, record in self.log.scan(self._position):
+            self._position = end
+            data = record.get('data', {})
+            if record.get('kind') == 'knowledge' and data.get('type') == 'tts_request':
+                text = (data.get('query') or '').strip()
+                if text:
+                    self.counts[text] += 1
+            if len(self.counts) > self.max_tracked:
+                self.counts = Counter({text: n for text, n in self.counts.items() if n > 1})
+
+    def top(self, limit: int, min_count: int = 2) -> List[str]:
+        self.update()
+        return [text for text, n in self.counts.most_common(limit) if n >= min_count]
+
+
+class RateLimiter:
+    """Spaces calls out to at most rate units per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, units: int = 1) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + units / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class Prewarmer:
+    """Scheduled pre-warming of common phrases, plus refresh-ahead"""
+
+    def __init__(
+        self,
+        cache,
+        segments: Callable[[str], List[Tuple[str, str]]],
+        synthesize_batch: Callable[[List[str]], List[Optional[bytes]]],
+        lock_dir,
+        phrases_file: Optional[str] = None,
+        miner: Optional[QueryMiner] = None,
+        top_queries: int = 100,
+        min_count: int = 3,
+        rate: float = 1.0,
+        batch_size: int = 8,
+        window: str = '',
+        interval: float = 3600,
+        run_on_start: bool = True,
+        refresh_ahead: float = 0
+    ):
+        """
+        segments maps a phrase to its (segment text, cache key) pairs;
+        synthesize_batch returns the audio (None on failure) of each text
+        """
+        self.cache = cache
+        self.segments = segments
+        self.synthesize_batch = synthesize_batch
+        self.lock_path = Path(lock_dir) / "prewarm.lock"
+        self.report_path = Path(lock_dir) / "prewarm.json"
+        self.phrases_file = phrases_file
+        self.miner = miner
+        self.top_queries = top_queries
+        self.min_count = min_count
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.window = parse_window(window)
+        self.interval = interval
+        self.run_on_start = run_on_start
+        self.refresh_ahead = refresh_ahead
+
+        self._run_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._lead_lock = None
+        self._last_attempt = 0.0
+
+        self._refresh_queue: "queue.Queue[Tuple[str, Callable[[], bytes]]]" = queue.Queue()
+        self._refreshing = set()
+        self._refresh_thread = None
+        self.refreshed = 0
+        self.refresh_errors = 0
+
+    # Scheduled runs
+
+    def phrases(self) -> List[str]:
+        """Phrases to keep warm: the phrase file, then the most frequent requests"""
+        phrases = load_phrases(self.phrases_file)
+        if self.miner is not None and self.top_queries > 0:
+            phrases += self.miner.top(self.top_queries, self.min_count)
+        return list(dict.fromkeys(phrases))
+
+    def run(self, phrases: Optional[Iterable[str]] = None) -> Dict:
+        """Warm and pin phrases (default: phrases()); unpins what is no longer listed"""
+        with self._run_lock:
+            started = time.time()
+            report = {'started': datetime.now().isoformat(), 'phrases': 0, 'segments': 0,
+                      'already_cached': 0, 'synthesized': 0, 'failed': 0, 'unpinned': 0}
+            self._save_report(dict(report, running=True))
+            explicit = phrases is not None
+            phrases = list(phrases) if explicit else self.phrases()
+            report['phrases'] = len(phrases)
+
+            wanted = {}
+            for phrase in phrases:
+                for text, key in self.segments(phrase):
+                    wanted.setdefault(key, text)
+            report['segments'] = len(wanted)
+
+            missing = []
+            for key, text in wanted.items():
+                if self.cache.is_pinned(key):
+                    report['already_cached'] += 1
+                    continue
+                data = self.cache.get(key)
+                if data is not None:
+                    self.cache.pin(key, data)
+                    report['already_cached'] += 1
+                else:
+                    missing.append((key, text))
+
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                self.limiter.acquire(len(batch))
+                try:
+                    results = self.synthesize_batch([text for _, text in batch])
+                except Exception as e:
+                    logging.error(f"Prewarm batch of {len(batch)} failed: {e}")
+                    report['failed'] += len(batch)
+                    continue
+                for (key, _), data in zip(batch, results):
+                    if data is None:
+                        report['failed'] += 1
+                        continue
+                    self.cache.set(key, data)
+                    self.cache.pin(key, data)
+                    report['synthesized'] += 1
+
+            if not explicit:
+                for key in self.cache.pinned_keys():
+                    if key not in wanted:
+                        self.cache.unpin(key)
+                        report['unpinned'] += 1
+
+            report['seconds'] = round(time.time() - started, 3)
+            self._save_report(dict(report, running=False))
+            logging.info(
+                f"Prewarmed {report['segments']} segments of {report['phrases']} phrases: "
+                f"{report['synthesized']} synthesized, {report['failed']} failed"
+            )
+            return report
+
+    def _save_report(self, report: Dict) -> None:
+        tmp_path = self.report_path.with_name(f".prewarm.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f)
+        os.replace(tmp_path, self.report_path)
+
+    def last_run(self) -> Optional[Dict]:
+        try:
+            with open(self.report_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def ensure_running(self, retry_interval: float = 60) -> None:
+        """Run the schedule on this worker if no other worker does"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            now = time.monotonic()
+            if now - self._last_attempt < retry_interval:
+                return
+            self._last_attempt = now
+            lock_file = open(self.lock_path, 'a')
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return
+            # Held for the life of the process; released by the OS if it dies
+            self._lead_lock = lock_file
+            self._thread = threading.Thread(target=self._schedule, name="cache-prewarm", daemon=True)
+            self._thread.start()
+
+    def _schedule(self) -> None:
+        if self.run_on_start:
+            self._run_logged()
+        while True:
+            time.sleep(self.interval)
+            if in_window(self.window):
+                self._run_logged()
+
+    def _run_logged(self) -> None:
+        try:
+            self.run()
+        except Exception as e:
+            logging.error(f"Error prewarming cache: {e}")
+
+    def trigger(self, phrases: Optional[List[str]] = None) -> bool:
+        """
+        Start a run in the background now; False if one is already running.
+        Given phrases stay pinned until the next scheduled run.
+        """
+        if self._run_lock.locked():
+            return False
+        threading.Thread(
+            target=lambda: self.run(phrases), name="cache-prewarm-now", daemon=True
+        ).start()
+        return True
+
+    # Refresh-ahead
+
+    def maybe_refresh(self, key: str, expires_in: Optional[float], synthesize: Callable[[], bytes]) -> None:
+        """Queue synthesize() if the entry for key is about to expire"""
+        if not self.refresh_ahead or expires_in is None or expires_in > self.refresh_ahead:
+            return
+        with self._start_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            # Started lazily so workers forked after import get their own thread
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_loop, name="cache-refresh", daemon=True
+                )
+                self._refresh_thread.start()
+        self._refresh_queue.put((key, synthesize))
+
+    def _refresh_loop(self) -> None:
+        while True:
+            key, synthesize = self._refresh_queue.get()
+            try:
+                self.limiter.acquire()
+                synthesize()
+                self.refreshed += 1
+            except Exception as e:
+                self.refresh_errors += 1
+                logging.error(f"Error refreshing cache entry {key}: {e}")
+            finally:
+                with self._start_lock:
+                    self._refreshing.discard(key)
+
+    def stats(self) -> Dict:
+        """State for monitoring"""
+        window = None
+        if self.window is not None:
+            start, end = self.window
+            window = f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+        return {
+            'scheduler': self._thread is not None and self._thread.is_alive(),
+            'window': window,
+            'pinned': len(self.cache.pinned_keys()),
+            'last_run': self.last_run(),
+            'refresh_pending': self._refresh_queue.qsize(),
+            'refreshed': self.refreshed,
+            'refresh_errors': self.refresh_errors
+        }
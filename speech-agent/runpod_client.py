@@ -0,0 +1,527 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import httpx
+except ImportError:  # Only needed by the ASGI serving mode
+    httpx = None
+
+
+# Statuses after which a job will make no further progress
+FAILED_STATUSES = ("FAILED", "CANCELLED", "TIMED_OUT")
+# Responses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class RunPodError(Exception):
+    """A RunPod request or job failed"""
+
+
+class CircuitOpenError(RunPodError):
+    """RunPod is failing and calls are being short-circuited"""
+
+
+class CircuitBreaker:
+    """
+    Stop calling RunPod after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast for ``reset_timeout`` seconds. Then a single trial call
+    is let through: success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may proceed"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.warning("RunPod circuit breaker opened")
+                self._opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        """A call ended without an outcome; an open circuit lets the next trial through"""
+        with self._lock:
+            if self._opened_at is not None:
+                self._trial_in_flight = False
+
+
+def _never_sent(error: requests.ConnectionError) -> bool:
+    """Whether a connection error happened before the request was sent"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', cause), NewConnectionError)
+
+
+class _RunPodBase:
+    """Configuration and response handling shared by the sync and async clients"""
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        mode: str = "runsync",
+        connect_timeout: float = 3.05,
+        read_timeout: float = 30,
+        job_timeout: float = 100,
+        max_retries: int = 3,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4,
+        poll_interval: float = 0.1,
+        poll_max_interval: float = 1,
+        pool_size: int = 32,
+        breaker: Optional[CircuitBreaker] = None,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        """
+        endpoint may be the endpoint URL or its /run or /runsync URL.
+        on_result is called with the final status response of each job
+        (which carries RunPod's delayTime and executionTime).
+        """
+        if mode not in ("run", "runsync"):
+            raise ValueError(f"Unknown RunPod mode: {mode}")
+        self.base_url = self._base_url(endpoint)
+        self.mode = mode
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.job_timeout = job_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.poll_max_interval = poll_max_interval
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self.on_result = on_result
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    @staticmethod
+    def _base_url(endpoint: str) -> str:
+        """Endpoint URL without the trailing /run or /runsync operation"""
+        base = (endpoint or '').rstrip('/')
+        for suffix in ('/runsync', '/run'):
+            if base.endswith(suffix):
+                return base[:-len(suffix)]
+        return base
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _response_json(self, status_code: int, text: str, parse: Callable[[], Any]) -> Dict[str, Any]:
+        """The body of a final response, recording the outcome with the breaker"""
+        # Client errors mean RunPod is up; only server errors trip the breaker
+        if status_code >= 500:
+            self.breaker.record_failure()
+        elif status_code != 200:
+            self.breaker.record_success()
+        if status_code != 200:
+            logging.error(f"RunPod API error: {text}")
+            raise RunPodError(f"RunPod API error: {status_code}")
+        try:
+            result = parse()
+        except ValueError as e:
+            self.breaker.record_failure()
+            raise RunPodError(f"RunPod returned an invalid response: {e}")
+        self.breaker.record_success()
+        return result
+
+    @staticmethod
+    def _output(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract a completed job's output, raising on worker errors"""
+        output = result.get("output", {})
+        # Generator handlers return their aggregated stream as a list
+        if isinstance(output, list):
+            output = output[-1] if output else {}
+        if "error" in output:
+            logging.error(f"RunPod processing error: {output['error']}")
+            raise RunPodError(output["error"])
+        return output
+
+    def _check_status(self, job_id: str, result: Dict[str, Any]) -> bool:
+        """True once the job completed; raises if it failed"""
+        status = result.get("status")
+        if self.on_result is not None and self._is_finished(result):
+            try:
+                self.on_result(result)
+            except Exception as e:
+                logging.warning(f"RunPod result hook failed: {e}")
+        if status in FAILED_STATUSES:
+            error = result.get("error") or f"RunPod job {job_id} ended with status {status}"
+            raise RunPodError(error)
+        return status == "COMPLETED"
+
+    @staticmethod
+    def _is_finished(result: Dict[str, Any]) -> bool:
+        return result.get("status") in ("COMPLETED",) + FAILED_STATUSES
+
+    @staticmethod
+    def _stream_outputs(result: Dict[str, Any]):
+        """Output items of a /stream response, raising on worker errors"""
+        outputs = []
+        for item in result.get("stream", []):
+            output = item.get("output", {})
+            if "error" in output:
+                logging.error(f"RunPod processing error: {output['error']}")
+                raise RunPodError(output["error"])
+            outputs.append(output)
+        return outputs
+
+
+class RunPodClient(_RunPodBase):
+    """
+    Client for a RunPod serverless endpoint.
+
+    Uses one pooled keep-alive session, bounded connect/read timeouts,
+    jittered exponential retries for transient failures and a circuit
+    breaker. Supports synchronous jobs (``/runsync``), asynchronous jobs
+    (``/run`` then polling ``/status`` with backoff) and streaming jobs
+    (``/run`` then polling ``/stream``).
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        session: Optional[requests.Session] = None,
+        **kwargs
+    ):
+        """Accepts the same options as the async client plus a session"""
+        super().__init__(endpoint, api_key, **kwargs)
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict[str, Any]] = None,
+        read_timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Make one API call with retries. POSTs that start jobs are only
+        retried when the request provably did not reach RunPod (failed
+        connects, 429, 503), so a retry cannot start a duplicate job.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("RunPod circuit breaker is open")
+
+        idempotent = method == "GET"
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        url = f"{self.base_url}/{path}"
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, json=payload, timeout=timeout)
+                retryable = response.status_code in RETRYABLE_STATUS_CODES and (
+                    idempotent or response.status_code in (429, 503)
+                )
+                if not retryable:
+                    break
+                error = RunPodError(f"RunPod API error: {response.status_code}")
+            except requests.ConnectionError as e:
+                error = RunPodError(f"RunPod connection failed: {e}")
+                # A dropped connection may have delivered the request
+                if not idempotent and not _never_sent(e):
+                    self.breaker.record_failure()
+                    raise error
+            except requests.Timeout as e:
+                error = RunPodError(f"RunPod request timed out: {e}")
+                if not idempotent:
+                    self.breaker.record_failure()
+                    raise error
+            except Exception as e:
+                # Broken responses, invalid URLs...: not worth retrying
+                self.breaker.record_failure()
+                raise RunPodError(f"RunPod request failed: {e}")
+            except BaseException:
+                self.breaker.record_cancelled()
+                raise
+            if attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+            delay = self._backoff(attempt)
+            logging.warning(f"{error}; retrying {method} {path} in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+        return self._response_json(response.status_code, response.text, response.json)
+
+    def run(self, job_input: Dict[str, Any]) -> str:
+        """Queue an asynchronous job and return its id"""
+        return self._request("POST", "run", {"input": job_input})["id"]
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """Current status (and output, once finished) of a job"""
+        return self._request("GET", f"status/{job_id}")
+
+    def cancel(self, job_id: str) -> None:
+        """Cancel a queued or running job, ignoring failures"""
+        try:
+            self._request("POST", f"cancel/{job_id}")
+        except RunPodError as e:
+            logging.warning(f"Could not cancel RunPod job {job_id}: {e}")
+
+    def wait(self, job_id: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Poll a job with backoff until it completes and return its output"""
+        deadline = deadline or time.monotonic() + self.job_timeout
+        interval = self.poll_interval
+        while True:
+            result = self.status(job_id)
+            if self._check_status(job_id, result):
+                return self._output(result)
+            if time.monotonic() + interval > deadline:
+                self.cancel(job_id)
+                raise RunPodError(f"RunPod job {job_id} timed out")
+            time.sleep(interval)
+            interval = min(interval * 2, self.poll_max_interval)
+
+    def runsync(self, job_input: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run a job synchronously. If RunPod returns before the job finishes
+        (it holds /runsync open for a limited time), fall back to polling.
+        """
+        deadline = time.monotonic() + self.job_timeout
+        result = self._request(
+            "POST", "runsync", {"input": job_input}, read_timeout=self.job_timeout
+        )
+        if self._check_status(result.get("id"), result):
+            return self._output(result)
+        return self.wait(result["id"], deadline)
+
+    def synthesize(self, job_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a job to completion using the configured mode"""
+        if self.mode == "runsync":
+            return self.runsync(job_input)
+        return self.wait(self.run(job_input))
+
+    def stream(self, job_input: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Start a job and yield each streamed output item as it arrives"""
+        job_id = self.run(job_input)
+        deadline = time.monotonic() + self.job_timeout
+        interval = self.poll_interval
+        finished = False
+        try:
+            while True:
+                result = self._request("GET", f"stream/{job_id}")
+                items = self._stream_outputs(result)
+                for output in items:
+                    yield output
+                finished = self._is_finished(result)
+                if self._check_status(job_id, result):
+                    return
+                if time.monotonic() > deadline:
+                    raise RunPodError(f"RunPod job {job_id} timed out")
+                # Poll quickly while chunks are flowing, back off while idle
+                interval = self.poll_interval if items else min(interval * 2, self.poll_max_interval)
+                time.sleep(interval)
+        finally:
+            if not finished:
+                # The consumer went away or the job failed; free the worker
+                self.cancel(job_id)
+
+    def close(self) -> None:
+        """Close pooled connections"""
+        self.session.close()
+
+
+class AsyncRunPodClient(_RunPodBase):
+    """
+    asyncio counterpart of RunPodClient for the ASGI serving mode.
+
+    Same retry, breaker, polling and streaming behaviour, on a pooled
+    httpx.AsyncClient, so waiting on RunPod does not hold a thread.
+    """
+
+    def __init__(self, endpoint: str, api_key: str, **kwargs):
+        """Accepts the same options as RunPodClient (except session)"""
+        if httpx is None:
+            raise RuntimeError("The async RunPod client requires the httpx package")
+        super().__init__(endpoint, api_key, **kwargs)
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size
+            )
+        )
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict[str, Any]] = None,
+        read_timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Make one API call with the same retry rules as RunPodClient._request"""
+        if not self.breaker.allow():
+            raise CircuitOpenError("RunPod circuit breaker is open")
+
+        idempotent = method == "GET"
+        timeout = httpx.Timeout(
+            read_timeout or self.read_timeout, connect=self.connect_timeout
+        )
+        url = f"{self.base_url}/{path}"
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, json=payload, timeout=timeout)
+                retryable = response.status_code in RETRYABLE_STATUS_CODES and (
+                    idempotent or response.status_code in (429, 503)
+                )
+                if not retryable:
+                    break
+                error = RunPodError(f"RunPod API error: {response.status_code}")
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # The request was never sent
+                error = RunPodError(f"RunPod connection failed: {e}")
+            except httpx.TransportError as e:
+                error = RunPodError(f"RunPod request failed: {e}")
+                if not idempotent:
+                    self.breaker.record_failure()
+                    raise error
+            except Exception as e:
+                # Undecodable responses, invalid URLs...: not worth retrying
+                self.breaker.record_failure()
+                raise RunPodError(f"RunPod request failed: {e}")
+            except BaseException:
+                # Cancelled (the client went away)
+                self.breaker.record_cancelled()
+                raise
+            if attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+            delay = self._backoff(attempt)
+            logging.warning(f"{error}; retrying {method} {path} in {delay:.2f}s")
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.breaker.record_cancelled()
+                raise
+            attempt += 1
+
+        return self._response_json(response.status_code, response.text, response.json)
+
+    async def run(self, job_input: Dict[str, Any]) -> str:
+        """Queue an asynchronous job and return its id"""
+        return (await self._request("POST", "run", {"input": job_input}))["id"]
+
+    async def status(self, job_id: str) -> Dict[str, Any]:
+        """Current status (and output, once finished) of a job"""
+        return await self._request("GET", f"status/{job_id}")
+
+    async def cancel(self, job_id: str) -> None:
+        """Cancel a queued or running job, ignoring failures"""
+        try:
+            await self._request("POST", f"cancel/{job_id}")
+        except RunPodError as e:
+            logging.warning(f"Could not cancel RunPod job {job_id}: {e}")
+
+    async def wait(self, job_id: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Poll a job with backoff until it completes and return its output"""
+        deadline = deadline or time.monotonic() + self.job_timeout
+        interval = self.poll_interval
+        while True:
+            result = await self.status(job_id)
+            if self._check_status(job_id, result):
+                return self._output(result)
+            if time.monotonic() + interval > deadline:
+                await self.cancel(job_id)
+                raise RunPodError(f"RunPod job {job_id} timed out")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.poll_max_interval)
+
+    async def runsync(self, job_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a job synchronously, falling back to polling"""
+        deadline = time.monotonic() + self.job_timeout
+        result = await self._request(
+            "POST", "runsync", {"input": job_input}, read_timeout=self.job_timeout
+        )
+        if self._check_status(result.get("id"), result):
+            return self._output(result)
+        return await self.wait(result["id"], deadline)
+
+    async def synthesize(self, job_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a job to completion using the configured mode"""
+        if self.mode == "runsync":
+            return await self.runsync(job_input)
+        return await self.wait(await self.run(job_input))
+
+    async def stream(self, job_input: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Start a job and yield each streamed output item as it arrives"""
+        job_id = await self.run(job_input)
+        deadline = time.monotonic() + self.job_timeout
+        interval = self.poll_interval
+        finished = False
+        try:
+            while True:
+                result = await self._request("GET", f"stream/{job_id}")
+                items = self._stream_outputs(result)
+                for output in items:
+                    yield output
+                finished = self._is_finished(result)
+                if self._check_status(job_id, result):
+                    return
+                if time.monotonic() > deadline:
+                    raise RunPodError(f"RunPod job {job_id} timed out")
+                # Poll quickly while chunks are flowing, back off while idle
+                interval = self.poll_interval if items else min(interval * 2, self.poll_max_interval)
+                await asyncio.sleep(interval)
+        finally:
+            if not finished:
+                # The consumer went away or the job failed; free the worker
+                await self.cancel(job_id)
+
+    async def close(self) -> None:
+        """Close pooled connections"""
+        await self.client.aclose()
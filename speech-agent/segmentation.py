@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import logging
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+
+from text_normalization import normalize_text
+
+
+# Sentence ends, then clause boundaries for sentences that are still too long
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["\')\]])\s+')
+CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:—])\s+')
+
+# A period after these does not end the sentence
+ABBREVIATIONS = {
+    'mr.', 'mrs.', 'ms.', 'dr.', 'prof.', 'st.', 'jr.', 'sr.', 'vs.',
+    'etc.', 'e.g.', 'i.e.', 'no.', 'approx.'
+}
+
+
+# Typographic variants that should not produce distinct cache entries
+PUNCTUATION_MAP = str.maketrans({
+    '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
+    '\u2013': '-', '\u2014': '-', '\u2026': '...'
+})
+REPEATED_PUNCTUATION = re.compile(r'([!?.,;:-])\1+')
+# Punctuation that carries no prosody once a segment stands on its own
+TRAILING_PUNCTUATION = re.compile(r'[\s.,;:"\'-]+$')
+LEADING_PUNCTUATION = re.compile(r'^[\s.,;:"\'-]+')
+
+
+def _pack(parts: List[str], max_chars: int) -> List[str]:
+    """Greedily join consecutive parts while they fit within max_chars"""
+    packed = []
+    current = ''
+    for part in parts:
+        candidate = f"{current} {part}" if current else part
+        if len(candidate) <= max_chars:
+            current = candidate
+        else:
+            if current:
+                packed.append(current)
+            current = part
+    if current:
+        packed.append(current)
+    return packed
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Split a sentence that exceeds max_chars at clause, then word, boundaries"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+
+    pieces = []
+    for clause in CLAUSE_BOUNDARY.split(sentence):
+        if len(clause) <= max_chars:
+            pieces.append(clause)
+            continue
+        # No usable punctuation left: fall back to word boundaries
+        words = clause.split()
+        for word in words:
+            while len(word) > max_chars:
+                pieces.append(word[:max_chars])
+                word = word[max_chars:]
+            pieces.append(word)
+    return _pack(pieces, max_chars)
+
+
+def split_text(text: str, max_chars: int = 300) -> List[str]:
+    """
+    Split text into synthesis segments at sentence boundaries.
+
+    Every sentence becomes its own segment so segments are independent
+    units of work; sentences longer than max_chars are broken at clause
+    boundaries and, failing that, at word boundaries.
+    """
+    sentences = []
+    pending = ''
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        sentence = f"{pending} {sentence}".strip() if pending else sentence.strip()
+        if sentence.rsplit(' ', 1)[-1].lower() in ABBREVIATIONS:
+            pending = sentence
+            continue
+        pending = ''
+        if sentence:
+            sentences.append(sentence)
+    if pending:
+        sentences.append(pending)
+
+    segments = []
+    for sentence in sentences:
+        segments.extend(_split_long(sentence, max_chars))
+    return segments
+
+
+# Keys are computed several times per request for the same segments
+@lru_cache(maxsize=4096)
+def normalize_segment(segment: str) -> str:
+    """
+    Canonical form of a segment for cache keys.
+
+    Spells out numbers, dates and abbreviations the way the worker's
+    front-end does before synthesis ("Dr." and "Doctor" sound the same),
+    then folds case, whitespace and typographic punctuation variants, and
+    drops quotation marks and trailing periods and commas. Question and
+    exclamation marks are kept because they change intonation.
+    """
+    text = unicodedata.normalize('NFKC', segment).translate(PUNCTUATION_MAP)
+    text = normalize_text(text)
+    text = text.replace('"', '')
+    text = ' '.join(text.lower().split())
+    text = REPEATED_PUNCTUATION.sub(r'\1', text)
+    text = LEADING_PUNCTUATION.sub('', text)
+    return TRAILING_PUNCTUATION.sub('', text)
+
+
+def segment_cache_key(segment: str, voice: str, model: str) -> str:
+    """Cache key for a segment rendered with a given voice and model"""
+    key = f"{model}\x1f{voice}\x1f{normalize_segment(segment)}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def synthesize_segments(
+    segments: List[str],
+    synthesize: Callable[[str], bytes],
+    max_workers: int = 4,
+    cached: Optional[List[Optional[bytes]]] = None
+) -> Iterator[bytes]:
+    """
+    Synthesize segments concurrently and yield their audio in order.
+
+    Segments whose audio is already known (``cached[i]`` is not None) are
+    not synthesized again. At most max_workers segments are in flight at
+    once. Each result is yielded as soon as it and every segment before it
+    are ready, so the first segment can be played while the rest are still
+    being generated.
+    """
+    if not segments:
+        return
+    if cached is None:
+        cached = [None] * len(segments)
+
+    missing = sum(1 for audio in cached if audio is None)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, missing)))
+    futures = [
+        executor.submit(synthesize, segment) if audio is None else None
+        for segment, audio in zip(segments, cached)
+    ]
+    try:
+        for future, audio in zip(futures, cached):
+            yield audio if future is None else future.result()
+    except Exception as e:
+        logging.error(f"Segment synthesis failed: {e}")
+        raise
+    finally:
+        # Don't spend GPU time on segments nobody will hear
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False)
+
+
+async def synthesize_segments_async(
+    segments: List[str],
+    synthesize: Callable[[str], Awaitable[bytes]],
+    max_workers: int = 4,
+    cached: Optional[List[Optional[bytes]]] = None
+) -> AsyncIterator[bytes]:
+    """asyncio counterpart of synthesize_segments"""
+    if not segments:
+        return
+    if cached is None:
+        cached = [None] * len(segments)
+
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def bounded(segment):
+        async with semaphore:
+            return await synthesize(segment)
+
+    tasks = [
+        asyncio.ensure_future(bounded(segment)) if audio is None else None
+        for segment, audio in zip(segments, cached)
+    ]
+    try:
+        for task, audio in zip(tasks, cached):
+            yield audio if task is None else await task
+    except Exception as e:
+        logging.error(f"Segment synthesis failed: {e}")
+        raise
+    finally:
+        # Don't spend GPU time on segments nobody will hear
+        for task in tasks:
+            if task is not None and not task.done():
+                task.cancel()
@@ -0,0 +1,474 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable,
+    Iterator, List, Optional
+)
+
+
+# Deletes the lease only if this caller still holds it
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    """An in-flight call whose result is shared with every waiter"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class _StreamCall:
+    """An in-flight stream whose chunks are replayed to every subscriber"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.cond = threading.Condition()
+
+    def append(self, chunk: bytes) -> None:
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    def wait(self) -> None:
+        """Block until the stream has ended"""
+        with self.cond:
+            while not self.finished:
+                self.cond.wait()
+
+    def subscribe(self) -> Iterator[bytes]:
+        """Yield every chunk from the start, then live chunks until done"""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.finished:
+                    self.cond.wait()
+                pending = self.chunks[index:]
+                finished = self.finished
+                error = self.error
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent requests for the same key into one execution.
+
+    The first caller for a key becomes the leader and does the work;
+    concurrent callers in the same process wait for (or subscribe to) its
+    result. A leader first checks ``lookup`` (normally a cache read), so a
+    flight starting just after another one finished reuses its result.
+    do() and stream() calls for the same key don't share a flight: one
+    waits for the other to end, then leads its own, served by lookup.
+    With a Redis client, the leader also takes a lease in Redis so
+    callers in other workers or hosts wait for the result to show up via
+    ``lookup`` instead of repeating the work. If
+    the lease holder disappears, the lease expires and a waiter takes over.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        lease_ttl: float = 120,
+        poll_interval: float = 0.05,
+        wait_timeout: float = 90,
+        prefix: str = "tts:lease:"
+    ):
+        """Initialize; without redis_client coalescing is per process"""
+        self.redis = redis_client
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self.prefix = prefix
+        self._release = redis_client.register_script(RELEASE_SCRIPT) if redis_client else None
+
+        self._calls: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.remote_waits = 0
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _acquire_lease(self, key: str) -> Optional[str]:
+        """Take the cross-worker lease for key; returns a token or None"""
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.redis.set(
+                self.prefix + key, token, nx=True, px=int(self.lease_ttl * 1000)
+            )
+        except Exception as e:
+            # Without Redis, fall back to per-process coalescing
+            logging.error(f"Could not acquire lease for {key}: {e}")
+            return token
+        return token if acquired else None
+
+    def _release_lease(self, key: str, token: str) -> None:
+        try:
+            self._release(keys=[self.prefix + key], args=[token])
+        except Exception as e:
+            logging.error(f"Could not release lease for {key}: {e}")
+
+    def _lease_held(self, key: str) -> bool:
+        try:
+            return bool(self.redis.exists(self.prefix + key))
+        except Exception:
+            return False
+
+    def _wait_remote(self, key: str, lookup: Callable[[], Any]) -> Any:
+        """
+        Wait for another worker holding the lease to publish its result.
+        Returns None if the lease went away without a result or the wait
+        timed out, in which case the caller should do the work itself.
+        """
+        self._count('remote_waits')
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            result = lookup()
+            if result is not None:
+                return result
+            if not self._lease_held(key):
+                # Holder finished or died; one last look before taking over
+                return lookup()
+            time.sleep(self.poll_interval)
+        logging.warning(f"Timed out waiting for remote leader of {key}")
+        return None
+
+    def _lead(self, key: str, fn: Callable[[], Any], lookup: Optional[Callable[[], Any]]):
+        """Run fn as the process-local leader, coordinating with other workers"""
+        if lookup is None:
+            return fn()
+        if self.redis is None:
+            # A flight for this key may have published its result just
+            # before this one started
+            result = lookup()
+            return result if result is not None else fn()
+
+        while True:
+            token = self._acquire_lease(key)
+            if token is not None:
+                try:
+                    # Another worker may have finished just before we got the lease
+                    result = lookup()
+                    return result if result is not None else fn()
+                finally:
+                    self._release_lease(key, token)
+            result = self._wait_remote(key, lookup)
+            if result is not None:
+                return result
+            if self._lease_held(key):
+                # Timed out behind a slow leader: don't wait forever
+                return fn()
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        lookup: Optional[Callable[[], Any]] = None
+    ) -> Any:
+        """
+        Return fn(), running it at most once across concurrent callers of
+        the same key. lookup should return the published result (or None)
+        and is what waiters in other workers poll.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if not isinstance(call, _StreamCall):
+                break
+            call.wait()
+
+        if not leader:
+            self._count('followers')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self._count('leaders')
+        try:
+            call.result = self._lead(key, fn, lookup)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(
+        self,
+        key: str,
+        produce: Callable[[], Iterable[bytes]],
+        lookup: Optional[Callable[[], Optional[bytes]]] = None
+    ) -> Iterator[bytes]:
+        """
+        Return an iterator over the chunks of produce(), running it at most
+        once across concurrent callers of the same key.
+
+        The producer runs in a background thread so it completes (and can
+        populate the cache) even if the client that started it disconnects.
+        Callers in the same process replay the chunks produced so far and
+        then follow live; callers in other workers wait for the lease
+        holder and receive the finished audio from lookup in one piece.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _StreamCall()
+
+        if isinstance(call, _Call):
+            return self._stream_after(call, key, produce, lookup)
+        if not leader:
+            self._count('followers')
+            return call.subscribe()
+
+        self._count('leaders')
+        threading.Thread(
+            target=self._produce, args=(key, call, produce, lookup),
+            name=f"single-flight-{key[:8]}", daemon=True
+        ).start()
+        return call.subscribe()
+
+    def _stream_after(self, call: _Call, key, produce, lookup) -> Iterator[bytes]:
+        """Stream key once a do() call for it has ended"""
+        call.done.wait()
+        yield from self.stream(key, produce, lookup)
+
+    def _produce(self, key, call: _StreamCall, produce, lookup) -> None:
+        def run():
+            for chunk in produce():
+                call.append(chunk)
+            return True
+
+        error = None
+        try:
+            result = self._lead(key, run, lookup)
+            if result is not True:
+                # Already published; replay the finished audio
+                call.append(result)
+        except BaseException as e:
+            logging.error(f"Single-flight stream for {key} failed: {e}")
+            error = e
+        # Callers arriving from now on lead a flight of their own
+        with self._lock:
+            self._calls.pop(key, None)
+        call.finish(error)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'remote_waits': self.remote_waits,
+                'in_flight': len(self._calls)
+            }
+
+
+class _AsyncStreamCall:
+    """asyncio counterpart of _StreamCall"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.finished = True
+        self.error = error
+        self._notify()
+
+    async def wait(self) -> None:
+        """Wait until the stream has ended"""
+        while not self.finished:
+            await self._changed.wait()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        """Yield every chunk from the start, then live chunks until done"""
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for the ASGI serving mode.
+
+    The shared work runs in its own task, so a caller that goes away does
+    not cancel it for the others. Redis lease operations reuse
+    SingleFlight's and run in a thread.
+    """
+
+    def __init__(self, redis_client=None, **kwargs):
+        """Accepts the same options as SingleFlight"""
+        self._sync = SingleFlight(redis_client, **kwargs)
+        self._calls: Dict[str, Any] = {}
+
+    async def _wait_remote(self, key: str, lookup: Callable[[], Awaitable[Any]]) -> Any:
+        """See SingleFlight._wait_remote"""
+        sync = self._sync
+        sync._count('remote_waits')
+        deadline = time.monotonic() + sync.wait_timeout
+        while time.monotonic() < deadline:
+            result = await lookup()
+            if result is not None:
+                return result
+            if not await asyncio.to_thread(sync._lease_held, key):
+                return await lookup()
+            await asyncio.sleep(sync.poll_interval)
+        logging.warning(f"Timed out waiting for remote leader of {key}")
+        return None
+
+    async def _lead(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        lookup: Optional[Callable[[], Awaitable[Any]]]
+    ) -> Any:
+        """Run fn as the process-local leader, coordinating with other workers"""
+        sync = self._sync
+        if lookup is None:
+            return await fn()
+        if sync.redis is None:
+            result = await lookup()
+            return result if result is not None else await fn()
+
+        while True:
+            token = await asyncio.to_thread(sync._acquire_lease, key)
+            if token is not None:
+                try:
+                    result = await lookup()
+                    return result if result is not None else await fn()
+                finally:
+                    await asyncio.to_thread(sync._release_lease, key, token)
+            result = await self._wait_remote(key, lookup)
+            if result is not None:
+                return result
+            if await asyncio.to_thread(sync._lease_held, key):
+                return await fn()
+
+    def _start(self, key: str, coro) -> "asyncio.Task":
+        task = asyncio.ensure_future(coro)
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return task
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        lookup: Optional[Callable[[], Awaitable[Any]]] = None
+    ) -> Any:
+        """Await fn(), running it at most once across concurrent callers of the same key"""
+        task = self._calls.get(key)
+        while isinstance(task, _AsyncStreamCall):
+            await task.wait()
+            task = self._calls.get(key)
+        if task is None:
+            self._sync._count('leaders')
+            task = self._start(key, self._lead(key, fn, lookup))
+        else:
+            self._sync._count('followers')
+        return await asyncio.shield(task)
+
+    def stream(
+        self,
+        key: str,
+        produce: Callable[[], AsyncIterable[bytes]],
+        lookup: Optional[Callable[[], Awaitable[Optional[bytes]]]] = None
+    ) -> AsyncIterator[bytes]:
+        """Async iterator over the chunks of produce(), run at most once per key"""
+        call = self._calls.get(key)
+        if isinstance(call, _AsyncStreamCall):
+            self._sync._count('followers')
+            return call.subscribe()
+        if call is not None:
+            return self._stream_after(call, key, produce, lookup)
+
+        self._sync._count('leaders')
+        call = _AsyncStreamCall()
+        self._calls[key] = call
+        asyncio.ensure_future(self._produce(key, call, produce, lookup))
+        return call.subscribe()
+
+    async def _stream_after(self, task: "asyncio.Task", key, produce, lookup) -> AsyncIterator[bytes]:
+        """Stream key once a do() call for it has ended"""
+        try:
+            await asyncio.shield(task)
+        except Exception:
+            # Its caller gets the error; this stream makes its own attempt
+            pass
+        async for chunk in self.stream(key, produce, lookup):
+            yield chunk
+
+    async def _produce(self, key, call: _AsyncStreamCall, produce, lookup) -> None:
+        async def run():
+            async for chunk in produce():
+                call.append(chunk)
+            return True
+
+        error = None
+        try:
+            result = await self._lead(key, run, lookup)
+            if result is not True:
+                # Already published; replay the finished audio
+                call.append(result)
+        except Exception as e:
+            logging.error(f"Single-flight stream for {key} failed: {e}")
+            error = e
+        finally:
+            # Callers arriving from now on lead a flight of their own
+            self._calls.pop(key, None)
+        call.finish(error)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring"""
+        stats = self._sync.stats()
+        stats['in_flight'] = len(self._calls)
+        return stats
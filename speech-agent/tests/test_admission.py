@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import Response
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def queued(controller, priority='interactive'):
+    return controller.stats()['priorities'][priority]['queued']
+
+
+def active(controller, priority='interactive'):
+    return controller.stats()['priorities'][priority]['active']
+
+
+def in_background(fn):
+    thread = threading.Thread(target=fn, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_free_slots_are_granted_without_waiting():
+    controller = AdmissionController(slots=2)
+
+    with controller.acquire() as first, controller.acquire('batch') as second:
+        assert first.waited == second.waited == 0.0
+        assert active(controller) == active(controller, 'batch') == 1
+    assert active(controller) == active(controller, 'batch') == 0
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    controller = AdmissionController(slots=1, queue_limits={'interactive': 1}, hold_estimate=1.5)
+    ticket = controller.acquire()
+    waiter = in_background(controller.acquire)
+    wait_until(lambda: queued(controller) == 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire()
+    assert rejected.value.reason == 'queue_full'
+    # Behind one queued request on one slot: two holds of 1.5s
+    assert rejected.value.retry_after == 3
+    assert controller.stats()['priorities']['interactive']['rejected'] == {'queue_full': 1}
+
+    ticket.release()
+    waiter.join(5)
+
+
+def test_key_limit_counts_admitted_and_queued_requests():
+    controller = AdmissionController(slots=1, key_limit=2, hold_estimate=1.5)
+    ticket = controller.acquire(key='a')
+    waiter = in_background(lambda: controller.acquire(key='a').release())
+    wait_until(lambda: queued(controller) == 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(key='a', timeout=0.01)
+    assert rejected.value.reason == 'key_limit'
+    assert rejected.value.retry_after == 2
+    # Other keys only see the usual queue
+    with pytest.raises(AdmissionRejected, match='deadline'):
+        controller.acquire(key='b', timeout=0.01)
+
+    ticket.release()
+    waiter.join(5)
+    assert controller.stats()['keys_active'] == 0
+    controller.acquire(key='a').release()
+
+
+def test_unmeetable_deadline_is_rejected_up_front():
+    controller = AdmissionController(slots=1, hold_estimate=2.0)
+    ticket = controller.acquire()
+
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(timeout=3)
+    assert time.monotonic() - start < 0.5
+    assert rejected.value.reason == 'deadline'
+    assert rejected.value.retry_after == 2
+    assert queued(controller) == 0
+    ticket.release()
+
+
+def test_deadline_passing_in_the_queue_is_a_timeout():
+    controller = AdmissionController(slots=1, hold_estimate=0.01)
+    ticket = controller.acquire()
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(timeout=0.1)
+    assert rejected.value.reason == 'timeout'
+    assert queued(controller) == 0
+    ticket.release()
+
+
+def test_interactive_requests_are_dispatched_before_batch():
+    controller = AdmissionController(slots=1)
+    ticket = controller.acquire()
+    order = []
+
+    def take(priority):
+        with controller.acquire(priority):
+            order.append(priority)
+
+    batch = in_background(lambda: take('batch'))
+    wait_until(lambda: queued(controller, 'batch') == 1)
+    interactive = in_background(lambda: take('interactive'))
+    wait_until(lambda: queued(controller) == 1)
+
+    ticket.release()
+    batch.join(5)
+    interactive.join(5)
+    assert order == ['interactive', 'batch']
+
+
+def test_batch_work_is_capped_at_batch_slots():
+    controller = AdmissionController(slots=3, batch_slots=1, hold_estimate=0.01)
+    batch = controller.acquire('batch')
+
+    with pytest.raises(AdmissionRejected, match='deadline passed'):
+        controller.acquire('batch', timeout=0.1)
+    # The slots batch work can't use stay free for interactive requests
+    tickets = [controller.acquire(timeout=0.1) for _ in range(2)]
+    assert active(controller) == 2 and active(controller, 'batch') == 1
+
+    waiter = in_background(lambda: controller.acquire('batch').release())
+    wait_until(lambda: queued(controller, 'batch') == 1)
+    for ticket in tickets:
+        ticket.release()
+    time.sleep(0.05)
+    # Free slots alone don't admit it; the batch slot has to free up
+    assert queued(controller, 'batch') == 1
+    batch.release()
+    waiter.join(5)
+    assert controller.stats()['priorities']['batch']['admitted'] == 2
+
+
+def test_flask_streamed_body_frees_the_slot_once_closed():
+    controller = AdmissionController(slots=1)
+    ticket = controller.acquire()
+    waiter = in_background(lambda: controller.acquire().release())
+    wait_until(lambda: queued(controller) == 1)
+
+    # As /tts does for streamed responses
+    response = Response(iter([b'one', b'two']))
+    response.call_on_close(ticket.release)
+    assert b''.join(response.response) == b'onetwo'
+    assert queued(controller) == 1
+
+    response.close()
+    waiter.join(5)
+    assert controller.stats()['priorities']['interactive']['admitted'] == 2
+
+
+def test_async_streamed_body_frees_the_slot_when_it_ends():
+    controller = AdmissionController(slots=1)
+
+    async def body():
+        for chunk in (b'one', b'two', b'three'):
+            yield chunk
+
+    async def main():
+        ticket = await controller.acquire_async()
+        chunks = [chunk async for chunk in ticket.astream(body())]
+        assert active(controller) == 0
+
+        # A client that goes away mid-stream frees it too
+        ticket = await controller.acquire_async()
+        stream = ticket.astream(body())
+        assert await stream.__anext__() == b'one'
+        assert active(controller) == 1
+        await stream.aclose()
+        assert active(controller) == 0
+        return chunks
+
+    assert asyncio.run(main()) == [b'one', b'two', b'three']
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    controller = AdmissionController(slots=1)
+
+    async def main():
+        ticket = await controller.acquire_async()
+        waiter = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0.01)
+        assert queued(controller) == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert queued(controller) == 0
+        ticket.release()
+
+    asyncio.run(main())
+    assert active(controller) == 0
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+import audio_cache
+from audio_cache import build_audio_cache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def cache(client, tmp_path):
+    cache = build_audio_cache(
+        'memory,redis', ttl=3600, memory_max_bytes=10, memory_ttl=60,
+        redis_client=client, pinned_dir=str(tmp_path / 'pinned')
+    )
+    yield cache
+    cache.close()
+
+
+def test_writes_go_to_every_tier(cache, client):
+    cache.set('k', b'audio')
+
+    assert cache.tier('memory').get('k') == b'audio'
+    assert client.get('tts:audio:k') == b'audio'
+    assert client.ttl('tts:audio:k') == 3600
+    # Only pin() writes the pinned tier
+    assert cache.tier('pinned').get('k') is None
+
+
+def test_redis_hit_is_promoted_to_memory(cache):
+    cache.tier('redis').set('k', b'audio')
+
+    data, expires_in = cache.get_with_expiry('k')
+    assert data == b'audio'
+    assert 3590 < expires_in <= 3600
+    assert cache.tier('memory').get('k') == b'audio'
+
+    # Served from memory now, which doesn't know the expiry
+    assert cache.get_with_expiry('k') == (b'audio', None)
+    assert cache.tier('redis').stats()['hits'] == 1
+
+
+def test_memory_expiry_falls_back_to_redis(cache, monkeypatch):
+    cache.set('k', b'audio')
+    now = time.time()
+    monkeypatch.setattr(audio_cache.time, 'time', lambda: now + 61)
+
+    assert cache.get('k') == b'audio'
+    assert cache.tier('memory').stats()['expirations'] == 1
+    assert cache.tier('redis').stats()['hits'] == 1
+
+
+def test_redis_expiry_is_a_miss(cache, client):
+    cache.tier('redis').set('k', b'audio')
+    client.pexpire('tts:audio:k', 20)
+    time.sleep(0.05)
+
+    assert cache.get('k') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_memory_evicts_least_recently_used(cache):
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    cache.get('a')
+    cache.set('c', b'cccc')
+
+    memory = cache.tier('memory')
+    assert memory.stats()['evictions'] == 1
+    assert memory.get('b') is None
+    assert memory.get('a') == b'aaaa'
+    # Evicted from memory, still shared through redis
+    assert cache.get('b') == b'bbbb'
+
+
+def test_pinned_entry_outlives_the_shared_tiers(cache, client):
+    cache.pin('k', b'audio')
+    client.flushall()
+    cache.tier('memory').clear()
+
+    assert cache.get('k') == b'audio'
+    assert cache.is_pinned('k')
+    assert cache.pinned_keys() == ['k']
+
+
+def test_redis_errors_degrade_to_misses(cache, client, monkeypatch):
+    def down(*args, **kwargs):
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(client, 'get', down)
+    monkeypatch.setattr(client, 'set', down)
+    cache.set('k', b'audio')
+    cache.tier('memory').clear()
+
+    assert cache.get('k') is None
+    assert cache.tier('redis').stats()['errors'] == 2
+
+
+def test_clear_with_redis_down_still_clears_the_other_tiers(client, tmp_path, monkeypatch):
+    cache = build_audio_cache(
+        'memory,redis,disk', ttl=3600, cache_dir=str(tmp_path / 'disk'),
+        sweep_interval=0, redis_client=client
+    )
+    cache.set('k', b'audio')
+
+    def down(*args, **kwargs):
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(client, 'scan_iter', down)
+    assert cache.clear() == 1
+
+    assert cache.tier('memory').get('k') is None
+    assert cache.tier('disk').get('k') is None
+    assert cache.tier('redis').stats()['errors'] == 1
@@ -0,0 +1,176 @@
+import json
+import os
+import time
+
+import pytest
+
+import audio_cache
+from audio_cache import DiskCache
+
+
+def disk_cache(path, max_bytes=12, ttl=3600):
+    # No sweeper thread; tests call sweep() themselves
+    return DiskCache(str(path), max_bytes, ttl, sweep_interval=0)
+
+
+def write(path, data, age=0.0, at=None):
+    """A cache file written by another worker age seconds ago (or at a time)"""
+    path.write_bytes(data)
+    if age or at:
+        when = at or time.time() - age
+        os.utime(path, (when, when))
+
+
+def keys(cache):
+    """Entry keys from least to most recently used"""
+    return list(cache._entries)
+
+
+def test_least_recently_used_entries_are_evicted_over_budget(tmp_path):
+    cache = disk_cache(tmp_path)
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    cache.set('c', b'cccc')
+    assert cache.get('a') == b'aaaa'
+
+    cache.set('d', b'dddd')
+
+    assert cache.get('b') is None
+    assert not (tmp_path / 'b').exists()
+    assert keys(cache) == ['c', 'a', 'd']
+    assert cache.stats()['bytes'] == 12
+    assert cache.stats()['evictions'] == 1
+
+
+def test_replacing_an_entry_updates_its_size(tmp_path):
+    cache = disk_cache(tmp_path)
+    cache.set('a', b'aaaa')
+    cache.set('a', b'aaaaaaaa')
+
+    assert cache.stats()['bytes'] == 8
+    assert cache.get('a') == b'aaaaaaaa'
+
+
+def test_index_is_rebuilt_from_index_json_and_a_scan(tmp_path):
+    cache = disk_cache(tmp_path, max_bytes=100)
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    cache.set('gone', b'xxxx')
+    cache.get('a')
+    cache.close()
+    index = json.loads((tmp_path / 'index.json').read_text())
+    assert [key for key, _, _ in index['entries']] == ['b', 'gone', 'a']
+
+    # Meanwhile another worker wrote c and rewrote a, and gone was removed
+    write(tmp_path / 'c', b'cccc', age=60)
+    write(tmp_path / 'a', b'aaaaaa')
+    (tmp_path / 'gone').unlink()
+
+    cache = disk_cache(tmp_path, max_bytes=100)
+    # Unindexed files count as least recent; sizes come from the files
+    assert keys(cache) == ['c', 'b', 'a']
+    assert cache.stats()['bytes'] == 14
+
+
+def test_rebuild_evicts_down_to_the_budget(tmp_path):
+    cache = disk_cache(tmp_path, max_bytes=100)
+    for key in 'abc':
+        cache.set(key, key.encode() * 4)
+    cache.close()
+
+    cache = disk_cache(tmp_path, max_bytes=8)
+    assert keys(cache) == ['b', 'c']
+    assert not (tmp_path / 'a').exists()
+
+
+def test_unreadable_index_falls_back_to_a_scan(tmp_path):
+    write(tmp_path / 'old', b'oooo', age=60)
+    write(tmp_path / 'new', b'nnnn', age=10)
+    (tmp_path / 'index.json').write_text('{not json')
+
+    cache = disk_cache(tmp_path)
+    assert keys(cache) == ['old', 'new']
+    assert cache.get('old') == b'oooo'
+
+
+def test_legacy_meta_and_wav_files_are_migrated(tmp_path):
+    created = time.time() - 100
+    write(tmp_path / 'k.wav', b'audio')
+    (tmp_path / 'k.meta').write_text(str(created))
+
+    cache = disk_cache(tmp_path, ttl=3600)
+
+    assert os.listdir(tmp_path) == ['k']
+    assert cache.get('k') == b'audio'
+    assert 3490 < cache.expires_in('k') < 3510
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    cache = disk_cache(tmp_path, ttl=60)
+    cache.set('k', b'audio')
+    now = time.time()
+    monkeypatch.setattr(audio_cache.time, 'time', lambda: now + 61)
+
+    assert cache.get('k') is None
+    assert not (tmp_path / 'k').exists()
+    assert cache.stats()['expirations'] == 1
+
+
+def test_sweep_expires_adopts_and_forgets(tmp_path, monkeypatch):
+    cache = disk_cache(tmp_path, max_bytes=100, ttl=60)
+    cache.set('old', b'oooo')
+    cache.set('removed', b'rrrr')
+    now = time.time()
+    monkeypatch.setattr(audio_cache.time, 'time', lambda: now + 30)
+    cache.set('new', b'nnnn')
+    # Another worker wrote one entry and removed another
+    write(tmp_path / 'other', b'xx', at=now + 30)
+    (tmp_path / 'removed').unlink()
+    monkeypatch.setattr(audio_cache.time, 'time', lambda: now + 61)
+
+    assert cache.sweep() == 1
+
+    # Adopted files count as least recent
+    assert keys(cache) == ['other', 'new']
+    assert cache.stats()['bytes'] == 6
+    assert not (tmp_path / 'old').exists()
+    index = json.loads((tmp_path / 'index.json').read_text())
+    assert [key for key, _, _ in index['entries']] == ['other', 'new']
+
+
+def test_sweep_evicts_files_adopted_over_budget(tmp_path):
+    cache = disk_cache(tmp_path, max_bytes=8)
+    cache.set('mine', b'mmmm')
+    write(tmp_path / 'a', b'aaaa', age=20)
+    write(tmp_path / 'b', b'bbbb', age=10)
+
+    cache.sweep()
+
+    # Adopted files count as least recent, so they go first
+    assert keys(cache) == ['b', 'mine']
+    assert cache.stats()['bytes'] == 8
+
+
+def test_reads_of_other_workers_files_stay_within_budget(tmp_path):
+    reader = disk_cache(tmp_path, max_bytes=8)
+    writer = disk_cache(tmp_path, max_bytes=100)
+    for key in 'xyz':
+        writer.set(key, key.encode() * 4)
+
+    assert reader.get('x') == b'xxxx'
+    assert reader.get('y') == b'yyyy'
+    assert reader.get('z') == b'zzzz'
+
+    assert keys(reader) == ['y', 'z']
+    assert reader.stats()['bytes'] == 8
+    assert reader.stats()['evictions'] == 1
+
+
+@pytest.mark.parametrize('size', [9, 100])
+def test_file_larger_than_the_budget_is_a_miss(tmp_path, size):
+    reader = disk_cache(tmp_path, max_bytes=8)
+    write(tmp_path / 'big', b'b' * size)
+
+    assert reader.get('big') is None
+    assert reader.stats()['bytes'] == 0
+    assert reader.stats()['misses'] == 1
@@ -0,0 +1,190 @@
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+from runpod_client import CircuitBreaker, CircuitOpenError, RunPodClient, RunPodError, _never_sent
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'benchmarks'))
+import mock_runpod  # noqa: E402
+
+JOB = {"text": "Hello there."}
+
+
+@pytest.fixture
+def server():
+    server = mock_runpod.serve(port=0, latency=0.01, chunk_interval=0.01)
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={'poll_interval': 0.05}, name="mock-runpod", daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class CountingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def request(self, method, url, *args, **kwargs):
+        self.requests.append((method, url.rsplit('/', 1)[-1]))
+        return super().request(method, url, *args, **kwargs)
+
+
+def client_for(port, **kwargs):
+    kwargs.setdefault('backoff_base', 0.001)
+    kwargs.setdefault('backoff_max', 0.001)
+    return RunPodClient(
+        f"http://127.0.0.1:{port}/v2/test/runsync", "test-key", session=CountingSession(), **kwargs
+    )
+
+
+@pytest.fixture
+def client(server):
+    client = client_for(server.server_address[1])
+    yield client
+    client.close()
+
+
+def fail_first(server, count):
+    """Answer the next count requests with a 503"""
+    remaining = [count]
+
+    def fail_request():
+        if remaining[0] <= 0:
+            return False
+        remaining[0] -= 1
+        server.backend.counters["http_errors"] += 1
+        return True
+
+    server.backend.fail_request = fail_request
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_synthesize(client, server):
+    output = client.synthesize(JOB)
+
+    assert output["audio"]
+    assert server.backend.counters["jobs"] == 1
+    assert client.session.requests == [("POST", "runsync")]
+
+
+def test_503s_are_retried(client, server):
+    fail_first(server, 2)
+
+    assert client.synthesize(JOB)["audio"]
+    assert server.backend.counters["jobs"] == 1
+    assert client.session.requests == [("POST", "runsync")] * 3
+    assert client.breaker.state == "closed"
+
+
+def test_retries_are_bounded(server):
+    client = client_for(server.server_address[1], max_retries=2)
+    fail_first(server, 10)
+
+    with pytest.raises(RunPodError, match="503"):
+        client.synthesize(JOB)
+    assert len(client.session.requests) == 3
+    assert server.backend.counters["jobs"] == 0
+
+
+def test_delivered_post_is_not_retried(client, server):
+    submit = server.backend.submit
+
+    def submit_then_drop(job_input):
+        submit(job_input)
+        raise RuntimeError("connection dropped after the job started")
+
+    server.backend.submit = submit_then_drop
+
+    with pytest.raises(RunPodError, match="connection failed"):
+        client.synthesize(JOB)
+    # Retrying would have started a duplicate job
+    assert server.backend.counters["jobs"] == 1
+    assert client.session.requests == [("POST", "runsync")]
+
+
+def test_refused_post_is_retried():
+    client = client_for(closed_port(), max_retries=2)
+
+    with pytest.raises(RunPodError, match="connection failed"):
+        client.synthesize(JOB)
+    assert client.session.requests == [("POST", "runsync")] * 3
+
+
+def test_never_sent():
+    with pytest.raises(requests.ConnectionError) as refused:
+        requests.post(f"http://127.0.0.1:{closed_port()}/v2/test/run")
+    assert _never_sent(refused.value)
+    assert _never_sent(requests.ConnectTimeout())
+    assert not _never_sent(requests.ConnectionError("Connection aborted."))
+
+
+def test_breaker_opens_and_recovers_through_a_trial(server):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    client = client_for(server.server_address[1], max_retries=0, breaker=breaker)
+    fail_first(server, 2)
+
+    for _ in range(2):
+        with pytest.raises(RunPodError, match="503"):
+            client.synthesize(JOB)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        client.synthesize(JOB)
+    assert len(client.session.requests) == 2
+
+    time.sleep(0.25)
+    assert breaker.state == "half-open"
+    assert client.synthesize(JOB)["audio"]
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_breaker(server):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    client = client_for(server.server_address[1], max_retries=0, breaker=breaker)
+    fail_first(server, 2)
+
+    with pytest.raises(RunPodError):
+        client.synthesize(JOB)
+    time.sleep(0.25)
+    with pytest.raises(RunPodError, match="503"):
+        client.synthesize(JOB)
+    assert breaker.state == "open"
+
+    time.sleep(0.25)
+    assert client.synthesize(JOB)["audio"]
+    assert breaker.state == "closed"
+
+
+def test_interrupted_trial_lets_the_next_one_through(server):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    client = client_for(server.server_address[1], max_retries=0, breaker=breaker)
+    fail_first(server, 1)
+    with pytest.raises(RunPodError):
+        client.synthesize(JOB)
+    time.sleep(0.25)
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    request = client.session.request
+    client.session.request = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        client.synthesize(JOB)
+
+    # Neither a success nor a failure: the circuit stays half-open
+    client.session.request = request
+    assert breaker.state == "half-open"
+    assert client.synthesize(JOB)["audio"]
+    assert breaker.state == "closed"
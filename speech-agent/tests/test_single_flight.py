@@ -0,0 +1,211 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import AsyncSingleFlight, SingleFlight
+
+CHUNKS = [b'one ', b'two ', b'three']
+AUDIO = b''.join(CHUNKS)
+
+
+class Producer:
+    """Streams CHUNKS once the gate opens, then publishes them to the cache"""
+
+    def __init__(self):
+        self.cache = {}
+        self.runs = 0
+        self.gate = threading.Event()
+
+    def lookup(self):
+        return self.cache.get('k')
+
+    def produce(self):
+        self.runs += 1
+        for chunk in CHUNKS:
+            self.gate.wait(5)
+            yield chunk
+        self.cache['k'] = AUDIO
+
+
+def burst(count, fn):
+    """Run fn on count threads at once; returns their results in order"""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def run(i):
+        barrier.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_stream_burst_produces_once():
+    flight = SingleFlight()
+    producer = Producer()
+    streams = burst(20, lambda: flight.stream('k', producer.produce, producer.lookup))
+    producer.gate.set()
+
+    assert [b''.join(stream) for stream in streams] == [AUDIO] * 20
+    assert producer.runs == 1
+    assert flight.stats() == {'leaders': 1, 'followers': 19, 'remote_waits': 0, 'in_flight': 0}
+
+
+def test_stream_after_a_finished_flight_is_served_from_the_cache():
+    # Requests of a burst that arrive once the first flight has ended
+    # lead a flight of their own; it must not synthesize again
+    flight = SingleFlight()
+    producer = Producer()
+    producer.gate.set()
+    assert b''.join(flight.stream('k', producer.produce, producer.lookup)) == AUDIO
+
+    late = burst(10, lambda: b''.join(flight.stream('k', producer.produce, producer.lookup)))
+
+    assert late == [AUDIO] * 10
+    assert producer.runs == 1
+
+
+def test_failed_stream_fails_every_subscriber_and_is_retried():
+    flight = SingleFlight()
+    producer = Producer()
+
+    def failing():
+        producer.runs += 1
+        yield b'one '
+        producer.gate.wait(5)
+        raise RuntimeError("synthesis failed")
+
+    streams = burst(5, lambda: flight.stream('k', failing, producer.lookup))
+    producer.gate.set()
+    for stream in streams:
+        with pytest.raises(RuntimeError, match="synthesis failed"):
+            b''.join(stream)
+
+    assert b''.join(flight.stream('k', producer.produce, producer.lookup)) == AUDIO
+    assert producer.runs == 2
+
+
+def test_do_burst_runs_once_and_later_calls_use_the_lookup():
+    flight = SingleFlight()
+    producer = Producer()
+
+    def synthesize():
+        return b''.join(producer.produce())
+
+    def release_when_all_joined():
+        while flight.stats()['followers'] < 19:
+            time.sleep(0.01)
+        producer.gate.set()
+
+    threading.Thread(target=release_when_all_joined, daemon=True).start()
+    results = burst(20, lambda: flight.do('k', synthesize, producer.lookup))
+    results += [flight.do('k', synthesize, producer.lookup) for _ in range(3)]
+
+    assert set(results) == {AUDIO}
+    assert producer.runs == 1
+
+
+def test_async_stream_burst_produces_once():
+    flight = AsyncSingleFlight()
+    producer = Producer()
+    producer.gate.set()
+
+    async def lookup():
+        return producer.lookup()
+
+    async def produce():
+        for chunk in producer.produce():
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def collect():
+        return b''.join([chunk async for chunk in flight.stream('k', produce, lookup)])
+
+    async def main():
+        first = await asyncio.gather(*(collect() for _ in range(20)))
+        late = await asyncio.gather(*(collect() for _ in range(5)))
+        return first + late
+
+    assert asyncio.run(main()) == [AUDIO] * 25
+    assert producer.runs == 1
+
+
+def test_buffered_call_waits_for_a_stream_of_the_same_key():
+    flight = SingleFlight()
+    producer = Producer()
+    stream = flight.stream('k', producer.produce, producer.lookup)
+
+    results = []
+
+    def buffered():
+        results.append(flight.do('k', lambda: b''.join(producer.produce()), producer.lookup))
+
+    threads = [threading.Thread(target=buffered) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    # Let them reach the stream still held at the gate
+    time.sleep(0.05)
+    producer.gate.set()
+
+    assert b''.join(stream) == AUDIO
+    for thread in threads:
+        thread.join(5)
+    assert results == [AUDIO] * 3
+    assert producer.runs == 1
+
+
+def test_stream_waits_for_a_buffered_call_of_the_same_key():
+    flight = SingleFlight()
+    producer = Producer()
+
+    def synthesize():
+        return b''.join(producer.produce())
+
+    buffered = threading.Thread(target=flight.do, args=('k', synthesize, producer.lookup))
+    buffered.start()
+    while flight.stats()['in_flight'] == 0:
+        time.sleep(0.01)
+    streams = burst(3, lambda: flight.stream('k', producer.produce, producer.lookup))
+    producer.gate.set()
+
+    assert [b''.join(stream) for stream in streams] == [AUDIO] * 3
+    buffered.join(5)
+    assert producer.runs == 1
+
+
+def test_async_mixed_stream_and_buffered_calls_produce_once():
+    flight = AsyncSingleFlight()
+    producer = Producer()
+    producer.gate.set()
+
+    async def lookup():
+        return producer.lookup()
+
+    async def produce():
+        for chunk in producer.produce():
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def synthesize():
+        return b''.join([chunk async for chunk in produce()])
+
+    async def collect():
+        return b''.join([chunk async for chunk in flight.stream('k', produce, lookup)])
+
+    async def main():
+        # Buffered first, then the reverse order
+        first = await asyncio.gather(
+            flight.do('k', synthesize, lookup), collect(), flight.do('k', synthesize, lookup)
+        )
+        producer.cache.clear()
+        second = await asyncio.gather(collect(), flight.do('k', synthesize, lookup), collect())
+        return first + second
+
+    assert asyncio.run(main()) == [AUDIO] * 6
+    assert producer.runs == 2
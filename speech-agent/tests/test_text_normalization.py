@@ -0,0 +1,27 @@
+import filecmp
+from pathlib import Path
+
+from segmentation import normalize_text, segment_cache_key
+
+ROOT = Path(__file__).resolve().parents[2]
+WORKER_COPY = ROOT / 'runpod-tts-service' / 'text_normalization.py'
+AGENT_COPY = ROOT / 'speech-agent' / 'text_normalization.py'
+
+
+def test_agent_and_worker_copies_are_identical():
+    # Cache keys only match the worker's audio while both run the same rules
+    assert filecmp.cmp(AGENT_COPY, WORKER_COPY, shallow=False), \
+        f"{AGENT_COPY} differs from {WORKER_COPY}; copy one over the other"
+
+
+def test_local_phone_number_is_read_as_digits():
+    assert normalize_text("Call 555-1234 today.") == "Call five five five, one two three four today."
+
+
+def test_versus_keeps_the_sentence_going():
+    assert normalize_text("A vs. B is close.") == "A versus B is close."
+
+
+def test_spelled_out_text_shares_the_cache_key():
+    assert segment_cache_key("Dr. Smith paid $12.50.", 'default', 'm') == \
+        segment_cache_key("Doctor Smith paid twelve dollars and fifty cents.", 'default', 'm')
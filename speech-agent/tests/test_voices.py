@@ -0,0 +1,47 @@
+import pytest
+
+from voices import Voice, parse_voice
+
+DEFAULT = Voice('default', 'base')
+VOICES = ['default', 'calm']
+MODELS = ['base', 'large']
+
+
+def test_default_voice_leaves_the_worker_defaults():
+    voice = parse_voice({}, DEFAULT, VOICES, MODELS)
+
+    assert voice == DEFAULT
+    assert voice.job_input(DEFAULT) == {}
+
+
+def test_other_voice_names_the_model_of_its_key():
+    # The worker would otherwise render with the preset's own model
+    voice = parse_voice({'voice': 'calm', 'model': 'base'}, DEFAULT, VOICES, MODELS)
+
+    assert voice.job_input(DEFAULT) == {'voice': 'calm', 'model': 'base'}
+    assert parse_voice({'voice': 'calm'}, DEFAULT, VOICES, MODELS).job_input(DEFAULT) == \
+        {'voice': 'calm', 'model': 'base'}
+
+
+def test_model_and_speed_of_the_default_voice():
+    voice = parse_voice({'model': 'large', 'speed': 1.25}, DEFAULT, VOICES, MODELS)
+
+    assert voice.job_input(DEFAULT) == {'model': 'large', 'speed': 1.25}
+    assert voice.cache_key('Hello.') != DEFAULT.cache_key('Hello.')
+
+
+def test_speed_is_part_of_the_key_only_when_given():
+    assert DEFAULT.key_name == 'default'
+    assert Voice('default', 'base', 1.5).key_name == 'default@1.5'
+
+
+@pytest.mark.parametrize('data', [
+    {'voice': 'loud'},
+    {'model': 'tiny'},
+    {'speed': 3},
+    {'speed': True},
+    {'speed': 'fast'}
+])
+def test_invalid_fields_are_rejected(data):
+    with pytest.raises(ValueError):
+        parse_voice(data, DEFAULT, VOICES, MODELS)
@@ -0,0 +1,360 @@
+"""
+Text normalization: the spoken form of numbers, dates, times, currency,
+abbreviations and URLs.
+
+The model reads text literally, so "Dr. Smith paid $12.50 on 3/15/2024"
+is turned into "Doctor Smith paid twelve dollars and fifty cents on March
+fifteenth, twenty twenty-four" before it is synthesized. The output keeps
+case and punctuation, contains no digits the rules understand, and is
+stable under a second pass, so it doubles as the canonical form of the
+text: inputs that differ only in how they write the same words are
+rendered, and cached, as one.
+
+runpod-tts-service/text_normalization.py and speech-agent/text_normalization.py
+are the same file: the worker speaks the normalized text and the web
+server keys its cache on it. Keep them identical (a test fails when they
+differ).
+"""
+import re
+from typing import Optional
+
+
+ONES = [
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
+    'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
+    'seventeen', 'eighteen', 'nineteen'
+]
+TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+SCALES = [(10 ** 12, 'trillion'), (10 ** 9, 'billion'), (10 ** 6, 'million'), (1000, 'thousand')]
+IRREGULAR_ORDINALS = {
+    'one': 'first', 'two': 'second', 'three': 'third', 'five': 'fifth',
+    'eight': 'eighth', 'nine': 'ninth', 'twelve': 'twelfth'
+}
+
+MONTHS = [
+    'January', 'February', 'March', 'April', 'May', 'June', 'July',
+    'August', 'September', 'October', 'November', 'December'
+]
+MONTH_NAMES = {month.lower(): i for i, month in enumerate(MONTHS, 1)}
+MONTH_NAMES.update({month[:3].lower(): i for i, month in enumerate(MONTHS, 1)})
+MONTH_NAMES['sept'] = 9
+MONTH_PATTERN = '|'.join(sorted((name.capitalize() for name in MONTH_NAMES), key=len, reverse=True))
+
+CURRENCIES = {
+    '$': ('dollar', 'dollars', 'cent', 'cents'),
+    '€': ('euro', 'euros', 'cent', 'cents'),
+    '£': ('pound', 'pounds', 'penny', 'pence')
+}
+UNITS = {
+    'km': ('kilometer', 'kilometers'), 'cm': ('centimeter', 'centimeters'),
+    'mm': ('millimeter', 'millimeters'), 'kg': ('kilogram', 'kilograms'),
+    'lb': ('pound', 'pounds'), 'lbs': ('pound', 'pounds'),
+    'mph': ('mile per hour', 'miles per hour'), 'kph': ('kilometer per hour', 'kilometers per hour'),
+    'ms': ('millisecond', 'milliseconds')
+}
+
+# Titles come before a name, so their period never ends a sentence
+TITLES = {
+    'Mr': 'Mister', 'Mrs': 'Missus', 'Ms': 'Miz', 'Dr': 'Doctor', 'Prof': 'Professor',
+    'Gen': 'General', 'Capt': 'Captain', 'Lt': 'Lieutenant', 'Sgt': 'Sergeant',
+    'Rev': 'Reverend', 'Hon': 'Honorable', 'Mt': 'Mount', 'Ft': 'Fort'
+}
+ABBREVIATIONS = {
+    'Jr': 'Junior', 'Sr': 'Senior', 'etc': 'et cetera',
+    'approx': 'approximately', 'Inc': 'Incorporated', 'Ltd': 'Limited',
+    'Corp': 'Corporation', 'Ave': 'Avenue', 'Blvd': 'Boulevard', 'Rd': 'Road',
+    'Dept': 'Department', 'dept': 'department'
+}
+
+# Words after which a bare four-digit number is read as a year
+YEAR_CONTEXT = re.compile(r'\b(?:in|since|by|until|from|during|year|of|before|after|circa)\s+$', re.IGNORECASE)
+
+URL = re.compile(r'\b(?:https?://|www\.)[^\s<>"]+[^\s<>".,;:!?)\]\'"]', re.IGNORECASE)
+EMAIL = re.compile(r'\b([\w.+-]+)@([\w-]+(?:\.[\w-]+)+)\b')
+PHONE = re.compile(r'(?<![\w-])(?:\+?1[-.\s])?\(?(\d{3})\)?[-.\s](\d{3})[-.\s](\d{4})\b')
+# Local numbers, which would otherwise read as a range
+LOCAL_PHONE = re.compile(r'(?<![\w.,-])(\d{3})-(\d{4})(?![\w-]|[.,]\d)')
+ISO_DATE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+NUMERIC_DATE = re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})\b')
+MONTH_DAY = re.compile(
+    rf'\b({MONTH_PATTERN})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}})\b)?'
+)
+DAY_MONTH = re.compile(
+    rf'\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({MONTH_PATTERN})\.?(?:,?\s+(\d{{4}})\b)?'
+)
+CLOCK_TIME = re.compile(r'\b(\d{1,2}):(\d{2})(?::\d{2})?(?:\s*([AaPp])\.?\s?[Mm]\b\.?)?')
+HOUR_TIME = re.compile(r'\b(\d{1,2})\s*([AaPp])\.?\s?[Mm]\b\.?')
+MERIDIEM = re.compile(r'\b([AaPp])\.\s?[Mm]\b\.?')
+CURRENCY = re.compile(
+    r'([$€£])\s?(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d{1,2}))?'
+    r'(?:\s?(thousand|million|billion|trillion)\b)?'
+)
+PERCENT = re.compile(r'(?<![\w.])(-?\d[\d,]*(?:\.\d+)?)\s?%')
+UNIT = re.compile(rf'(?<![\w.])(\d[\d,]*(?:\.\d+)?)\s?({"|".join(UNITS)})\b')
+ORDINAL = re.compile(r'\b(\d+)(st|nd|rd|th)\b', re.IGNORECASE)
+DECADE = re.compile(r"(?<![\w'])'?(\d{2})?(\d)0'?s\b")
+RANGE = re.compile(r'(?<![\w.,])(\d+)\s?[-–]\s?(\d+)(?![\w.,]\d)')
+NUMBER_SIGN = re.compile(r'(\bNo\.|#)\s?(?=\d)')
+NUMBER = re.compile(r'(?<![\w.,])(-?)(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?(?!\w)')
+TITLE = re.compile(rf'\b({"|".join(TITLES)})\.(?=\s)')
+# "vs." joins two things, so its period never ends a sentence either
+VERSUS = re.compile(r'\bvs\.?(?=\s)')
+ABBREVIATION = re.compile(rf'\b({"|".join(ABBREVIATIONS)})\.')
+SAINT_STREET = re.compile(r'\bSt\.(\s+[A-Z])?')
+LATIN = re.compile(r'\b(e\.g|i\.e)\.', re.IGNORECASE)
+AMPERSAND = re.compile(r'\s&\s')
+
+
+def cardinal(n: int) -> str:
+    """n in words: 1234 -> "one thousand two hundred thirty-four" """
+    if n < 0:
+        return f"minus {cardinal(-n)}"
+    if n >= 10 ** 15:
+        return digits(str(n))
+    if n == 0:
+        return 'zero'
+    words = []
+    for scale, name in SCALES:
+        if n >= scale:
+            words.append(f"{_under_thousand(n // scale)} {name}")
+            n %= scale
+    if n:
+        words.append(_under_thousand(n))
+    return ' '.join(words)
+
+
+def _under_thousand(n: int) -> str:
+    words = []
+    if n >= 100:
+        words.append(f"{ONES[n // 100]} hundred")
+        n %= 100
+    if n >= 20:
+        words.append(TENS[n // 10] + (f"-{ONES[n % 10]}" if n % 10 else ''))
+    elif n:
+        words.append(ONES[n])
+    return ' '.join(words)
+
+
+def ordinal(n: int) -> str:
+    """n as an ordinal in words: 22 -> "twenty-second" """
+    words = cardinal(n)
+    head, sep, last = words.rpartition(' ')
+    prefix, hyphen, last = last.rpartition('-')
+    if last in IRREGULAR_ORDINALS:
+        last = IRREGULAR_ORDINALS[last]
+    elif last.endswith('y'):
+        last = last[:-1] + 'ieth'
+    else:
+        last += 'th'
+    return f"{head}{sep}{prefix}{hyphen}{last}"
+
+
+def year(n: int) -> str:
+    """n read as a year: 1999 -> "nineteen ninety-nine", 2005 -> "two thousand five" """
+    if not 1000 <= n <= 2999 or n % 1000 == 0 or 2000 <= n < 2010:
+        return cardinal(n)
+    century, rest = divmod(n, 100)
+    if rest == 0:
+        return f"{cardinal(century)} hundred"
+    if rest < 10:
+        return f"{cardinal(century)} oh {cardinal(rest)}"
+    return f"{cardinal(century)} {cardinal(rest)}"
+
+
+def digits(text: str) -> str:
+    """Each digit in words: "0451" -> "zero four five one" """
+    return ' '.join(ONES[int(digit)] for digit in text if digit.isdigit())
+
+
+def decimal(whole: str, fraction: Optional[str] = None) -> str:
+    """A number as written (with thousands separators and fraction digits) in words"""
+    whole = whole.replace(',', '')
+    words = digits(whole) if len(whole) > 1 and whole.startswith('0') else cardinal(int(whole))
+    if fraction:
+        words += f" point {digits(fraction)}"
+    return words
+
+
+def _plural(words: str) -> str:
+    return words[:-1] + 'ies' if words.endswith('y') else words + 's'
+
+
+def _sentence_end(match: 're.Match') -> str:
+    """The period a match swallowed, when it also ended the sentence"""
+    if not match.group(0).endswith('.'):
+        return ''
+    rest = match.string[match.end():]
+    return '.' if not rest.strip() or re.match(r'\s+[A-Z]', rest) else ''
+
+
+def _date(month: int, day: int, year_text: Optional[str]) -> Optional[str]:
+    if not 1 <= month <= 12 or not 1 <= day <= 31:
+        return None
+    words = f"{MONTHS[month - 1]} {ordinal(day)}"
+    if year_text:
+        number = int(year_text)
+        if len(year_text) == 2:
+            number += 2000 if number < 50 else 1900
+        words += f", {year(number)}"
+    return words
+
+
+def _url(match: 're.Match') -> str:
+    text = re.sub(r'^https?://', '', match.group(0), flags=re.IGNORECASE)
+    text = text.rstrip('/')
+    for symbol, word in (('.', ' dot '), ('/', ' slash '), ('-', ' dash '), ('_', ' underscore '),
+                         ('?', ' question mark '), ('=', ' equals '), ('&', ' and '), ('#', ' hash ')):
+        text = text.replace(symbol, word)
+    if text.lower().startswith('www dot '):
+        text = 'w w w dot ' + text[8:]
+    return ' '.join(text.split())
+
+
+def _email(match: 're.Match') -> str:
+    user = match.group(1).replace('.', ' dot ').replace('_', ' underscore ').replace('-', ' dash ')
+    domain = match.group(2).replace('.', ' dot ').replace('-', ' dash ')
+    return ' '.join(f"{user} at {domain}".split())
+
+
+def _phone(match: 're.Match') -> str:
+    return ', '.join(digits(group) for group in match.groups())
+
+
+def _iso_date(match: 're.Match') -> str:
+    words = _date(int(match.group(2)), int(match.group(3)), match.group(1))
+    return words or match.group(0)
+
+
+def _numeric_date(match: 're.Match') -> str:
+    first, second = int(match.group(1)), int(match.group(2))
+    # Month first, unless that can't be a month
+    month, day = (second, first) if first > 12 else (first, second)
+    return _date(month, day, match.group(3)) or match.group(0)
+
+
+def _named_date(month_name: str, day: str, year_text: Optional[str], original: str) -> str:
+    words = _date(MONTH_NAMES[month_name.lower()], int(day), year_text)
+    return words or original
+
+
+def _clock_time(match: 're.Match') -> str:
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return match.group(0)
+    suffix = f" {match.group(3).lower()} m" if match.group(3) else ''
+    if minute == 0:
+        words = cardinal(hour) if suffix else f"{cardinal(hour)} o'clock" if hour <= 12 else f"{cardinal(hour)} hundred"
+    elif minute < 10:
+        words = f"{cardinal(hour)} oh {cardinal(minute)}"
+    else:
+        words = f"{cardinal(hour)} {cardinal(minute)}"
+    return words + suffix + (_sentence_end(match) if suffix else '')
+
+
+def _hour_time(match: 're.Match') -> str:
+    hour = int(match.group(1))
+    if not 1 <= hour <= 12:
+        return match.group(0)
+    return f"{cardinal(hour)} {match.group(2).lower()} m{_sentence_end(match)}"
+
+
+def _currency(match: 're.Match') -> str:
+    singular, plural, minor, minor_plural = CURRENCIES[match.group(1)]
+    whole, fraction, scale = match.group(2), match.group(3), match.group(4)
+    if scale:
+        return f"{decimal(whole, fraction)} {scale} {plural}"
+    amount = int(whole.replace(',', ''))
+    cents = int(fraction.ljust(2, '0')) if fraction else 0
+    parts = []
+    if amount or not cents:
+        parts.append(f"{decimal(whole)} {singular if amount == 1 else plural}")
+    if cents:
+        parts.append(f"{cardinal(cents)} {minor if cents == 1 else minor_plural}")
+    return ' and '.join(parts)
+
+
+def _percent(match: 're.Match') -> str:
+    number = match.group(1)
+    sign = 'minus ' if number.startswith('-') else ''
+    whole, _, fraction = number.lstrip('-').partition('.')
+    return f"{sign}{decimal(whole, fraction)} percent"
+
+
+def _unit(match: 're.Match') -> str:
+    whole, _, fraction = match.group(1).partition('.')
+    singular, plural = UNITS[match.group(2)]
+    one = whole == '1' and not fraction
+    return f"{decimal(whole, fraction)} {singular if one else plural}"
+
+
+def _decade(match: 're.Match') -> str:
+    decade = int(match.group(2)) * 10
+    if match.group(1):
+        return _plural(year(int(match.group(1)) * 100 + decade))
+    return _plural(cardinal(decade))
+
+
+def _range(match: 're.Match') -> str:
+    low, high = match.group(1), match.group(2)
+    if len(low) == len(high) == 4 and 1000 <= int(low) <= 2999 and 1000 <= int(high) <= 2999:
+        return f"{year(int(low))} to {year(int(high))}"
+    return f"{decimal(low)} to {decimal(high)}"
+
+
+def _number(match: 're.Match') -> str:
+    sign, whole, fraction = match.groups()
+    fraction = fraction[1:] if fraction else None
+    if (not sign and not fraction and len(whole) == 4 and 1000 <= int(whole) <= 2999
+            and YEAR_CONTEXT.search(match.string[:match.start()])):
+        return year(int(whole))
+    return ('minus ' if sign else '') + decimal(whole, fraction)
+
+
+def _abbreviation(match: 're.Match') -> str:
+    return ABBREVIATIONS[match.group(1)] + _sentence_end(match)
+
+
+def _saint_street(match: 're.Match') -> str:
+    # After a name it's Street ("Main St."), before one Saint ("St. Louis")
+    after_name = re.search(r'[A-Z]\w*\s+$', match.string[:match.start()])
+    following = match.group(1)
+    if following and not after_name:
+        return 'Saint' + following
+    if following:
+        # "Main St. He ..." also ended the sentence
+        return 'Street.' + following
+    return 'Street' + _sentence_end(match)
+
+
+def _latin(match: 're.Match') -> str:
+    return 'for example' if match.group(1).lower() == 'e.g' else 'that is'
+
+
+def normalize_text(text: str) -> str:
+    """The spoken form of text; see the module docstring"""
+    text = URL.sub(_url, text)
+    text = EMAIL.sub(_email, text)
+    text = PHONE.sub(_phone, text)
+    text = LOCAL_PHONE.sub(_phone, text)
+    text = ISO_DATE.sub(_iso_date, text)
+    text = NUMERIC_DATE.sub(_numeric_date, text)
+    text = MONTH_DAY.sub(lambda m: _named_date(m.group(1), m.group(2), m.group(3), m.group(0)), text)
+    text = DAY_MONTH.sub(lambda m: _named_date(m.group(2), m.group(1), m.group(3), m.group(0)), text)
+    text = CLOCK_TIME.sub(_clock_time, text)
+    text = HOUR_TIME.sub(_hour_time, text)
+    text = MERIDIEM.sub(lambda m: f"{m.group(1).lower()} m{_sentence_end(m)}", text)
+    text = CURRENCY.sub(_currency, text)
+    text = PERCENT.sub(_percent, text)
+    text = UNIT.sub(_unit, text)
+    text = ORDINAL.sub(lambda m: ordinal(int(m.group(1))), text)
+    text = DECADE.sub(_decade, text)
+    text = RANGE.sub(_range, text)
+    text = NUMBER_SIGN.sub(lambda m: 'Number ' if m.group(1) == 'No.' else 'number ', text)
+    text = NUMBER.sub(_number, text)
+    text = TITLE.sub(lambda m: TITLES[m.group(1)], text)
+    text = VERSUS.sub('versus', text)
+    text = SAINT_STREET.sub(_saint_street, text)
+    text = ABBREVIATION.sub(_abbreviation, text)
+    text = LATIN.sub(_latin, text)
+    text = AMPERSAND.sub(' and ', text)
+    return ' '.join(text.split())
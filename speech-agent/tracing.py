@@ -0,0 +1,401 @@
+"""
+Request tracing for /tts.
+
+Each request gets a Trace, continuing the caller's W3C ``traceparent``
+when it sends one, with one span per stage: admission wait, cache
+lookups and writes, RunPod jobs, base64 decoding, encoding and the
+knowledge base write. The RunPod worker is sent the trace id in the job
+input and reports its own stage timings back (queue wait, synthesis,
+encoding), which become child spans of the RunPod span, laid back to
+back ending with it; RunPod's own queue time (delayTime) becomes a span
+attribute.
+
+The stages finished by the time the headers go out are summed into the
+response's ``Server-Timing`` header. When a request finishes, its trace
+is exported if it was slower than ``slow_seconds`` (those are also
+logged with their breakdown) or picked by ``sample_rate``. Export is in
+OTLP JSON, from a background thread: appended as one line per batch to a
+file (the format of the OpenTelemetry Collector's file exporter) and/or
+posted to an OTLP/HTTP collector.
+
+Spans are recorded on whatever thread does the work: the current trace
+lives in a context variable, which bind() carries into thread pools and
+Trace.stream() into response bodies produced after the view returned.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+# Traces per export batch, and seconds to wait for a batch to fill
+EXPORT_BATCH = 64
+EXPORT_INTERVAL = 1.0
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    """One timed stage of a trace"""
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any],
+                 start_ns: Optional[int] = None):
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class _NullSpan:
+    """Returned by span() outside a trace"""
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+# (trace, span new spans are children of)
+_current: contextvars.ContextVar = contextvars.ContextVar('tts_trace', default=None)
+
+
+class Trace:
+    """The spans of one request"""
+
+    def __init__(self, name: str, traceparent: Optional[str] = None, **attributes):
+        match = TRACEPARENT.match((traceparent or '').strip().lower())
+        self.trace_id = match.group(1) if match else _new_id(16)
+        self.root = Span(name, match.group(2) if match else None, attributes)
+        self.spans: List[Span] = [self.root]
+        self._lock = threading.Lock()
+
+    @property
+    def traceparent(self) -> str:
+        """This trace's W3C traceparent, with the root span as parent"""
+        return f"00-{self.trace_id}-{self.root.span_id}-01"
+
+    def add(self, name: str, parent: Optional[Span], attributes: Dict[str, Any],
+            start_ns: Optional[int] = None) -> Span:
+        span = Span(name, (parent or self.root).span_id, attributes, start_ns)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def attach(self, parent: Optional[Span] = None) -> contextvars.Token:
+        """Make this trace current; undo with detach()"""
+        return _current.set((self, parent or self.root))
+
+    def stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass a response body through with this trace current while each chunk is produced"""
+        iterator = iter(chunks)
+        try:
+            while True:
+                token = self.attach()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _current.reset(token)
+                yield chunk
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                token = self.attach()
+                try:
+                    close()
+                finally:
+                    _current.reset(token)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: finished stages summed by name, plus the total so far"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self.spans[1:]:
+                if span.end_ns is not None:
+                    name = re.sub(r'[^A-Za-z0-9_-]', '-', span.name)
+                    totals[name] = totals.get(name, 0.0) + span.seconds
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        entries.append(f"total;dur={self.root.seconds * 1000:.1f}")
+        return ', '.join(entries)
+
+    def breakdown(self) -> str:
+        """Finished stages and their milliseconds, in the order they started"""
+        with self._lock:
+            spans = sorted(self.spans[1:], key=lambda span: span.start_ns)
+        return ', '.join(f"{span.name}={span.seconds * 1000:.0f}ms" for span in spans if span.end_ns is not None)
+
+
+def current_trace() -> Optional[Trace]:
+    current = _current.get()
+    return current[0] if current else None
+
+
+def detach(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage as a child of the current span; does nothing outside a trace"""
+    current = _current.get()
+    if current is None:
+        yield _NULL_SPAN
+        return
+    trace, parent = current
+    child = trace.add(name, parent, attributes)
+    token = _current.set((trace, child))
+    try:
+        yield child
+    except GeneratorExit:
+        # The consumer stopped early; not an error
+        raise
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A generator's span, closed from another context
+            pass
+        child.end()
+
+
+def annotate(**attributes) -> None:
+    """Set attributes on the current span"""
+    current = _current.get()
+    if current is not None:
+        current[1].set(**attributes)
+
+
+def inject(job_input: Dict[str, Any]) -> Dict[str, Any]:
+    """job_input with the current trace id and span id, for the RunPod worker"""
+    current = _current.get()
+    if current is None:
+        return job_input
+    trace, parent = current
+    return dict(job_input, trace_id=trace.trace_id, parent_span_id=parent.span_id)
+
+
+def add_worker_stages(stages: Optional[Dict[str, float]], parent=None) -> None:
+    """
+    Record a worker's stage timings as children of parent (default: the
+    current span), back to back and ending now; the worker reports
+    durations only
+    """
+    current = _current.get()
+    if current is None or not stages:
+        return
+    trace = current[0]
+    parent = parent if isinstance(parent, Span) else current[1]
+    end_ns = time.time_ns()
+    start_ns = end_ns - int(sum(stages.values()) * 1e9)
+    for name, seconds in stages.items():
+        child = trace.add(f"worker-{name}", parent, {'worker': True}, start_ns)
+        start_ns += int(seconds * 1e9)
+        child.end(start_ns)
+
+
+def stream(chunks: Iterable[bytes]) -> Iterable[bytes]:
+    """chunks, produced with the current trace (if any) current"""
+    trace = current_trace()
+    return chunks if trace is None else trace.stream(chunks)
+
+
+def bind(fn: Callable) -> Callable:
+    """fn, running in the caller's trace on whichever thread calls it"""
+    current = _current.get()
+    if current is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        token = _current.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return bound
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def otlp_spans(trace: Trace) -> List[Dict[str, Any]]:
+    """A trace's spans as OTLP JSON"""
+    spans = []
+    for span in trace.spans:
+        item = {
+            'traceId': trace.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 2 if span is trace.root else 1,  # SERVER, INTERNAL
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns or span.start_ns),
+            'attributes': [_attribute(key, value) for key, value in span.attributes.items() if value is not None],
+            'status': {'code': 2, 'message': span.error} if span.error else {}
+        }
+        if span.parent_id:
+            item['parentSpanId'] = span.parent_id
+        spans.append(item)
+    return spans
+
+
+class OTLPExporter:
+    """Writes traces as OTLP JSON to a file and/or an OTLP/HTTP endpoint, from a background thread"""
+
+    def __init__(self, service_name: str, path: Optional[str] = None, endpoint: Optional[str] = None,
+                 timeout: float = 5.0, max_queue: int = 10000):
+        self.service_name = service_name
+        self.path = path
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._queue: "queue.Queue[Trace]" = queue.Queue(max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def export(self, trace: Trace) -> None:
+        """Queue a finished trace; dropped if the queue is full"""
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+            return
+        # Started lazily so workers forked after import get their own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Failed to export {len(batch)} traces: {e}")
+
+    def _write(self, batch: List[Trace]) -> None:
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{
+                'scope': {'name': 'speech-agent.tracing'},
+                'spans': [item for trace in batch for item in otlp_spans(trace)]
+            }]
+        }]}
+        data = json.dumps(body, separators=(',', ':'))
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(data + '\n')
+        if self.endpoint:
+            response = requests.post(
+                self.endpoint, data=data, timeout=self.timeout,
+                headers={'Content-Type': 'application/json'}
+            )
+            response.raise_for_status()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self._queue.qsize(),
+            'exported': self.exported,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+
+class Tracer:
+    """Starts traces and decides which finished ones are logged and exported"""
+
+    def __init__(self, enabled: bool = True, sample_rate: float = 0.0, slow_seconds: float = 2.0,
+                 exporter: Optional[OTLPExporter] = None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.exporter = exporter
+        self.slow = 0
+
+    def start(self, name: str, traceparent: Optional[str] = None, **attributes) -> Tuple[Optional[Trace], Optional[contextvars.Token]]:
+        """A new current trace and the token to detach it with; (None, None) if disabled"""
+        if not self.enabled:
+            return None, None
+        trace = Trace(name, traceparent, **attributes)
+        return trace, trace.attach()
+
+    def finish(self, trace: Optional[Trace], status: int) -> None:
+        """End a trace's root span; log and export it if it was slow or sampled"""
+        if trace is None or trace.root.end_ns is not None:
+            return
+        trace.root.set(**{'http.status_code': status})
+        trace.root.end()
+        slow = self.slow_seconds > 0 and trace.root.seconds >= self.slow_seconds
+        if slow:
+            self.slow += 1
+            logging.warning(
+                f"Slow {trace.root.name} request (trace {trace.trace_id}): "
+                f"{trace.root.seconds * 1000:.0f}ms: {trace.breakdown()}"
+            )
+        if self.exporter is not None and (slow or random.random() < self.sample_rate):
+            self.exporter.export(trace)
+
+    def headers(self, trace: Optional[Trace]) -> Dict[str, str]:
+        """Response headers naming the trace and its timing so far"""
+        if trace is None:
+            return {}
+        return {'Server-Timing': trace.server_timing(), 'traceparent': trace.traceparent}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'slow_seconds': self.slow_seconds,
+            'slow': self.slow,
+            'exporter': self.exporter.stats() if self.exporter else None
+        }
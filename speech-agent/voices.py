@@ -0,0 +1,67 @@
+"""
+Voices requests are rendered with.
+
+A request may pick one of the worker's voice presets (``voice``), the
+model to render it on (``model``) and a speaking rate (``speed``). All
+three change the audio, so all three are part of its cache keys; the
+default voice at its preset speed keeps the keys it always had. A preset
+on the worker may name its own model, which the agent doesn't know, so
+jobs for other voices always name the model their keys were made with.
+"""
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from segmentation import segment_cache_key
+
+MIN_SPEED = 0.5
+MAX_SPEED = 2.0
+
+
+class Voice(NamedTuple):
+    name: str
+    model: str
+    speed: Optional[float] = None  # None: the preset's speed
+
+    @property
+    def key_name(self) -> str:
+        """The voice part of cache keys"""
+        return self.name if self.speed is None else f"{self.name}@{self.speed:g}"
+
+    def cache_key(self, segment: str) -> str:
+        return segment_cache_key(segment, self.key_name, self.model)
+
+    def job_input(self, default: "Voice") -> Dict[str, Any]:
+        """
+        The RunPod job input fields selecting this voice. Fields equal to
+        the default are left out, so workers apply their own defaults,
+        except the model of another voice: without one the worker would
+        render with the preset's model rather than the one in the key.
+        """
+        fields = {}
+        if self.name != default.name:
+            fields['voice'] = self.name
+        if self.name != default.name or self.model != default.model:
+            fields['model'] = self.model
+        if self.speed is not None:
+            fields['speed'] = self.speed
+        return fields
+
+
+def parse_voice(data: Dict[str, Any], default: Voice, voices: Iterable[str], models: Iterable[str]) -> Voice:
+    """
+    The voice of a request from its voice, model and speed fields, each
+    falling back to the default's. Raises ValueError on invalid fields.
+    """
+    voices = list(voices)
+    models = list(models)
+    name = data.get('voice') or default.name
+    if name not in voices:
+        raise ValueError(f"voice must be one of: {', '.join(voices)}")
+    model = data.get('model') or default.model
+    if model not in models:
+        raise ValueError(f"model must be one of: {', '.join(models)}")
+    speed = data.get('speed')
+    if speed is not None:
+        if isinstance(speed, bool) or not isinstance(speed, (int, float)) or not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"speed must be a number from {MIN_SPEED} to {MAX_SPEED}")
+        speed = float(speed)
+    return Voice(name, model, speed)
@@ -0,0 +1,159 @@
+import struct
+from array import array
+from typing import NamedTuple, Tuple
+
+
+# Size placeholder used by streaming WAV headers (length unknown up front)
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+class WavParams(NamedTuple):
+    """PCM layout of a WAV stream"""
+    channels: int
+    sample_rate: int
+    sample_width: int
+
+
+def build_wav_header(params: WavParams, data_size: int = STREAMING_SIZE) -> bytes:
+    """Build a PCM WAV header, streaming-compatible by default"""
+    byte_rate = params.sample_rate * params.channels * params.sample_width
+    block_align = params.channels * params.sample_width
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack(
+            '<IHHIIHH', 16, 1, params.channels, params.sample_rate,
+            byte_rate, block_align, params.sample_width * 8
+        )
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+def _find_data_chunk(data: bytes) -> int:
+    """Return the offset of the 'data' chunk id, or -1 if not found"""
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        if chunk_id == b'data':
+            return offset
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        # Chunks are word aligned
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return -1
+
+
+def finalize_wav(data: bytes) -> bytes:
+    """
+    Rewrite the RIFF and data chunk sizes of a WAV blob so they match its
+    actual length. Streamed WAVs carry placeholder sizes, which some
+    players reject once the audio is served from cache.
+    """
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return data
+    data_offset = _find_data_chunk(data)
+    if data_offset < 0:
+        return data
+
+    data_size = len(data) - data_offset - 8
+    fixed = bytearray(data)
+    fixed[4:8] = struct.pack('<I', len(data) - 8)
+    fixed[data_offset + 4:data_offset + 8] = struct.pack('<I', data_size)
+    return bytes(fixed)
+
+
+def parse_wav(data: bytes) -> Tuple[WavParams, bytes]:
+    """Split a PCM WAV blob into its layout and raw sample data"""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("Not a WAV file")
+
+    params = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ':
+            channels, sample_rate = struct.unpack(
+                '<HI', data[offset + 10:offset + 16]
+            )
+            bits = struct.unpack('<H', data[offset + 22:offset + 24])[0]
+            params = WavParams(channels, sample_rate, bits // 8)
+        elif chunk_id == b'data':
+            if params is None:
+                raise ValueError("WAV data chunk precedes fmt chunk")
+            # Streamed WAVs carry a placeholder size; the data runs to EOF
+            end = len(data) if chunk_size == STREAMING_SIZE else offset + 8 + chunk_size
+            return params, data[offset + 8:end]
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+    raise ValueError("WAV file has no data chunk")
+
+
+def _crossfade(tail: bytes, head: bytes) -> bytes:
+    """Linearly crossfade two equal-length runs of 16-bit samples"""
+    out = array('h', tail)
+    incoming = array('h', head)
+    n = len(out)
+    for i in range(n):
+        weight = (i + 1) / (n + 1)
+        out[i] = int(out[i] * (1 - weight) + incoming[i] * weight)
+    return out.tobytes()
+
+
+class WavStitcher:
+    """
+    Concatenate WAV segments into one continuous stream, in order.
+
+    The first call to ``feed`` returns a streaming WAV header followed by
+    the segment's samples, so output can be relayed to the client as soon
+    as each segment arrives. With a crossfade, the tail of every segment is
+    held back until the next one arrives (or ``finish`` is called) and the
+    two are overlapped.
+    """
+
+    def __init__(self, crossfade_ms: int = 0):
+        self.crossfade_ms = crossfade_ms
+        self.params = None
+        self._tail = b''
+        self._fade_bytes = 0
+
+    def feed(self, wav: bytes) -> bytes:
+        """Add the next segment and return the bytes that can be emitted"""
+        params, pcm = parse_wav(wav)
+        out = b''
+        if self.params is None:
+            self.params = params
+            out = build_wav_header(params)
+            frame = params.channels * params.sample_width
+            if params.sample_width == 2 and self.crossfade_ms > 0:
+                frames = params.sample_rate * self.crossfade_ms // 1000
+                self._fade_bytes = frames * frame
+        elif params != self.params:
+            raise ValueError(
+                f"Segment format {params} does not match {self.params}"
+            )
+
+        fade = min(self._fade_bytes, len(self._tail), len(pcm))
+        if fade:
+            out += self._tail[:len(self._tail) - fade]
+            out += _crossfade(self._tail[-fade:], pcm[:fade])
+            pcm = pcm[fade:]
+        else:
+            out += self._tail
+
+        # Hold back the tail so it can be blended with the next segment
+        keep = min(self._fade_bytes, len(pcm))
+        self._tail = pcm[len(pcm) - keep:]
+        return out + pcm[:len(pcm) - keep]
+
+    def finish(self) -> bytes:
+        """Flush any held-back samples"""
+        tail, self._tail = self._tail, b''
+        return tail
+
+
+def stitch_wavs(wavs, crossfade_ms: int = 0) -> bytes:
+    """Join WAV segments into a single WAV with correct header sizes"""
+    stitcher = WavStitcher(crossfade_ms)
+    parts = [stitcher.feed(wav) for wav in wavs]
+    parts.append(stitcher.finish())
+    return finalize_wav(b''.join(parts))